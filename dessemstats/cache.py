@@ -0,0 +1,234 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+from json import dumps, load, dump
+from hashlib import sha1
+import logging
+import os
+import pickle
+import shutil
+from datetime import date
+from time import time
+from urllib.parse import quote
+from dateutil.relativedelta import relativedelta
+
+CHECKPOINT_VERSION = 2
+
+
+def fingerprint(*items):
+    """ Retorna um hash estavel dos objetos informados (serializados em
+        JSON com chaves ordenadas), usado como versao de entradas de cache """
+    return sha1(dumps(items, sort_keys=True, default=str).encode(
+        'utf-8')).hexdigest()
+
+
+def load_versioned(filename, version):
+    """ Le um arquivo gravado por save_versioned (JSON, ou pickle para
+        arquivos '.pickle'). Retorna None caso o arquivo nao exista ou
+        tenha sido gravado com outra versao """
+    if not os.path.exists(filename):
+        return None
+    if filename.endswith('.pickle'):
+        with open(filename, 'rb') as handle:
+            entry = pickle.load(handle)
+    else:
+        with open(filename, 'r') as handle:
+            entry = load(handle)
+    if entry.get('version') != version:
+        return None
+    return entry['data']
+
+
+def save_versioned(filename, version, data):
+    """ Grava (de forma atomica) um arquivo identificado por versao, em
+        JSON ou, para arquivos '.pickle', em pickle """
+    tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+    if filename.endswith('.pickle'):
+        with open(tmp_filename, 'wb') as handle:
+            pickle.dump({'version': version, 'data': data}, handle,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+    else:
+        with open(tmp_filename, 'w') as handle:
+            dump({'version': version, 'data': data}, handle)
+    os.replace(tmp_filename, filename)
+
+
+def extract(store, names, metrics, first_day, last_day):
+    """ Extrai de um dicionario no formato store[nome][dia][metrica] as
+        series 'metrics' dos nomes 'names' entre first_day e last_day """
+    data = dict()
+    for name in names:
+        for cur_day, day_data in store.get(name, dict()).items():
+            if cur_day < first_day or cur_day > last_day:
+                continue
+            for metric in metrics:
+                if metric not in day_data:
+                    continue
+                data.setdefault(name, dict()).setdefault(
+                    cur_day, dict())[metric] = dict(day_data[metric])
+    return data
+
+
+def merge(store, data):
+    """ Incorpora ao dicionario store[nome][dia][metrica] os pontos de
+        'data' (no mesmo formato), preservando os pontos ja existentes.
+        Armazenamentos colunares (com 'add_points') recebem os pontos
+        diretamente, ja que neles prevalece o primeiro valor recebido """
+    if hasattr(store, 'add_points'):
+        for name, name_data in data.items():
+            for day_data in name_data.values():
+                for metric, points in day_data.items():
+                    store.add_points(name, metric, list(points),
+                                     list(points.values()))
+        return
+    for name, name_data in data.items():
+        store_name = store.setdefault(name, dict())
+        for cur_day, day_data in name_data.items():
+            store_day = store_name.setdefault(cur_day, dict())
+            for metric, points in day_data.items():
+                store_points = store_day.setdefault(metric, dict())
+                for tstamp, value in points.items():
+                    if tstamp not in store_points:
+                        store_points[tstamp] = value
+
+
+class MonthCache(object):
+    """ Cache local de series por mes. Meses encerrados (anteriores ao mes
+        passado) sao imutaveis: uma vez gravados apos o seu encerramento,
+        sao mantidos indefinidamente. O mes corrente e o anterior ainda
+        recebem dados e sao revalidados apos 'ttl' segundos """
+
+    def __init__(self, folder, ttl=3600):
+        self.folder = folder
+        self.ttl = ttl
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    @staticmethod
+    def is_closed(month, today=None):
+        """ Verifica se o mes (qualquer data do mes) ja esta encerrado """
+        today = today or date.today()
+        first_open = today.replace(day=1) - relativedelta(months=1)
+        return month.replace(day=1) < first_open
+
+    def __filename(self, month, key):
+        """ Retorna o arquivo de uma entrada do cache """
+        return '%s/%s/%s.pickle' % (self.folder, month.strftime('%Y_%m'),
+                                    key.replace('/', '_'))
+
+    def load(self, month, key):
+        """ Retorna os dados armazenados para (mes, chave) se ainda forem
+            validos, ou None caso precisem ser consultados novamente """
+        filename = self.__filename(month, key)
+        if not os.path.exists(filename):
+            return None
+        with open(filename, 'rb') as handle:
+            entry = pickle.load(handle)
+        if entry['final']:
+            return entry['data']
+        if self.is_closed(month):
+            # gravado antes do encerramento do mes: consulta final
+            return None
+        if time() - entry['fetched'] > self.ttl:
+            return None
+        return entry['data']
+
+    def save(self, month, key, data):
+        """ Grava (de forma atomica) os dados de (mes, chave) """
+        filename = self.__filename(month, key)
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+        entry = {'final': self.is_closed(month),
+                 'fetched': time(),
+                 'data': data}
+        tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+        with open(tmp_filename, 'wb') as handle:
+            pickle.dump(entry, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, filename)
+        logging.debug('Cached %s (%s): %s', key, month.strftime('%m/%Y'),
+                      'immutable' if entry['final'] else 'revalidate')
+
+    def discard(self, month, key):
+        """ Remove a entrada de (mes, chave), caso exista, e a pasta do mes
+            caso fique vazia """
+        filename = self.__filename(month, key)
+        if not os.path.exists(filename):
+            return
+        os.remove(filename)
+        try:
+            os.rmdir(os.path.dirname(filename))
+        except OSError:
+            # outras entradas do mes
+            pass
+
+
+class Checkpoint(object):
+    """ Registro das unidades de consulta de uma execucao. Cada unidade eh
+        gravada (de forma atomica) assim que termina, com a situacao 'done'
+        (concluida com dados), 'empty' (concluida sem dados) ou 'failed'
+        (alguma consulta falhou). Uma execucao interrompida ou com falhas
+        pode ser retomada ('resume') consultando novamente apenas as
+        unidades que falharam ou nao terminaram. Sem 'resume', o registro
+        de uma execucao anterior eh descartado """
+
+    def __init__(self, folder, resume=False):
+        self.folder = folder
+        if not resume:
+            self.clear()
+        os.makedirs(folder, exist_ok=True)
+        failed = self.failed() if resume else list()
+        if failed:
+            logging.info('Resuming run: %d failed units will be queried '
+                         'again', len(failed))
+
+    def __filename(self, month, key):
+        """ Retorna o arquivo de uma unidade """
+        return '%s/%s_%s.pickle' % (self.folder, month.strftime('%Y_%m'),
+                                    quote(key, safe=''))
+
+    def status(self, month, key):
+        """ Retorna a situacao da unidade (mes, chave) ('done', 'empty' ou
+            'failed'), ou None caso ela nao tenha terminado """
+        entry = load_versioned(self.__filename(month, key),
+                               CHECKPOINT_VERSION)
+        return entry['status'] if entry else None
+
+    def load(self, month, key):
+        """ Retorna os dados da unidade (mes, chave), ou None caso ela nao
+            tenha sido concluida com sucesso """
+        entry = load_versioned(self.__filename(month, key),
+                               CHECKPOINT_VERSION)
+        if not entry or entry['status'] == 'failed':
+            return None
+        return entry['data']
+
+    def save(self, month, key, data):
+        """ Registra a conclusao com sucesso da unidade (mes, chave), com
+            ou sem dados """
+        save_versioned(self.__filename(month, key), CHECKPOINT_VERSION,
+                       {'status': 'done' if data else 'empty', 'data': data})
+
+    def fail(self, month, key):
+        """ Registra a falha da unidade (mes, chave) """
+        save_versioned(self.__filename(month, key), CHECKPOINT_VERSION,
+                       {'status': 'failed', 'data': None})
+
+    def failed(self):
+        """ Retorna os arquivos das unidades que falharam """
+        failed = list()
+        for filename in sorted(os.listdir(self.folder)):
+            if not filename.endswith('.pickle'):
+                continue
+            entry = load_versioned('%s/%s' % (self.folder, filename),
+                                   CHECKPOINT_VERSION)
+            if entry and entry['status'] == 'failed':
+                failed.append(filename)
+        return failed
+
+    def clear(self):
+        """ Descarta o registro (ex.: apos gravar os resultados) """
+        shutil.rmtree(self.folder, ignore_errors=True)
@@ -0,0 +1,182 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+from json import dumps
+import logging
+import sqlite3
+from threading import Lock
+from time import time
+
+VERIFIED_GEN_PATTERN = 'ts_ons_geracao_horaria_verificada_*'
+
+
+def dessem_prefix(deck_provider, cur_date_str):
+    """ Retorna o prefixo comum das series do DESSEM de um dia operativo """
+    return '%s_%s_%s' % (
+        'ts_' + deck_provider + '_dessem_completo',
+        cur_date_str.replace('-', '_'),
+        'com_rede_pdo_operacao_interval')
+
+
+class TimeseriesCatalog(object):
+    """ Catalogo persistente (SQLite) nome -> tsid. Guarda as listagens
+        por padrao coringa e tambem as consultas sem resultado (negativas),
+        ambas com validade limitada por 'ttl' (em segundos) """
+
+    def __init__(self, filename, ttl=86400):
+        self.ttl = ttl
+        self.lock = Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS patterns ('
+                            'pattern TEXT PRIMARY KEY, updated REAL)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS series ('
+                            'name TEXT PRIMARY KEY, pattern TEXT, '
+                            'tsid TEXT, updated REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS series_pattern '
+                            'ON series (pattern)')
+
+    def get_pattern(self, pattern):
+        """ Retorna {nome: tsid} de um padrao listado ha menos de 'ttl'
+            segundos, ou None caso o padrao nao esteja no catalogo """
+        with self.lock:
+            row = self.db.execute(
+                'SELECT updated FROM patterns WHERE pattern = ?',
+                (pattern,)).fetchone()
+            if not row or time() - row[0] > self.ttl:
+                return None
+            rows = self.db.execute(
+                'SELECT name, tsid FROM series '
+                'WHERE pattern = ? AND tsid IS NOT NULL',
+                (pattern,)).fetchall()
+        return dict(rows)
+
+    def put_pattern(self, pattern, tseries):
+        """ Substitui a listagem armazenada de um padrao """
+        now = time()
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM series WHERE pattern = ?',
+                            (pattern,))
+            self.db.executemany(
+                'INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?)',
+                [(tsobj['name'], pattern, tsobj['tsid'], now)
+                 for tsobj in tseries])
+            self.db.execute('INSERT OR REPLACE INTO patterns VALUES (?, ?)',
+                            (pattern, now))
+
+    def is_missing(self, name):
+        """ Verifica se ha uma consulta negativa valida para o nome """
+        with self.lock:
+            row = self.db.execute(
+                'SELECT updated FROM series '
+                'WHERE name = ? AND tsid IS NULL',
+                (name,)).fetchone()
+        return bool(row) and time() - row[0] <= self.ttl
+
+    def put_name(self, name, pattern, tsid=None):
+        """ Registra o resultado de uma consulta individual (tsid None
+            indica que a serie nao existe) """
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?)',
+                (name, pattern, tsid, time()))
+
+    def invalidate(self, name=None, pattern=None):
+        """ Remove um nome e/ou a listagem de um padrao do catalogo """
+        with self.lock, self.db:
+            if name:
+                self.db.execute('DELETE FROM series WHERE name = ?',
+                                (name,))
+            if pattern:
+                self.db.execute('DELETE FROM patterns WHERE pattern = ?',
+                                (pattern,))
+
+
+class TimeseriesIndex(object):
+    """ Indice local nome -> serie temporal. Cada padrao coringa (ex.:
+        'ts_ons_geracao_horaria_verificada_*') eh listado no Miran uma
+        unica vez por execucao, de modo que as verificacoes de existencia
+        e a obtencao dos tsids passam a ser consultas a um dicionario.
+        Com um 'catalog', listagens e consultas negativas recentes de
+        execucoes anteriores sao reaproveitadas sem acesso a rede """
+
+    def __init__(self, con, catalog=None):
+        self.con = con
+        self.catalog = catalog
+        self.series = dict()
+        self.loaded = dict()
+        self.invalid = set()
+        self.lock = Lock()
+
+    def __pattern_lock(self, pattern):
+        """ Retorna o estado de carregamento de um padrao """
+        with self.lock:
+            if pattern not in self.loaded:
+                self.loaded[pattern] = [Lock(), False, False]
+            return self.loaded[pattern]
+
+    def load(self, pattern):
+        """ Lista todas as series que casam com o padrao, a partir do
+            catalogo local quando possivel e do Miran caso contrario """
+        entry = self.__pattern_lock(pattern)
+        with entry[0]:
+            if entry[1]:
+                return
+            cached = self.catalog.get_pattern(pattern)\
+                if self.catalog else None
+            if cached is not None:
+                tseries = [{'name': name, 'tsid': tsid}
+                           for name, tsid in cached.items()]
+                entry[2] = True
+            else:
+                tseries = self.con.get_timeseries(
+                    params={'name': pattern}) or list()
+                if self.catalog:
+                    self.catalog.put_pattern(pattern, tseries)
+            with self.lock:
+                for tsobj in tseries:
+                    self.series[tsobj['name']] = tsobj
+            entry[1] = True
+            logging.debug('Indexed %d timeseries for pattern: %s (%s)',
+                          len(tseries), pattern,
+                          'catalog' if entry[2] else 'miran')
+
+    def get_timeseries(self, name, pattern):
+        """ Equivalente local de con.get_timeseries(params={'name': name}),
+            onde 'pattern' eh o padrao coringa que contem 'name' """
+        self.load(pattern)
+        if name in self.series:
+            return [self.series[name]]
+        if not self.catalog:
+            return list()
+        if not self.loaded[pattern][2] and name not in self.invalid:
+            # listagem recem obtida do Miran: a ausencia eh definitiva
+            self.catalog.put_name(name, pattern)
+            return list()
+        if self.catalog.is_missing(name):
+            return list()
+        # falha em uma listagem do catalogo: a listagem pode estar
+        # desatualizada, entao a serie eh consultada individualmente
+        tseries = self.con.get_timeseries(params={'name': name})
+        if not tseries:
+            self.catalog.put_name(name, pattern)
+            return list()
+        self.catalog.put_name(name, pattern, tseries[0]['tsid'])
+        with self.lock:
+            self.series[name] = tseries[0]
+        return [tseries[0]]
+
+    def invalidate(self, name):
+        """ Descarta um tsid que se mostrou invalido (ex.: a consulta de
+            pontos falhou), forcando nova resolucao na proxima consulta """
+        with self.lock:
+            tsobj = self.series.pop(name, None)
+            self.invalid.add(name)
+        if self.catalog:
+            self.catalog.invalidate(name=name)
+        logging.debug('Invalidated timeseries: %s (%s)', name,
+                      dumps(tsobj))
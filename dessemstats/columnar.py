@@ -0,0 +1,193 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+from urllib.parse import quote
+import logging
+import os
+import numpy as np
+from dessemstats.localtime import LOCAL_TABLE, LOCAL_TIMEZONE
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    # exportacao em Parquet opcional
+    pa = pc = pq = None
+
+PARQUET_COMPRESSION = 'zstd'
+
+
+def require_pyarrow():
+    """ Verifica se o pyarrow esta disponivel (params['output_parquet']) """
+    assert pa is not None, 'output_parquet requires the pyarrow package'
+
+
+def partition(folder, keys):
+    """ Retorna a pasta de uma particao no formato hive
+        (<folder>/<chave>=<valor>/...) para a lista [(chave, valor)] """
+    return '/'.join([folder] + ['%s=%s' % (key, quote(str(value), safe=''))
+                                for key, value in keys])
+
+
+def merge_table(filename, table, key, order):
+    """ Une 'table' as linhas do arquivo Parquet existente 'filename' cuja
+        coluna 'key' nao aparece em 'table' (execucoes anteriores de outros
+        periodos sao preservadas). As colunas ausentes em uma das tabelas
+        sao nulas e as linhas sao ordenadas pelas colunas 'order' """
+    if not os.path.exists(filename):
+        return table
+    old = pq.read_table(filename)
+    old = old.filter(pc.invert(pc.is_in(
+        old.column(key), value_set=table.column(key).combine_chunks())))
+    names = table.column_names + [name for name in old.column_names
+                                  if name not in table.column_names]
+    tables = list()
+    for cur, other in [(table, old), (old, table)]:
+        for name in names:
+            if name not in cur.column_names:
+                cur = cur.append_column(other.schema.field(name), pa.nulls(
+                    len(cur), type=other.schema.field(name).type))
+        tables.append(cur.select(names))
+    return pa.concat_tables(tables).sort_by(
+        [(name, 'ascending') for name in order])
+
+
+def write_table(filename, columns, compression=PARQUET_COMPRESSION,
+                key=None, order=None):
+    """ Grava (de forma atomica) um arquivo Parquet com as colunas
+        [(nome, valores)], onde 'valores' sao arrays pyarrow. Com 'key',
+        o arquivo existente eh atualizado (ver merge_table) """
+    require_pyarrow()
+    table = pa.table(dict(columns))
+    if key is not None:
+        table = merge_table(filename, table, key, order or [key])
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+    pq.write_table(table, tmp_filename, compression=compression)
+    os.replace(tmp_filename, filename)
+    logging.info('Finished outputting data into parquet file: %s', filename)
+
+
+def timestamps(tstamps):
+    """ Retorna a coluna de instantes (timestamps em ms, fuso local) """
+    return pa.array(np.asarray(tstamps, dtype=np.int64),
+                    type=pa.timestamp('ms', tz=LOCAL_TIMEZONE.zone))
+
+
+def floats(values, missing=None):
+    """ Retorna uma coluna float64, nula onde 'missing' for True """
+    return pa.array(np.asarray(values, dtype=np.float64), mask=missing,
+                    type=pa.float64())
+
+
+def join_series(series):
+    """ Une as series {nome: (timestamps, valores)} sobre a uniao dos
+        timestamps. Retorna (timestamps, [(nome, coluna)]) com valores
+        nulos onde a serie nao possui o ponto """
+    index = np.unique(np.concatenate(
+        [np.asarray(tstamps, dtype=np.int64)
+         for tstamps, _ in series.values()] + [np.empty(0, np.int64)]))
+    columns = list()
+    for name, (tstamps, values) in series.items():
+        column = np.zeros(len(index))
+        missing = np.ones(len(index), dtype=bool)
+        positions = np.searchsorted(index, tstamps)
+        column[positions] = values
+        missing[positions] = False
+        columns.append((name, floats(column, missing)))
+    return index, columns
+
+
+def export_series(folder, keys, series, compression=PARQUET_COMPRESSION):
+    """ Grava as series {nome: (timestamps, valores)} de uma planta (ou do
+        CMO), identificada pelas chaves de particao 'keys', em uma coluna
+        por serie, com um arquivo por ano (local). Os instantes ja gravados
+        fora de 'series' sao mantidos """
+    require_pyarrow()
+    index, columns = join_series(series)
+    years = LOCAL_TABLE.local_seconds(index).astype(
+        'datetime64[s]').astype('datetime64[Y]').astype(np.int64) + 1970
+    for year in np.unique(years).tolist():
+        rows = np.flatnonzero(years == year)
+        write_table('%s/data.parquet' % partition(folder,
+                                                  keys + [('year', year)]),
+                    [('datetime', timestamps(index[rows]))] +
+                    [(name, column.take(rows)) for name, column in columns],
+                    compression, key='datetime')
+
+
+def export_indicators(folder, keys, indicators,
+                      compression=PARQUET_COMPRESSION):
+    """ Grava os indicadores diarios {dia: {indicador: valor}} de uma
+        planta em uma coluna por indicador. Dias sem indicadores sao
+        omitidos e os dias ja gravados fora de 'indicators' sao mantidos """
+    require_pyarrow()
+    days = sorted(day for day in indicators if indicators[day])
+    if not days:
+        return
+    names = sorted(set(name for day in days for name in indicators[day]))
+    columns = [('date', pa.array(days, type=pa.date32()))]
+    for name in names:
+        values = [indicators[day].get(name, '') for day in days]
+        columns.append((name, pa.array(
+            [None if value == '' else value for value in values],
+            type=pa.float64())))
+    write_table('%s/data.parquet' % partition(folder, keys), columns,
+                compression, key='date')
+
+
+def export_deck_series(folder, keys, plant_data, series_names,
+                       compression=PARQUET_COMPRESSION):
+    """ Grava as series de cada deck diario {dia: {serie: {timestamp:
+        valor}}} de uma planta (timestamps do DESSEM, em segundos), com a
+        coluna 'deck' (dia do deck) e um arquivo por ano do deck. Os decks
+        ja gravados fora de 'plant_data' sao mantidos """
+    require_pyarrow()
+    by_year = dict()
+    for day in sorted(plant_data):
+        by_year.setdefault(day.year, list()).append(day)
+    for year, days in by_year.items():
+        decks = list()
+        index = list()
+        columns = dict((name, list()) for name in series_names)
+        for day in days:
+            day_series = dict(
+                (name, (np.fromiter(plant_data[day].get(name, dict()),
+                                    dtype=np.int64) * 1000,
+                        list(plant_data[day].get(name, dict()).values())))
+                for name in series_names)
+            day_index, day_columns = join_series(day_series)
+            decks.extend([day] * len(day_index))
+            index.append(day_index)
+            for name, column in day_columns:
+                columns[name].append(column)
+        if not decks:
+            continue
+        write_table('%s/data.parquet' % partition(folder,
+                                                  keys + [('year', year)]),
+                    [('deck', pa.array(decks, type=pa.date32())),
+                     ('datetime', timestamps(np.concatenate(index)))] +
+                    [(name, pa.concat_arrays(columns[name]))
+                     for name in series_names],
+                    compression, key='deck', order=['deck', 'datetime'])
+
+
+def export_timeseries(folder, data, dtimes, ts_names,
+                      compression=PARQUET_COMPRESSION):
+    """ Grava um conjunto {instante: {serie: valor}} ja consultado (ver
+        interface.write_timeseries), com valores '' como nulos, em uma
+        coluna por serie e um arquivo por ano (ver export_series). Os
+        instantes de outros periodos ja gravados sao mantidos """
+    series = dict()
+    for ts_name in ts_names:
+        points = [(dtime, data[dtime][ts_name]) for dtime in dtimes
+                  if data[dtime].get(ts_name, '') != '']
+        series[ts_name] = ([int(dtime.timestamp() * 1000)
+                            for dtime, _ in points],
+                           [value for _, value in points])
+    export_series(folder, list(), series, compression)
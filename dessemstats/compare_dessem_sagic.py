@@ -6,24 +6,40 @@ Written by Marcos Leone Filho <marcos@venidera.com>
 """
 
 from json import loads, dumps
+import asyncio
+from contextlib import closing
 from datetime import datetime, date
+from functools import partial
 from time import mktime
 import logging
-import locale
-import statistics
-from math import sqrt, log
+from math import sqrt
 from os import path
-import pickle
-from joblib import Parallel, delayed
 import pytz
+import numpy as np
 from dateutil.relativedelta import relativedelta
 from dateutil.rrule import rrule, DAILY, MONTHLY
 from deckparser.dessem2dicts import load_dessem
 from vplantnaming.naming import name_to_id
+from dessemstats.catalog import dessem_prefix, VERIFIED_GEN_PATTERN
+from dessemstats.fetch import FetchEngine
+from dessemstats.cache import MonthCache, Checkpoint, extract, merge
+from dessemstats.cache import fingerprint, load_versioned, save_versioned
+from dessemstats.localtime import LOCAL_TABLE
+from dessemstats.csvwriter import CsvWriter, require_compression
+from dessemstats.columnar import require_pyarrow, export_series
+from dessemstats.columnar import export_indicators, export_deck_series
+from dessemstats.database import connect as connect_database
+from dessemstats.database import upsert_series, upsert_indicators
+from dessemstats.database import upsert_deck_series
+from dessemstats.store import CompareStore, missing_days
+from dessemstats.partitions import PartitionedStore, save_compare
+from dessemstats.partitions import load_compare, save_nested, load_nested
+from dessemstats.partitions import coverage_request, covered, add_coverage
+from dessemstats.kernels import compare_terms
+from dessemstats.parallel import map_compare_terms, map_outputs
 from dessemstats.interface import load_files, connect_miran, dump_to_csv
-from dessemstats.interface import write_pld_csv, write_load_gen_csv
-from dessemstats.interface import write_pld_xlsx, write_load_gen_xlsx
-from dessemstats.interface import write_interchange_csv, write_interchange_xlsx
+from dessemstats.interface import export_pld, export_load_gen
+from dessemstats.interface import export_interchange
 from dessemstats.interface import write_xlsx, write_cmo_xlsx
 
 LOCAL_TIMEZONE = pytz.timezone('America/Sao_Paulo')
@@ -43,52 +59,84 @@ logging.getLogger().addHandler(CONSOLE)
 
 GEN_TYPE = {'uhe': 'hidraulica',
             'ute': 'termica'}
-DADOS_COMPARE = dict()
+COMPARE_SERIES = ['programada', 'verificada', 'dessem']
+CMO_SERIES = ['s', 'se', 'ne', 'n']
+DESSEM_SERIES = ['dessem_gen', 'dessem_vol']
+# armazenamentos de resultados (particionados por planta e mes)
+COMPARE_RESULTS = 'compare_sagic'
+DESSEM_RESULTS = 'compare_sagic_ts_dessem'
+# versao das formulas dos indicadores (invalida os indicadores gravados)
+STATS_VERSION = 1
+# parametros repassados aos processos do estagio de saida
+OUTPUT_PARAMS = ['storage_folder', 'output_xls', 'output_csv',
+                 'csv_compression', 'output_parquet', 'output_database',
+                 'deck_provider', 'network', 'ini_date', 'end_date']
+DADOS_COMPARE = CompareStore()
 DADOS_DESSEM = dict()
 
-def __return_ts_points(cur_date_str, gen_type, dessem_name, params):
-    """ Retorna series de geracao e volume inicial para um gerador """
-    ts_gen = '%s_%s_%s_ger%s_%s_%s_%s' % (
-        'ts_' + params['deck_provider'] + '_dessem_completo',
-        cur_date_str.replace('-', '_'),
-        'com_rede_pdo_operacao_interval',
+async def __return_ts_points(cur_date_str, gen_type, dessem_name,
+                             params, engine):
+    """ Retorna series de geracao e volume inicial para um gerador, e se
+        a consulta teve sucesso. Series inexistentes no deck nao sao
+        falhas (a planta nao possui dados no dia), mas series existentes
+        sem pontos retornados sao """
+    prefix = dessem_prefix(params['deck_provider'], cur_date_str)
+    ts_gen = '%s_ger%s_%s_%s_%s' % (
+        prefix,
         gen_type[:4],
         dessem_name,
         'geracao',
         gen_type)
-    ts_vol = '%s_%s_%s_bal%s_%s_%s' % (
-        'ts_' + params['deck_provider'] + '_dessem_completo',
-        cur_date_str.replace('-', '_'),
-        'com_rede_pdo_operacao_interval',
+    ts_vol = '%s_bal%s_%s_%s' % (
+        prefix,
         gen_type[:4],
         dessem_name,
         'volini')
-    con = params['con']
-    gen_ts = con.get_timeseries(params={'name': ts_gen})
+    con = engine.con
+    ts_index = params['ts_index']
+    success = True
+    gen_ts = await engine.call(ts_index.get_timeseries, ts_gen, prefix + '_*')
     if not gen_ts:
         logging.error('Error retrieving timeseries for: %s', ts_gen)
         gen_points = None
     else:
-        gen_points = con.get_points(oid=gen_ts[0]['tsid'],
-                                    params={'tstype': 'int'})
+        gen_points = await con.get_points(oid=gen_ts[0]['tsid'],
+                                          params={'tstype': 'int'})
         #raise Exception(dumps(gen_points))
-    vol_ts = con.get_timeseries(params={'name': ts_vol})
+        if not gen_points:
+            ts_index.invalidate(ts_gen)
+            success = False
+    vol_ts = await engine.call(ts_index.get_timeseries, ts_vol, prefix + '_*')
     if not vol_ts:
         logging.error('Error retrieving timeseries for: %s', ts_vol)
         vol_points = None
     else:
-        vol_points = con.get_points(oid=vol_ts[0]['tsid'],
-                                    params={'tstype': 'int'})
-    return gen_points, vol_points
+        vol_points = await con.get_points(oid=vol_ts[0]['tsid'],
+                                          params={'tstype': 'int'})
+        if not vol_points:
+            ts_index.invalidate(ts_vol)
+            success = False
+    return gen_points, vol_points, success
 
 
 def query_installed_capacity(params):
     """ Retorna a capacidade instalada e volume do reservatorio para
-        todas as plantas hidreletricas """
+        todas as plantas hidreletricas. As tabelas sao mantidas em
+        tmp_folder/installed_capacity.json, identificadas pelo deck
+        (oid e nome do arquivo), pela data do PMO e pela versao da tabela
+        de nomes, e o deck so eh lido novamente quando algum deles muda """
     if not params['normalize']:
         return dict(), dict()
     con = params['con']
     res = con.get_file(oid='file5939_287')
+    pmo_date = date(2020, 3, 1)
+    cache_file = params['tmp_folder'] + '/installed_capacity.json'
+    version = fingerprint('file5939_287', res['name'], pmo_date,
+                          params['dessem_sagic_name'])
+    cached = load_versioned(cache_file, version)
+    if cached is not None:
+        logging.debug('Installed capacity loaded from: %s', cache_file)
+        return cached['installed_capacity'], cached['reservoir_volume']
     filepath = params['tmp_folder'] + '/' + res['name']
     if not path.exists(filepath):
         filepath = con.download_file(oid='file5939_287',
@@ -99,7 +147,7 @@ def query_installed_capacity(params):
                        dia=[11],
                        rd=True,
                        output_format='dict',
-                       pmo_date=date(2020, 3, 1))
+                       pmo_date=pmo_date)
     installed_capacity = dict()
     reservoir_volume = dict()
     key_date = list(deck)[0]
@@ -142,65 +190,58 @@ def query_installed_capacity(params):
             installed_capacity[sagic_name] = capacidade / factor
             logging.debug('Computed installed capacity for UTE "%s": %s',
                           sagic_name, str(capacidade))
+    save_versioned(cache_file, version,
+                   {'installed_capacity': installed_capacity,
+                    'reservoir_volume': reservoir_volume})
     return installed_capacity, reservoir_volume
 
 
 def build_compare_dict(grp, sagic_name, subsis, factor):
-    """ Constroi um dicionario organizado para dados de comparacao
-        entre SAGIC e DESSEM """
-    for metric in ['programada', 'verificada', 'dessem']:
+    """ Acrescenta ao armazenamento colunar os pontos de uma consulta de
+        comparacao entre SAGIC e DESSEM. As series de geracao de uma planta
+        sao declaradas em conjunto, de modo que todo dia com dados possui
+        as 3 series (possivelmente vazias) """
+    pairs = grp['results_timeseries']['timeseries_sum']
+    tstamps = [pair[0] for pair in pairs]
+    for metric in COMPARE_SERIES:
         if metric in grp['name']:
-            for pair in grp[
-                    'results_timeseries'][
-                        'timeseries_sum']:
-                cur_date = datetime.fromtimestamp(pair[0]/1000,
-                                                  tz=LOCAL_TIMEZONE).date()
-                if cur_date not in DADOS_COMPARE[sagic_name]:
-                    DADOS_COMPARE[sagic_name][cur_date] = dict()
-                    DADOS_COMPARE[sagic_name][cur_date]['programada'] = dict()
-                    DADOS_COMPARE[sagic_name][cur_date]['verificada'] = dict()
-                    DADOS_COMPARE[sagic_name][cur_date]['dessem'] = dict()
-                if pair[0] not in DADOS_COMPARE[sagic_name][cur_date][
-                        metric]:
-                    DADOS_COMPARE[sagic_name][cur_date][metric][
-                        pair[0]] = pair[1] / factor
+            DADOS_COMPARE.declare(sagic_name, COMPARE_SERIES)
+            DADOS_COMPARE.add_points(sagic_name, metric, tstamps,
+                                     [pair[1] / factor for pair in pairs])
     if 'cmo' in grp['name']:
-        for pair in grp[
-                'results_timeseries'][
-                    'timeseries_sum']:
-            cur_date = datetime.fromtimestamp(pair[0]/1000,
-                                              tz=LOCAL_TIMEZONE).date()
-            if cur_date not in DADOS_COMPARE[sagic_name]:
-                DADOS_COMPARE[sagic_name][cur_date] = dict()
-            if subsis not in DADOS_COMPARE[sagic_name][cur_date]:
-                DADOS_COMPARE[sagic_name][cur_date][subsis] = dict()
-            if pair[0] not in DADOS_COMPARE[sagic_name][cur_date][subsis]:
-                DADOS_COMPARE[sagic_name][cur_date][subsis][
-                    pair[0]] = pair[1]
-
-def query_compare_data(pparams):
+        DADOS_COMPARE.add_points(sagic_name, subsis, tstamps,
+                                 [pair[1] for pair in pairs])
+
+async def query_compare_data(pparams, engine):
     """ Faz consulta do Miran Web que retorna geracao horaria verificada e
         programada (SAGIC) e geracao programada do DESSEM. As series sao
         indexadas por dia, sendo que em cada dia sao armazenadas series
         temporais horarias ou semi-horarias em cada um dos dias para as 3
         variaveis citadas. Note que o dicionario 'dados' eh um ponteiro
         e eh organizado/indexado de tal forma que ele pode e eh alimentado
-        por n threads de consultas simultaneas """
-    params, cur_date, next_date, gen_type, d_name, s_name = pparams
-    start = cur_date.isoformat()
-    end = next_date.isoformat()
+        por n consultas simultaneas do motor 'engine'. O intervalo
+        consultado eh 'interval' (normalmente o mes todo, de cur_date a
+        next_date), enquanto cur_date identifica o mes e o deck do DESSEM.
+        Retorna False caso alguma consulta ou soma de grupo falhe, de modo
+        que a unidade nao seja registrada como concluida nem armazenada
+        no cache """
+    params, cur_date, _, gen_type, d_name, s_name, interval = pparams
+    start = interval[0].isoformat()
+    end = interval[1].isoformat()
     cur_date = cur_date.date()
-    ts_gen = '%s_%s_%s_ger%s_%s_%s_%s' % (
-        'ts_' + params['deck_provider'] + '_dessem_completo',
-        cur_date.isoformat().replace('-', '_'),
-        'com_rede_pdo_operacao_interval',
+    prefix = dessem_prefix(params['deck_provider'], cur_date.isoformat())
+    ts_gen = '%s_ger%s_%s_%s_%s' % (
+        prefix,
         gen_type[:4],
         d_name,
         'geracao',
         gen_type)
-    con = params['con']
+    con = engine.con
+    ts_index = params['ts_index']
+    success = True
     if 'cmo' not in s_name:
-        gen_ts = con.get_timeseries(params={'name': ts_gen})
+        gen_ts = await engine.call(ts_index.get_timeseries,
+                                   ts_gen, prefix + '_*')
         if not gen_ts:
             # in this case, the current cepel name (d_name) might not be applied
             # to the dessem names (could be a newave/decomp name), so we move
@@ -215,7 +256,8 @@ def query_compare_data(pparams):
     for sagic_name in s_name:
         ts_gen = 'ts_ons_geracao_horaria_verificada_%s' % sagic_name
         if 'cmo' not in sagic_name:
-            gen_ts = con.get_timeseries(params={'name': ts_gen})
+            gen_ts = await engine.call(ts_index.get_timeseries,
+                                       ts_gen, VERIFIED_GEN_PATTERN)
             if not gen_ts:
                 logging.debug('%s. %s: %s. %s: %s. %s: %s',
                               'Failed to query data for: ',
@@ -224,9 +266,7 @@ def query_compare_data(pparams):
                               'current_date', cur_date.strftime('%m/%Y'))
                 continue
         logging.debug('Querying plant: %s', sagic_name)
-        con = params['con']
-        if sagic_name not in DADOS_COMPARE:
-            DADOS_COMPARE[sagic_name] = dict()
+        DADOS_COMPARE.plant(sagic_name)
         if sagic_name == 'cmo':
             query = params['query_cmo_template_str'].substitute(
                 deck_provider=params['deck_provider'],
@@ -244,56 +284,77 @@ def query_compare_data(pparams):
         query = loads(query)
         query['intervals']['date_ini'] = start
         query['intervals']['date_fin'] = end
-        resp = con.consulta_miran_web(data=query)
+        resp = await con.consulta_miran_web(data=query)
         if resp:
-            for grp in query['consults']:
-                grp['results'] = dict(
-                    resp['group'][str(grp['id'])])
-                ltimeseries = list(grp['results']['timeseries'])
-                payload = {'start': start,
-                           'end': end,
-                           'timeseries': ltimeseries}
-                try:
-                    respts = con.get_timeseries_sum(data=payload)
-                except AssertionError as ass_err:
-                    respts = None
-                    logging.error('%s. %s: %s. %s: %s. %s: %s',
-                                  str(ass_err),
-                                  'sagic_name', sagic_name,
-                                  'dessem_name', d_name,
-                                  'current_date', cur_date.strftime('%m/%Y'))
-                if respts and respts[0]:
-                    grp['results_timeseries'] = respts[0]
-                    build_compare_dict(grp, sagic_name, d_name, factor)
-                else:
-                    logging.error(
-                        '%s. [%s] (%s) %s: %s. %s: %s. %s: %s - dump: %s',
-                        grp['name'],
-                        'Error retrieving timeseries sum',
-                        dumps(payload),
-                        'sagic_name', sagic_name,
-                        'dessem_name', d_name,
-                        'current_date', cur_date.strftime('%m/%Y'),
-                        dumps(respts))
+            groups = await asyncio.gather(*[
+                __query_group_sum(con, grp, resp, start, end, sagic_name,
+                                  d_name, cur_date, factor)
+                for grp in query['consults']])
+            success = success and all(groups)
         else:
             logging.critical('Failed to evaluate query: %s', dumps(query))
             # raise Exception('Fatal error. Unable to process query. Aborting.')
-    return True
+            success = False
+    return success
 
 
-def query_complete_data(pparams):
-    """ Consulta dados de geracao e volume inicial por dia operativo """
+async def __query_group_sum(con, grp, resp, start, end, sagic_name,
+                            d_name, cur_date, factor):
+    """ Consulta a soma das series de um grupo da consulta do Miran Web.
+        Retorna False caso o grupo nao conste da resposta ou a soma nao
+        retorne pontos """
+    if str(grp['id']) not in resp.get('group', dict()):
+        logging.error('%s. [%s] %s: %s. %s: %s. %s: %s', grp['name'],
+                      'Group missing from query response',
+                      'sagic_name', sagic_name,
+                      'dessem_name', d_name,
+                      'current_date', cur_date.strftime('%m/%Y'))
+        return False
+    grp['results'] = dict(
+        resp['group'][str(grp['id'])])
+    ltimeseries = list(grp['results']['timeseries'])
+    payload = {'start': start,
+               'end': end,
+               'timeseries': ltimeseries}
+    try:
+        respts = await con.get_timeseries_sum(data=payload)
+    except AssertionError as ass_err:
+        respts = None
+        logging.error('%s. %s: %s. %s: %s. %s: %s',
+                      str(ass_err),
+                      'sagic_name', sagic_name,
+                      'dessem_name', d_name,
+                      'current_date', cur_date.strftime('%m/%Y'))
+    if respts and respts[0]:
+        grp['results_timeseries'] = respts[0]
+        build_compare_dict(grp, sagic_name, d_name, factor)
+        return True
+    logging.error(
+        '%s. [%s] (%s) %s: %s. %s: %s. %s: %s - dump: %s',
+        grp['name'],
+        'Error retrieving timeseries sum',
+        dumps(payload),
+        'sagic_name', sagic_name,
+        'dessem_name', d_name,
+        'current_date', cur_date.strftime('%m/%Y'),
+        dumps(respts))
+    return False
+
+
+async def query_complete_data(pparams, engine):
+    """ Consulta dados de geracao e volume inicial por dia operativo.
+        Retorna False caso a consulta de alguma serie falhe """
     params, cur_date, gen_type, d_name, s_name = pparams
     cur_date_str = cur_date.isoformat()
     factor = len(s_name)
+    success = True
     for sagic_name in s_name:
         logging.debug('Querying plant: %s', sagic_name)
         if sagic_name not in DADOS_DESSEM:
             DADOS_DESSEM[sagic_name] = dict()
-        gen_points, vol_points = __return_ts_points(cur_date_str,
-                                                    gen_type,
-                                                    d_name,
-                                                    params)
+        gen_points, vol_points, queried = await __return_ts_points(
+            cur_date_str, gen_type, d_name, params, engine)
+        success = success and queried
         if cur_date not in DADOS_DESSEM[sagic_name]:
             DADOS_DESSEM[sagic_name][cur_date] = dict()
             DADOS_DESSEM[sagic_name][cur_date]['dessem_gen'] = dict()
@@ -306,155 +367,346 @@ def query_complete_data(pparams):
             for itstamp, tstamp in enumerate(vol_points['timestamps']):
                 DADOS_DESSEM[sagic_name][cur_date]['dessem_vol'][
                     tstamp] = vol_points['values'][itstamp] / factor
-    return True
+    return success
+
+
+def __missing_intervals(cur_date, next_date, sagic_names, metrics):
+    """ Agrupa os dias sem dados completos do mes em intervalos continuos
+        de consulta. Dias posteriores a amanha nao sao consultados """
+    last_day = min(next_date.date(), date.today() + relativedelta(days=1))
+    missing = missing_days(DADOS_COMPARE, sagic_names, metrics,
+                           cur_date.date(), last_day)
+    intervals = list()
+    for cur_day in missing:
+        day_start = datetime(cur_day.year, cur_day.month, cur_day.day)
+        day_end = day_start + relativedelta(days=1) - relativedelta(minutes=1)
+        if intervals and intervals[-1][1] + relativedelta(
+                minutes=1) == day_start:
+            intervals[-1] = (intervals[-1][0], min(day_end, next_date))
+        else:
+            intervals.append((day_start, min(day_end, next_date)))
+    return intervals
+
+
+def __month_cache(params, kind):
+    """ Retorna o cache de series por mes da execucao, ou None caso
+        params['month_cache'] esteja desabilitado """
+    if not params.get('month_cache', True):
+        return None
+    return MonthCache('%s/month_cache/%s_%s_%s' % (params['tmp_folder'],
+                                                   kind,
+                                                   params['deck_provider'],
+                                                   params['network']),
+                      ttl=params.get('month_cache_ttl', 3600))
+
+
+def __plant_units(params):
+    """ Retorna as plantas da consulta (params['compare_plants'], ou todas
+        as plantas da tabela de nomes), [(gen_type, d_name, s_name)] """
+    units = list()
+    for gen_type in params['dessem_sagic_name']:
+        for d_name, item in params['dessem_sagic_name'][gen_type][
+                'by_cepelname'].items():
+            if (params['compare_plants'] and
+                    d_name not in params['compare_plants']):
+                continue
+            units.append((gen_type, d_name, list(set(item['ons_sagic']))))
+    return units
+
+
+def __prune_month_cache(params, kind, units):
+    """ Remove do cache de meses as unidades [(dia, chave)] de meses
+        encerrados, apos a gravacao dos resultados de uma execucao
+        completa: o armazenamento de resultados passa a ser a unica copia
+        desses meses (ver __load_results). Os meses ainda abertos sao
+        mantidos, pois sao revalidados pelo cache """
+    month_cache = __month_cache(params, kind)
+    if not month_cache:
+        return
+    for day, key in units:
+        if MonthCache.is_closed(day):
+            month_cache.discard(day, key)
+
+
+def __checkpoint_folder(params, kind):
+    """ Retorna a pasta do registro de unidades concluidas de uma execucao,
+        identificada pelos parametros da consulta """
+    run = fingerprint(kind, params['deck_provider'], params['network'],
+                      params['dessem_sagic_name'], params['compare_plants'],
+                      params['ini_date'], params['end_date'],
+                      params['query_gen'], params['query_cmo'])
+    return '%s/checkpoints/%s_%s' % (params['tmp_folder'], kind, run[:16])
+
+
+def __checkpoint(params, kind):
+    """ Retorna o registro de unidades concluidas da execucao (retomado
+        caso params['resume']), ou None caso params['checkpoint'] esteja
+        desabilitado """
+    if not params.get('checkpoint', True):
+        return None
+    return Checkpoint(__checkpoint_folder(params, kind),
+                      resume=params.get('resume', False))
+
+
+def __finish_checkpoint(params, kind, complete):
+    """ Descarta o registro de unidades da execucao, apos a gravacao dos
+        resultados, caso todas as unidades tenham sucesso. Caso contrario,
+        o registro eh mantido para que params['resume'] consulte novamente
+        apenas as unidades que falharam """
+    if not params.get('checkpoint', True):
+        return
+    if complete:
+        Checkpoint(__checkpoint_folder(params, kind), resume=True).clear()
+    else:
+        logging.warning('Some query units failed; run again with resume to '
+                        'query only the failed units')
+
+
+def __load_unit(month_cache, checkpoint, store, month, key):
+    """ Incorpora a store os dados de uma unidade ja concluida nesta
+        execucao ou presente no cache. Retorna False caso a unidade
+        precise ser consultada """
+    for source in [checkpoint, month_cache]:
+        if source:
+            done = source.load(month, key)
+            if done is not None:
+                merge(store, done)
+                return True
+    return False
+
+
+def __save_unit(month_cache, checkpoint, store, month, interval, key,
+                names, metrics, queried=None):
+    """ Grava no registro da execucao e no cache as series de uma unidade
+        concluida com sucesso. Meses encerrados sao registrados em
+        'queried' (ver __compare_unit) """
+    if queried is not None and MonthCache.is_closed(month):
+        months = set(queried.get(key, list())) | {month.strftime('%Y_%m')}
+        queried[key] = sorted(months)
+    data = extract(store, names, metrics,
+                   interval[0].date(), interval[1].date())
+    if checkpoint:
+        checkpoint.save(month, key, data)
+    if month_cache and data:
+        month_cache.save(month, key, data)
+
+
+def __compare_unit(params, engine, month_cache, checkpoint, cur_date,
+                   next_date, gen_type, d_name, s_name, metrics):
+    """ Monta a unidade de consulta de uma planta (ou subsistema, no caso
+        do CMO) em um mes. Retorna None caso a unidade ja tenha sido
+        concluida nesta execucao ou o mes esteja no cache. No modo
+        incremental, meses encerrados ja consultados com sucesso
+        (params['queried'], {unidade: [AAAA_MM]}, mantido no armazenamento
+        de resultados) nao sao consultados novamente, mesmo sem dados """
+    key = '%s_%s' % (gen_type, d_name)
+    if __load_unit(month_cache, checkpoint, DADOS_COMPARE,
+                   cur_date.date(), key):
+        return None
+    queried = params.get('queried')
+    if (params.get('incremental', False) and queried is not None and
+            cur_date.strftime('%Y_%m') in queried.get(key, list())):
+        return None
+    on_done = partial(__save_unit, month_cache, checkpoint, DADOS_COMPARE,
+                      cur_date.date(), (cur_date, next_date), key, s_name,
+                      metrics, queried)
+    on_fail = None
+    if checkpoint:
+        on_fail = partial(checkpoint.fail, cur_date.date(), key)
+    if params.get('incremental', False):
+        intervals = __missing_intervals(cur_date, next_date, s_name, metrics)
+    else:
+        intervals = [(cur_date, next_date)]
+    return engine.group(
+        [query_compare_data((params, cur_date, next_date, gen_type,
+                             d_name, s_name, interval), engine)
+         for interval in intervals], on_done, on_fail)
 
 
 def process_compare_data(params):
-    """ Processa dados para comparacao entre DESSEM e SAGIC """
+    """ Processa dados para comparacao entre DESSEM e SAGIC. Todas as
+        unidades (mes, planta) e (mes, subsistema do CMO) sao submetidas
+        de uma so vez ao motor de consultas, limitado apenas por
+        params['max_concurrency']. No modo incremental
+        (params['incremental']), apenas os dias ainda sem dados completos
+        em DADOS_COMPARE sao consultados. Meses presentes no cache de
+        meses (ver MonthCache) nao sao consultados. Cada unidade eh
+        registrada como concluida ou com falha (ver Checkpoint) e, com
+        params['resume'], apenas as unidades de uma execucao interrompida
+        que falharam ou nao terminaram sao consultadas novamente. Com
+        params['engine'], o motor de consultas informado eh utilizado (e
+        nao eh encerrado). Retorna True caso todas as unidades tenham
+        sucesso """
+    engine = params.get('engine')
+    if engine is None:
+        engine = FetchEngine(params['con_pool'],
+                             params.get('max_concurrency', 10))
+    month_cache = __month_cache(params, 'compare')
+    checkpoint = __checkpoint(params, COMPARE_RESULTS)
+    units = list()
     for cur_date in rrule(MONTHLY, dtstart=params['ini_date'],
                           until=params['end_date']):
         next_date = cur_date + relativedelta(
             months=1) - relativedelta(minutes=1)
-        logging.info('Querying: cur_date: %s; next_date: %s',
+        logging.info('Scheduling: cur_date: %s; next_date: %s',
                      cur_date.date().isoformat(),
                      next_date.date().isoformat())
         if params['query_gen']:
-            for gen_type in params['dessem_sagic_name']:
-                pparams = list()
-                for d_name, item in params['dessem_sagic_name'][gen_type][
-                        'by_cepelname'].items():
-                    s_name = list(set(item['ons_sagic']))
-                    if (params['compare_plants'] and
-                            d_name not in params['compare_plants']):
-                        continue
-                    pparams.append((params, cur_date, next_date,
-                                    GEN_TYPE[gen_type],
-                                    d_name, s_name))
-                results = Parallel(n_jobs=10, verbose=10, backend="threading")(
-                    map(delayed(query_compare_data), pparams))
-                if not all(results):
-                    logging.warning('Not all parallel jobs were successful!')
+            for gen_type, d_name, s_name in __plant_units(params):
+                units.append(__compare_unit(
+                    params, engine, month_cache, checkpoint, cur_date,
+                    next_date, GEN_TYPE[gen_type], d_name, s_name,
+                    COMPARE_SERIES))
         if params['query_cmo']:
-            pparams = list()
-            for subsis in ['se', 'ne', 'n', 's']:
-                pparams.append((params, cur_date, next_date, 'cmo',
-                                subsis, ['cmo']))
-            results = Parallel(n_jobs=10, verbose=10, backend="threading")(
-                map(delayed(query_compare_data), pparams))
+            for subsis in CMO_SERIES:
+                units.append(__compare_unit(
+                    params, engine, month_cache, checkpoint, cur_date,
+                    next_date, 'cmo', subsis, ['cmo'], [subsis]))
+    units = [unit for unit in units if unit is not None]
+    logging.info('Submitting %d query units', len(units))
+    try:
+        results = engine.run(units)
+    finally:
+        if engine is not params.get('engine'):
+            engine.close()
+    if not all(results):
+        logging.warning('Not all parallel jobs were successful!')
+    return all(results)
+
+
+def __compare_units(params):
+    """ Retorna as unidades [(mes, chave)] de consulta de do_compare (ver
+        __compare_unit) """
+    keys = list()
+    if params['query_gen']:
+        keys += ['%s_%s' % (GEN_TYPE[gen_type], d_name)
+                 for gen_type, d_name, _ in __plant_units(params)]
+    if params['query_cmo']:
+        keys += ['cmo_%s' % subsis for subsis in CMO_SERIES]
+    return [(cur_date.date(), key)
+            for cur_date in rrule(MONTHLY, dtstart=params['ini_date'],
+                                  until=params['end_date'])
+            for key in keys]
+
+
+def __dessem_key(cur_date, gen_type, d_name):
+    """ Retorna a chave da unidade (dia, planta) de process_ts_data """
+    return '%s_%s_%s' % (cur_date.strftime('%d'), gen_type, d_name)
+
+
+def __dessem_units(params):
+    """ Retorna as unidades [(dia, chave)] de consulta de do_ts_dessem """
+    return [(cur_date.date(), __dessem_key(cur_date, gen_type, d_name))
+            for cur_date in rrule(DAILY, dtstart=params['ini_date'],
+                                  until=params['end_date'])
+            for gen_type, d_name, _ in __plant_units(params)]
 
 
 def process_ts_data(params):
     """ Processa series temporais utilizadas
-        para calcular estatisticas do DESSEM """
+        para calcular estatisticas do DESSEM. Todas as unidades
+        (dia, planta) sao submetidas de uma so vez ao motor de consultas.
+        No modo incremental (params['incremental']), os dias cujo deck ja
+        consta em DADOS_DESSEM para a planta nao sao consultados. As
+        unidades sao registradas e o retorno eh o mesmo de
+        process_compare_data """
+    engine = FetchEngine(params['con_pool'],
+                         params.get('max_concurrency', 10))
+    month_cache = __month_cache(params, 'ts_dessem')
+    checkpoint = __checkpoint(params, DESSEM_RESULTS)
+    units = list()
     for cur_date in rrule(DAILY, dtstart=params['ini_date'],
                           until=params['end_date']):
-        logging.info('Querying: cur_date: %s', cur_date.date().isoformat())
-        for gen_type in params['dessem_sagic_name']:
-            pparams = list()
-            for d_name, item in params['dessem_sagic_name'][gen_type][
-                    'by_cepelname'].items():
-                s_name = list(set(item['ons_sagic']))
-                if (params['compare_plants'] and
-                        d_name not in params['compare_plants']):
-                    continue
-                pparams.append((params, cur_date.date(), GEN_TYPE[gen_type],
-                                d_name, s_name))
-            results = Parallel(n_jobs=10, verbose=10, backend="threading")(
-                map(delayed(query_complete_data), pparams))
-            if not all(results):
-                logging.warning('Not all parellel jobs were successful!')
+        logging.info('Scheduling: cur_date: %s', cur_date.date().isoformat())
+        for gen_type, d_name, s_name in __plant_units(params):
+            if params.get('incremental', False) and all(
+                    DADOS_DESSEM.get(sagic_name, dict()).get(
+                        cur_date.date(), dict()).get('dessem_gen')
+                    for sagic_name in s_name):
+                continue
+            key = __dessem_key(cur_date, gen_type, d_name)
+            if __load_unit(month_cache, checkpoint, DADOS_DESSEM,
+                           cur_date.date(), key):
+                continue
+            on_done = on_fail = None
+            if month_cache or checkpoint:
+                on_done = partial(__save_unit, month_cache, checkpoint,
+                                  DADOS_DESSEM, cur_date.date(),
+                                  (cur_date, cur_date), key,
+                                  s_name, DESSEM_SERIES)
+            if checkpoint:
+                on_fail = partial(checkpoint.fail, cur_date.date(), key)
+            units.append(engine.group(
+                [query_complete_data((params, cur_date.date(),
+                                      GEN_TYPE[gen_type], d_name,
+                                      s_name), engine)], on_done,
+                on_fail))
+    logging.info('Submitting %d query units', len(units))
+    try:
+        results = engine.run(units)
+    finally:
+        engine.close()
+    if not all(results):
+        logging.warning('Not all parellel jobs were successful!')
+    return all(results)
 
 
 def calculate_statistics(comp_series, sagic_name,
-                         cur_date, installed_capacity, normalize=False):
-    """ Calcula os indicadores de comparacao entre DESSEM e SAGIC """
-    logging.debug('Construindo estatíticas: %s X %s para %s em %s',
+                         cur_dates, installed_capacity, normalize=False):
+    """ Calcula os indicadores de comparacao entre DESSEM e SAGIC para
+        todos os dias de 'cur_dates' de uma vez. As series sao alinhadas
+        pelos timestamps comuns e os indicadores sao calculados por
+        kernels vetorizados (dessemstats.kernels), com os mesmos valores
+        do calculo ponto a ponto """
+    logging.debug('Construindo estatíticas: %s X %s para %s em %d dias',
                   comp_series[0], comp_series[1],
-                  sagic_name, cur_date.isoformat())
-    diffs = list()
-    diffs_abs = list()
-    diffs_sqrt = list()
-    i_logs = list()
-    j_logs = list()
-    timestamps = list(set(
-        DADOS_COMPARE[sagic_name][cur_date][comp_series[0]]
-        ).intersection(
-            set(DADOS_COMPARE[sagic_name][cur_date][comp_series[1]])))
-    timestamps.sort()
-    i_list = list()
-    j_list = list()
-    prev_tstamp = None
-    i_volat = list()
-    j_volat = list()
-    for tstamp in timestamps:
-        i = DADOS_COMPARE[sagic_name][cur_date][comp_series[0]][tstamp]
-        i_list.append(i)
-        j = DADOS_COMPARE[sagic_name][cur_date][comp_series[1]][tstamp]
-        j_list.append(j)
-        diffs.append(i - j)
-        diffs_abs.append(abs(i - j))
-        diffs_sqrt.append(sqrt((i - j) * (i - j)))
-        if prev_tstamp:
-            i_prev = DADOS_COMPARE[sagic_name][cur_date][
-                comp_series[0]][prev_tstamp]
-            j_prev = DADOS_COMPARE[sagic_name][cur_date][
-                comp_series[1]][prev_tstamp]
-            i_volat.append(abs(i - i_prev))
-            j_volat.append(abs(j - j_prev))
-            if i and i_prev and (i / i_prev) > 0:
-                i_logs.append(log(i / i_prev))
-            else:
-                i_logs.append(0)
-            if j and j_prev and (j / j_prev) > 0:
-                j_logs.append(log(j / j_prev))
-            else:
-                j_logs.append(0)
-        prev_tstamp = tstamp
+                  sagic_name, len(cur_dates))
+    results = compare_terms(
+        DADOS_COMPARE.columns(sagic_name, comp_series[0]),
+        DADOS_COMPARE.columns(sagic_name, comp_series[1]),
+        [cur_date.toordinal() for cur_date in cur_dates])
+    __write_indicators(comp_series, sagic_name, results,
+                       installed_capacity, normalize)
+
+
+def __write_indicators(comp_series, sagic_name, results,
+                       installed_capacity, normalize=False):
+    """ Grava os indicadores de comparacao a partir dos termos calculados
+        por dessemstats.kernels.compare_terms """
     cur_capacity = 1
     if sagic_name in installed_capacity and normalize:
         cur_capacity = installed_capacity[sagic_name]
     if not cur_capacity:
         cur_capacity = 1
-    num_values = len(timestamps)
-    DADOS_COMPARE[sagic_name][cur_date][
-        'desvio_%s_%s' % comp_series] =\
-        sum(diffs) / (num_values * cur_capacity)
-    DADOS_COMPARE[sagic_name][cur_date][
-        'desvio_absoluto_%s_%s' % comp_series] =\
-        sum(diffs_sqrt) / (num_values * cur_capacity)
-    DADOS_COMPARE[sagic_name][cur_date][
-        'oscilacao_maxima_norm_%s' % comp_series[0]] =\
-        (max(i_list) - min(i_list)) / (cur_capacity)
-    DADOS_COMPARE[sagic_name][cur_date][
-        'oscilacao_maxima_norm_%s' % comp_series[1]] =\
-        (max(j_list) - min(j_list)) / (cur_capacity)
-    DADOS_COMPARE[sagic_name][cur_date][
-        'volatilidade_media_%s' % comp_series[0]] =\
-        statistics.mean(i_volat) / cur_capacity
-    DADOS_COMPARE[sagic_name][cur_date][
-        'volatilidade_media_%s' % comp_series[1]] =\
-        statistics.mean(j_volat) / cur_capacity
-    DADOS_COMPARE[sagic_name][cur_date][
-        'volatilidade_log_%s' % comp_series[0]] =\
-        statistics.stdev(i_logs)
-    DADOS_COMPARE[sagic_name][cur_date][
-        'volatilidade_log_%s' % comp_series[1]] =\
-        statistics.stdev(j_logs)
-    DADOS_COMPARE[sagic_name][cur_date][
-        'desviopadrao_diffs_%s_%s' % comp_series] = statistics.stdev(
-            diffs) / cur_capacity
-    DADOS_COMPARE[sagic_name][cur_date][
-        'desviopadrao_%s' % comp_series[0]] = statistics.stdev(
-            i_list) / cur_capacity
-    DADOS_COMPARE[sagic_name][cur_date][
-        'desviopadrao_%s' % comp_series[1]] = statistics.stdev(
-            j_list) / cur_capacity
-    DADOS_COMPARE[sagic_name][cur_date][
-        'desviopadrao_%s_%s' % comp_series] = (
-            DADOS_COMPARE[sagic_name][cur_date][
-                'desviopadrao_%s' % comp_series[0]] - DADOS_COMPARE[
-                    sagic_name][cur_date][
-                        'desviopadrao_%s' % comp_series[1]]) / cur_capacity
+    for day, terms in results:
+        indicators = DADOS_COMPARE.indicators(sagic_name,
+                                              date.fromordinal(day))
+        num_values = terms['num_values']
+        indicators['desvio_%s_%s' % comp_series] =\
+            terms['sum_diffs'] / (num_values * cur_capacity)
+        indicators['desvio_absoluto_%s_%s' % comp_series] =\
+            terms['sum_diffs_sqrt'] / (num_values * cur_capacity)
+        indicators['oscilacao_maxima_norm_%s' % comp_series[0]] =\
+            terms['range_i'] / (cur_capacity)
+        indicators['oscilacao_maxima_norm_%s' % comp_series[1]] =\
+            terms['range_j'] / (cur_capacity)
+        indicators['volatilidade_media_%s' % comp_series[0]] =\
+            terms['volat_mean_i'] / cur_capacity
+        indicators['volatilidade_media_%s' % comp_series[1]] =\
+            terms['volat_mean_j'] / cur_capacity
+        indicators['volatilidade_log_%s' % comp_series[0]] =\
+            terms['logs_stdev_i']
+        indicators['volatilidade_log_%s' % comp_series[1]] =\
+            terms['logs_stdev_j']
+        indicators['desviopadrao_diffs_%s_%s' % comp_series] =\
+            terms['stdev_diffs'] / cur_capacity
+        indicators['desviopadrao_%s' % comp_series[0]] =\
+            terms['stdev_i'] / cur_capacity
+        indicators['desviopadrao_%s' % comp_series[1]] =\
+            terms['stdev_j'] / cur_capacity
+        indicators['desviopadrao_%s_%s' % comp_series] = (
+            indicators['desviopadrao_%s' % comp_series[0]] -
+            indicators['desviopadrao_%s' % comp_series[1]]) / cur_capacity
 
 
 def calculate_dessem_statistics(sagic_name, dessem_var,
@@ -493,26 +745,42 @@ def calculate_dessem_statistics(sagic_name, dessem_var,
             'desvio_absoluto_' + dessem_var] =\
             sqrt(abs(diff_squared)) / reservoir_volume[sagic_name]
 
-def __compare_operation(params, installed_capacity):
+def __compare_tasks(sagic_name, compare, full=True):
+    """ Retorna os pares de series a comparar de uma planta e, para cada
+        par, os dias (ordinais) em que ambas as series possuem ao menos 24
+        pontos. Sem 'full', apenas os dias em que alguma das series
+        recebeu pontos desde o ultimo calculo sao retornados """
+    pairs = list()
+    for comp_series in compare:
+        if not (DADOS_COMPARE.has_series(sagic_name, comp_series[0]) and
+                DADOS_COMPARE.has_series(sagic_name, comp_series[1])):
+            continue
+        i_counts = DADOS_COMPARE.day_counts(sagic_name, comp_series[0])
+        j_counts = DADOS_COMPARE.day_counts(sagic_name, comp_series[1])
+        changed = DADOS_COMPARE.dirty_days(sagic_name, comp_series[0]) |\
+            DADOS_COMPARE.dirty_days(sagic_name, comp_series[1])
+        ordinals = sorted(day for day, count in i_counts.items()
+                          if count >= 24 and j_counts.get(day, 0) >= 24 and
+                          (full or day in changed))
+        if ordinals:
+            pairs.append((comp_series, ordinals))
+    return pairs
+
+def __compare_operation(full=True):
     """ compares operation using various metrics """
     compare = [('programada', 'verificada'),
                ('programada', 'dessem'),
                ('verificada', 'dessem')]
-    logging.info('Calculating Statistics...')
+    tasks = list()
     for sagic_name in DADOS_COMPARE:
         if sagic_name == 'cmo':
             continue
-        for cur_date in DADOS_COMPARE[sagic_name]:
-            for comp_series in compare:
-                if (len(DADOS_COMPARE[sagic_name][cur_date][
-                        comp_series[0]]) >= 24 and
-                        len(DADOS_COMPARE[sagic_name][cur_date][
-                            comp_series[1]]) >= 24):
-                    calculate_statistics(comp_series, sagic_name,
-                                         cur_date, installed_capacity,
-                                         params['normalize'])
-
-def __compare_cmo(installed_capacity):
+        pairs = __compare_tasks(sagic_name, compare, full)
+        if pairs:
+            tasks.append((sagic_name, pairs))
+    return tasks
+
+def __compare_cmo(full=True):
     """ compares cmo using various metrics """
     compare = [('ne', 'se'),
                ('ne', 's'),
@@ -521,64 +789,186 @@ def __compare_cmo(installed_capacity):
                ('n', 's'),
                ('s', 'se'),
                ('s', 'n')]
-    logging.info('Calculating CMO Statistics...')
-    for cur_date in DADOS_COMPARE['cmo']:
-        for comp_series in compare:
-            if (comp_series[0] not in DADOS_COMPARE['cmo'][cur_date] or
-                    comp_series[1] not in DADOS_COMPARE['cmo'][cur_date]):
-                continue
-            if (len(DADOS_COMPARE['cmo'][cur_date][
-                    comp_series[0]]) >= 24 and
-                    len(DADOS_COMPARE['cmo'][cur_date][
-                        comp_series[1]]) >= 24):
-                calculate_statistics(comp_series, 'cmo',
-                                     cur_date, installed_capacity,
-                                     False)
+    if 'cmo' not in DADOS_COMPARE:
+        return list()
+    pairs = __compare_tasks('cmo', compare, full)
+    return [('cmo', pairs)] if pairs else list()
+
+def __run_statistics(params, installed_capacity):
+    """ Calcula os indicadores de todas as plantas e do CMO. Apenas os
+        dias com pontos novos desde o ultimo calculo sao recalculados, a
+        menos que os parametros do calculo (normalizacao e capacidades
+        instaladas) tenham mudado. Com params['stats_workers'] > 1 as
+        plantas sao distribuidas entre processos, que leem as series de
+        arquivos mapeados em memoria. Retorna True caso algum indicador
+        tenha sido (re)calculado """
+    version = fingerprint(STATS_VERSION, params['normalize'],
+                          installed_capacity)
+    full = DADOS_COMPARE.stats_version != version
+    logging.info('Calculating Statistics (%s)...',
+                 'all days' if full else 'changed days')
+    tasks = __compare_operation(full) + __compare_cmo(full)
+    __compute_statistics(params, tasks, installed_capacity)
+    DADOS_COMPARE.clear_dirty()
+    DADOS_COMPARE.stats_version = version
+    return full or bool(tasks)
+
+def __compute_statistics(params, tasks, installed_capacity):
+    """ Calcula os indicadores das tarefas [(planta, [(par, dias)])] """
+    workers = params.get('stats_workers', 1)
+    if workers <= 1 or len(tasks) < 2:
+        for sagic_name, pairs in tasks:
+            normalize = params['normalize'] if sagic_name != 'cmo' else False
+            for comp_series, ordinals in pairs:
+                calculate_statistics(comp_series, sagic_name,
+                                     [date.fromordinal(ordinal)
+                                      for ordinal in ordinals],
+                                     installed_capacity, normalize)
+        return
+    columns = dict()
+    for sagic_name, pairs in tasks:
+        for comp_series, _ in pairs:
+            for series in comp_series:
+                columns[(sagic_name, series)] = DADOS_COMPARE.columns(
+                    sagic_name, series)
+    results = map_compare_terms(columns, tasks, workers,
+                                params['tmp_folder'])
+    for sagic_name, pair_results in results:
+        normalize = params['normalize'] if sagic_name != 'cmo' else False
+        for comp_series, terms in pair_results:
+            __write_indicators(comp_series, sagic_name, terms,
+                               installed_capacity, normalize)
+
+def __requested_names(params, kinds):
+    """ Retorna os nomes (SAGIC) das plantas de params['compare_plants'],
+        mais o CMO caso 'kinds' o inclua, ou None caso todas as plantas
+        sejam consideradas """
+    names = set(['cmo']) if 'cmo' in kinds else set()
+    if list(kinds) == ['cmo']:
+        return names
+    if not params['compare_plants']:
+        return None
+    for gen_type in params['dessem_sagic_name']:
+        for d_name, item in params['dessem_sagic_name'][gen_type][
+                'by_cepelname'].items():
+            if d_name in params['compare_plants']:
+                names.update(item['ons_sagic'])
+    return names
+
+def __results_store(params, kind, *items):
+    """ Retorna o armazenamento de resultados 'kind' dos parametros que
+        determinam o conteudo das consultas (provedor do deck, rede, tabela
+        de nomes e 'items'), em params['tmp_folder']/results. Execucoes com
+        outros parametros usam armazenamentos distintos """
+    namespace = fingerprint(kind, params['deck_provider'], params['network'],
+                            params['dessem_sagic_name'], *items)
+    return PartitionedStore('%s/results/%s_%s' % (params['tmp_folder'], kind,
+                                                   namespace[:16]))
+
+
+def __load_results(params, results, load, store, kinds):
+    """ Carrega com 'load' os resultados armazenados das plantas e meses
+        da consulta. Retorna (coverage, loaded): a descricao da consulta
+        para o registro de cobertura e se ela ja esta integralmente
+        coberta por execucoes anteriores.
+        Um mes pode estar em tres locais de tmp_folder, consultados nesta
+        ordem: results/ (este armazenamento, a copia definitiva), o
+        registro da execucao em checkpoints/ (ver __checkpoint), mantido
+        apenas ate a conclusao de uma execucao com falhas, e o cache de
+        meses em month_cache/ (ver __month_cache). Apos uma execucao
+        completa, os meses encerrados sao removidos do cache (ver
+        __prune_month_cache), que mantem apenas os meses abertos e os de
+        execucoes com falhas """
+    names = __requested_names(params, kinds)
+    coverage = coverage_request(names, params['ini_date'].date(),
+                                params['end_date'].date(), kinds)
+    if params['force_process'] or not results.exists():
+        return coverage, False
+    load(results, store, names, params['ini_date'].date(),
+         params['end_date'].date())
+    return coverage, covered(results, coverage)
+
+
+def __compare_results(params):
+    """ Retorna o armazenamento de resultados de comparacao """
+    return __results_store(params, COMPARE_RESULTS,
+                           params['query_template_str'].template,
+                           params['query_cmo_template_str'].template)
+
+
+def __compare_kinds(params):
+    """ Retorna os tipos de serie ('gen' e/ou 'cmo') da consulta """
+    return [kind for kind, flag in [('gen', params['query_gen']),
+                                    ('cmo', params['query_cmo'])] if flag]
+
+
+def __installed_capacity(params):
+    """ Retorna a capacidade instalada e o volume dos reservatorios (ver
+        query_installed_capacity), ou params['installed_capacity'] caso
+        ja tenham sido consultados """
+    if 'installed_capacity' in params:
+        return params['installed_capacity']
+    return query_installed_capacity(params)
+
 
 def do_compare(params):
-    """ Calcula indicadores de comparacao entre SAGIC e DESSEM """
-    if path.exists('compare_sagic.pickle') and not params['force_process']:
-        with open('compare_sagic.pickle', 'rb') as handle:
-            dados_file = pickle.load(handle)
-        for key in dados_file:
-            DADOS_COMPARE[key] = dados_file[key]
-        data_loaded = True
-    else:
-        data_loaded = False
-        process_compare_data(params)
-    if not data_loaded:
-        with open('compare_sagic.pickle', 'wb') as handle:
-            pickle.dump(DADOS_COMPARE, handle, protocol=pickle.HIGHEST_PROTOCOL)
-    installed_capacity, _ = query_installed_capacity(params)
-    __compare_operation(params, installed_capacity)
-    __compare_cmo(installed_capacity)
+    """ Calcula indicadores de comparacao entre SAGIC e DESSEM. Os
+        resultados sao mantidos por parametros de consulta (ver
+        __results_store), particionados por planta e mes, e apenas as
+        particoes da consulta sao lidas. Consultas abrangidas por execucoes
+        anteriores (mesmo intervalo ou menor, mesmas plantas ou menos) nao
+        sao refeitas; nas demais, e no modo incremental, apenas as lacunas
+        dos dados armazenados sao consultadas. A consulta so eh registrada
+        como coberta quando todas as unidades tem sucesso, de modo que as
+        lacunas de unidades com falha sao consultadas na proxima execucao
+        (com params['record_coverage'] desabilitado, o registro fica a
+        cargo de quem chama). Retorna o armazenamento de resultados, ja
+        gravado, e se todas as unidades tiveram sucesso """
+    results = __compare_results(params)
+    kinds = __compare_kinds(params)
+    coverage, data_loaded = __load_results(params, results, load_compare,
+                                           DADOS_COMPARE, kinds)
+    data_loaded = data_loaded and not params.get('incremental', False)
+    complete = True
+    if params['force_process']:
+        results.meta['queried'] = dict()
     if not data_loaded:
-        with open('compare_sagic.pickle', 'wb') as handle:
-            pickle.dump(DADOS_COMPARE, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        complete = process_compare_data(dict(params, incremental=(
+            params.get('incremental', False) or bool(DADOS_COMPARE)),
+            queried=results.meta.setdefault('queried', dict())))
+    installed_capacity, _ = __installed_capacity(params)
+    computed = __run_statistics(params, installed_capacity)
+    if not data_loaded and complete and params.get('record_coverage', True):
+        add_coverage(results, coverage)
+    if not data_loaded or computed:
+        save_compare(results, DADOS_COMPARE)
+    if not data_loaded and complete:
+        __prune_month_cache(params, 'compare', __compare_units(params))
+    __finish_checkpoint(params, COMPARE_RESULTS, complete)
+    return results, complete
 
 
 def do_ts_dessem(params):
-    """ Calcula as estatisticas das series temporais do DESSEM """
-    if (path.exists('compare_sagic_ts_dessem.pickle') and
-            not params['force_process']):
-        with open('compare_sagic_ts_dessem.pickle', 'rb') as handle:
-            dados_file = pickle.load(handle)
-        for key in dados_file:
-            DADOS_DESSEM[key] = dados_file[key]
-        data_loaded = True
-    else:
-        data_loaded = False
-        process_ts_data(params)
+    """ Calcula as estatisticas das series temporais do DESSEM. Os
+        resultados sao mantidos e reaproveitados como em do_compare """
+    results = __results_store(params, DESSEM_RESULTS)
+    coverage, data_loaded = __load_results(params, results, load_nested,
+                                           DADOS_DESSEM, ['dessem'])
+    complete = True
     if not data_loaded:
-        with open('compare_sagic_ts_dessem.pickle', 'wb') as handle:
-            pickle.dump(DADOS_DESSEM, handle, protocol=pickle.HIGHEST_PROTOCOL)
-    installed_capicity, reservoir_volume = query_installed_capacity(params)
+        complete = process_ts_data(dict(params,
+                                        incremental=bool(DADOS_DESSEM)))
+    installed_capicity, reservoir_volume = __installed_capacity(params)
     logging.info('Calculating Statistics...')
+    # os resultados armazenados sao carregados por mes: DADOS_DESSEM pode
+    # conter dias fora da consulta, e dias sem o deck seguinte
     for sagic_name in DADOS_DESSEM:
         for cur_date in DADOS_DESSEM[sagic_name]:
-            if cur_date >= params['end_date'].date():
-                continue
             next_date = cur_date + relativedelta(days=1)
+            if (not params['ini_date'].date() <= cur_date <
+                    params['end_date'].date() or
+                    next_date not in DADOS_DESSEM[sagic_name]):
+                continue
             for dessem_var in ['dessem_gen', 'dessem_vol']:
                 if (len(DADOS_DESSEM[sagic_name][cur_date][
                         dessem_var]) > 24 and
@@ -589,22 +979,25 @@ def do_ts_dessem(params):
                                                 reservoir_volume,
                                                 params['normalize'])
     if not data_loaded:
-        with open('compare_sagic_ts_dessem.pickle', 'wb') as handle:
-            pickle.dump(DADOS_DESSEM, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        if complete:
+            add_coverage(results, coverage)
+        save_nested(results, DADOS_DESSEM, DESSEM_SERIES)
+        if complete:
+            __prune_month_cache(params, 'ts_dessem', __dessem_units(params))
+    __finish_checkpoint(params, DESSEM_RESULTS, complete)
 
 def __compute_cmo_data():
     """ writes cmo to csv """
     tstamp_dict = dict()
     data_types = ['s', 'se', 'ne', 'n']
-    for dtime in DADOS_COMPARE['cmo']:
-        for data_type in data_types:
-            if data_type not in DADOS_COMPARE['cmo'][dtime]:
-                continue
-            for tstamp in DADOS_COMPARE['cmo'][dtime][data_type]:
-                if tstamp not in tstamp_dict:
-                    tstamp_dict[tstamp] = dict()
-                tstamp_dict[tstamp][data_type] = DADOS_COMPARE[
-                    'cmo'][dtime][data_type][tstamp]
+    for data_type in data_types:
+        if not DADOS_COMPARE.has_series('cmo', data_type):
+            continue
+        tstamps, values = DADOS_COMPARE.series('cmo', data_type)
+        for tstamp, value in zip(tstamps.tolist(), values.tolist()):
+            if tstamp not in tstamp_dict:
+                tstamp_dict[tstamp] = dict()
+            tstamp_dict[tstamp][data_type] = value
     tstamp_index = list(tstamp_dict)
     tstamp_index.sort()
     for tstamp in tstamp_index:
@@ -619,34 +1012,32 @@ def __write_plant_xlsx(params, sagic_name):
     if sagic_name == 'cmo':
         return
     time_series = dict()
-    for cur_date in DADOS_COMPARE[sagic_name]:
-        for metric in DADOS_COMPARE[sagic_name][cur_date]:
-            if metric in ['dessem', 'verificada', 'programada']:
-                if '%s_%s' % (sagic_name, metric) not in time_series:
-                    time_series['%s_%s' %
-                                (sagic_name, metric)] = list()
-                for tstamp in DADOS_COMPARE[sagic_name][cur_date][metric]:
-                    cur_date_data = dict()
-                    cur_date_data['Data'] = datetime.fromtimestamp(
-                        int(tstamp/1000))
-                    cur_date_data[metric] = DADOS_COMPARE[sagic_name][
-                        cur_date][metric][tstamp]
-                    time_series['%s_%s' %
-                                (sagic_name, metric)].append(cur_date_data)
+    if DADOS_COMPARE[sagic_name]:
+        for metric in COMPARE_SERIES:
+            if not DADOS_COMPARE.has_series(sagic_name, metric):
+                continue
+            tstamps, values = DADOS_COMPARE.series(sagic_name, metric)
+            time_series['%s_%s' % (sagic_name, metric)] = [
+                {'Data': dtime, metric: value}
+                for dtime, value in zip(LOCAL_TABLE.datetimes(tstamps),
+                                        values.tolist())]
     logging.info('Outputting to excel: %s.xlsx', sagic_name)
     write_xlsx(
         data=time_series,
         filename='%s/%s.xlsx' % (params['storage_folder'], sagic_name))
 
-def __write_metrics_xlsx(params, existing_dates, existing_metrics):
+def __write_metrics_xlsx(params, existing_dates, existing_metrics,
+                         data=None):
     """ write metrics (compare data) into xlsx workbook """
-    for sagic_name in DADOS_COMPARE:
+    if data is None:
+        data = DADOS_COMPARE
+    for sagic_name in data:
         # gen_type = sagic_gen_type[sagic_name]
         time_series = dict()
         time_series[sagic_name] = list()
         for cur_date in existing_dates:
-            if cur_date not in DADOS_COMPARE[sagic_name]:
-                DADOS_COMPARE[sagic_name][cur_date] = dict()
+            day_data = data[sagic_name][cur_date]\
+                if cur_date in data[sagic_name] else dict()
             cur_date_data = dict()
             cur_date_data['Data'] = cur_date
             for metric in existing_metrics:
@@ -654,20 +1045,18 @@ def __write_metrics_xlsx(params, existing_dates, existing_metrics):
                         metric.endswith('_s'),
                         metric.endswith('_ne'),
                         metric.endswith('_n')]) and sagic_name == 'cmo':
-                    if metric not in DADOS_COMPARE[sagic_name][cur_date]:
+                    if metric not in day_data:
                         cur_date_data[metric] = ''
                     else:
-                        cur_date_data[metric] = DADOS_COMPARE[
-                            sagic_name][cur_date][metric]
+                        cur_date_data[metric] = day_data[metric]
                 elif not any([metric.endswith('_se'),
                               metric.endswith('_s'),
                               metric.endswith('_ne'),
                               metric.endswith('_n')]) and sagic_name != 'cmo':
-                    if metric not in DADOS_COMPARE[sagic_name][cur_date]:
+                    if metric not in day_data:
                         cur_date_data[metric] = ''
                     else:
-                        cur_date_data[metric] = DADOS_COMPARE[
-                            sagic_name][cur_date][metric]
+                        cur_date_data[metric] = day_data[metric]
             time_series[sagic_name].append(cur_date_data)
         logging.info('Outputting to excel: %s_indicadores.xlsx', sagic_name)
         write_xlsx(
@@ -675,81 +1064,50 @@ def __write_metrics_xlsx(params, existing_dates, existing_metrics):
             filename='%s/%s_indicadores.xlsx' % (params['storage_folder'],
                                                  sagic_name))
 
-def __write_cmo_csv(params):
+def __write_cmo_csv(params, cmo_data=None):
     """ writes cmo to csv"""
-    tstamp_dict, tstamp_index, _ = __compute_cmo_data()
+    if cmo_data is None:
+        cmo_data = __compute_cmo_data()
+    tstamp_dict, tstamp_index, _ = cmo_data
     dest_file = '%s/cmo_%s_%s.csv' % (params['storage_folder'],
                                       params['deck_provider'],
                                       params['network'])
-    with open(dest_file, 'w') as cur_file:
-        cur_file.write('%s;%s;%s;%s;%s\n' %
-                       ('datetime',
-                        's',
-                        'se',
-                        'ne',
-                        'n'))
-        for tstamp in tstamp_index:
-            dtime = datetime.fromtimestamp(int(tstamp/1000),
-                                           tz=LOCAL_TIMEZONE)
-            sul = locale.str(tstamp_dict[tstamp]['s'])\
-                if tstamp_dict[tstamp]['s'] != '' else ''
-            sudeste = locale.str(tstamp_dict[tstamp]['se'])\
-                if tstamp_dict[tstamp]['se'] != '' else ''
-            nordeste = locale.str(tstamp_dict[tstamp]['ne'])\
-                if tstamp_dict[tstamp]['ne'] != '' else ''
-            norte = locale.str(tstamp_dict[tstamp]['n'])\
-                if tstamp_dict[tstamp]['n'] != '' else ''
-            cur_file.write('%s;%s;%s;%s;%s\n' %
-                           (dtime.isoformat(),
-                            sul,
-                            sudeste,
-                            nordeste,
-                            norte))
-    logging.info('Finished outputting data into csv file: %s', dest_file)
-
-def __write_gen_csv(plant, dest_path):
-    """ writes generation to csv """
-    tstamp_dict = dict()
-    for dtime in DADOS_COMPARE[plant]:
-        for data_type in ['verificada', 'programada', 'dessem']:
-            if data_type not in DADOS_COMPARE[plant][dtime]:
-                continue
-            for tstamp in DADOS_COMPARE[plant][dtime][data_type]:
-                if tstamp not in tstamp_dict:
-                    tstamp_dict[tstamp] = dict()
-                tstamp_dict[tstamp][data_type] = DADOS_COMPARE[
-                    plant][dtime][data_type][tstamp]
-    tstamp_index = list(tstamp_dict)
-    tstamp_index.sort()
-    for tstamp in tstamp_index:
-        for data_type in ['verificada', 'programada', 'dessem']:
-            if data_type not in tstamp_dict[tstamp]:
-                tstamp_dict[tstamp][
-                    data_type] = ''
-    dest_file = dest_path + '/' + plant + '.csv'
-    with open(dest_file, 'w') as cur_file:
-        cur_file.write('%s;%s;%s;%s\n' %
-                       ('datetime',
-                        'dessem',
-                        'verificada',
-                        'programada'))
-        for tstamp in tstamp_index:
-            dtime = datetime.fromtimestamp(int(tstamp/1000),
-                                           tz=LOCAL_TIMEZONE)
-            dessem = locale.str(tstamp_dict[tstamp]['dessem'])\
-                if tstamp_dict[tstamp]['dessem'] != '' else ''
-            verificada = locale.str(tstamp_dict[tstamp]['verificada'])\
-                if tstamp_dict[tstamp]['verificada'] != '' else ''
-            programada = locale.str(tstamp_dict[tstamp]['programada'])\
-                if tstamp_dict[tstamp]['programada'] != '' else ''
-            cur_file.write('%s;%s;%s;%s\n' %
-                           (dtime.isoformat(),
-                            dessem,
-                            verificada,
-                            programada))
-    logging.info('Finished outputting data into csv file: %s', dest_file)
-
-def __write_compare_csv(plant, dest_path):
+    with CsvWriter(dest_file, params.get('csv_compression')) as writer:
+        writer.writerow(['datetime', 's', 'se', 'ne', 'n'])
+        cell = writer.cell
+        writer.writerows(
+            [dtime] + [cell(tstamp_dict[tstamp][subsis])
+                       for subsis in ['s', 'se', 'ne', 'n']]
+            for tstamp, dtime in zip(tstamp_index,
+                                     LOCAL_TABLE.isoformat(tstamp_index)))
+
+def __write_gen_csv(plant, dest_path, compression=None):
+    """ writes generation to csv. Each series is formatted as a whole
+        column over the union of the timestamps of all series """
+    data_types = ['dessem', 'verificada', 'programada']
+    series = dict((data_type, DADOS_COMPARE.series(plant, data_type))
+                  for data_type in data_types
+                  if DADOS_COMPARE.has_series(plant, data_type))
+    tstamp_index = np.unique(np.concatenate(
+        [tstamps for tstamps, _ in series.values()] +
+        [np.empty(0, np.int64)]))
+    with CsvWriter(dest_path + '/' + plant + '.csv',
+                   compression) as writer:
+        columns = list()
+        for data_type in data_types:
+            column = [''] * len(tstamp_index)
+            if data_type in series:
+                tstamps, values = series[data_type]
+                for pos, value in zip(
+                        np.searchsorted(tstamp_index, tstamps).tolist(),
+                        values.tolist()):
+                    column[pos] = writer.number(value)
+            columns.append(column)
+        writer.writerow(['datetime'] + data_types)
+        writer.writerows(zip(LOCAL_TABLE.isoformat(tstamp_index),
+                             *columns))
+
+def __write_compare_csv(plant, dest_path, compression=None):
     """ writes generation to csv """
     dtimes_dict = dict()
     data_types = list()
@@ -772,25 +1130,29 @@ def __write_compare_csv(plant, dest_path):
                 dtimes_dict[dtime][
                     data_type] = ''
     dest_file = dest_path + '/' + plant + '_indicadores.csv'
-    dump_to_csv(dest_file, dtimes_dict, data_types, dtimes)
+    dump_to_csv(dest_file, dtimes_dict, data_types, dtimes, compression)
 
-def write_csv(params):
+def write_csv(params, cmo_data=None):
     """ outputs data to individual files as specified by EDP """
     for plant in DADOS_COMPARE:
         if plant == 'cmo':
-            __write_cmo_csv(params)
+            __write_cmo_csv(params, cmo_data)
         else:
-            __write_gen_csv(plant, params['storage_folder'])
-            __write_compare_csv(plant, params['storage_folder'])
+            __write_gen_csv(plant, params['storage_folder'],
+                            params.get('csv_compression'))
+            __write_compare_csv(plant, params['storage_folder'],
+                                params.get('csv_compression'))
 
-def __prepare_wrapup_metrics():
+def __prepare_wrapup_metrics(data=None):
     """ prepare metrics to be exported """
+    if data is None:
+        data = DADOS_COMPARE
     metrics = dict()
     dates = dict()
-    for sagic_name in DADOS_COMPARE:
-        for cur_date in DADOS_COMPARE[sagic_name]:
+    for sagic_name in data:
+        for cur_date in data[sagic_name]:
             dates[cur_date] = cur_date
-            for metric in DADOS_COMPARE[sagic_name][cur_date]:
+            for metric in data[sagic_name][cur_date]:
                 metrics[metric] = metric
     existing_dates = list(dates)
     existing_dates.sort()
@@ -809,92 +1171,361 @@ def __prepare_wrapup_metrics():
     existing_metrics.sort()
     return existing_dates, existing_metrics
 
+def __write_plant_parquet(params, sagic_name):
+    """ Grava as series e os indicadores diarios de uma planta (ou do CMO)
+        em storage_folder/parquet/{compare,cmo}_{series,indicators},
+        particionados por provedor do deck, rede e planta (ver
+        dessemstats.columnar) """
+    folder = params['storage_folder'] + '/parquet'
+    keys = [('deck_provider', params['deck_provider']),
+            ('network', params['network'])]
+    if sagic_name == 'cmo':
+        dataset, names = 'cmo', CMO_SERIES
+    else:
+        dataset, names = 'compare', COMPARE_SERIES
+        keys.append(('plant', sagic_name))
+    export_series('%s/%s_series' % (folder, dataset), keys,
+                  dict((name, DADOS_COMPARE.series(sagic_name, name))
+                       for name in names
+                       if DADOS_COMPARE.has_series(sagic_name, name)))
+    export_indicators('%s/%s_indicators' % (folder, dataset), keys,
+                      DADOS_COMPARE.plant(sagic_name).indicators)
+
+def __write_plant_database(params, sagic_name):
+    """ Grava (com upsert) as series e os indicadores diarios de uma planta
+        (ou do CMO, com source 'cmo') no banco de resultados
+        params['output_database'] (ver dessemstats.database) """
+    source = 'cmo' if sagic_name == 'cmo' else 'compare'
+    names = CMO_SERIES if sagic_name == 'cmo' else COMPARE_SERIES
+    keys = (params['deck_provider'], params['network'])
+    with closing(connect_database(params['output_database'])) as con:
+        upsert_series(con, source, keys, sagic_name,
+                      dict((name, DADOS_COMPARE.series(sagic_name, name))
+                           for name in names
+                           if DADOS_COMPARE.has_series(sagic_name, name)))
+        upsert_indicators(con, source, keys, sagic_name,
+                          DADOS_COMPARE.plant(sagic_name).indicators)
+
+def __write_plant_outputs(params, sagic_name, metrics=None):
+    """ Grava as saidas (XLSX e CSV) de uma planta (ou do CMO) presente em
+        DADOS_COMPARE. Com metrics=(datas, indicadores) (ver
+        __prepare_wrapup_metrics), grava tambem a planilha de indicadores
+        da planta """
+    if sagic_name == 'cmo':
+        cmo_data = __compute_cmo_data()
+        if params['output_xls']:
+            write_cmo_xlsx(*cmo_data, params)
+        if params['output_csv']:
+            __write_cmo_csv(params, cmo_data)
+    else:
+        if params['output_xls']:
+            __write_plant_xlsx(params, sagic_name)
+        if params['output_csv']:
+            __write_gen_csv(sagic_name, params['storage_folder'],
+                            params.get('csv_compression'))
+            __write_compare_csv(sagic_name, params['storage_folder'],
+                                params.get('csv_compression'))
+    if params.get('output_parquet', False):
+        __write_plant_parquet(params, sagic_name)
+    if params.get('output_database'):
+        __write_plant_database(params, sagic_name)
+    if params['output_xls'] and metrics:
+        __write_metrics_xlsx(params, metrics[0], metrics[1],
+                             {sagic_name: DADOS_COMPARE[sagic_name]})
+
+
+def plant_output_task(task):
+    """ Tarefa do estagio de saida em processos: carrega uma planta do
+        armazenamento de resultados para o DADOS_COMPARE do processo e
+        grava as suas saidas (ver __write_plant_outputs) """
+    params, folder, sagic_name, metrics = task
+    DADOS_COMPARE.clear()
+    load_compare(PartitionedStore(folder), DADOS_COMPARE, [sagic_name],
+                 params['ini_date'].date(), params['end_date'].date())
+    __write_plant_outputs(params, sagic_name, metrics)
+    DADOS_COMPARE.clear()
+    return sagic_name
+
+
+def __parallel_outputs(params, results):
+    """ Estagio de saida em params['output_workers'] processos: cada
+        processo le as suas plantas do armazenamento de resultados
+        (gravado por do_compare) e grava os seus arquivos. O processo
+        principal apenas levanta as datas e indicadores da planilha de
+        indicadores e distribui as plantas, das maiores para as menores """
+    metrics = __prepare_wrapup_metrics()
+    output_params = dict((key, params.get(key)) for key in OUTPUT_PARAMS)
+    sizes = dict((sagic_name, sum(
+        len(series.tstamps) for series in DADOS_COMPARE.plant(
+            sagic_name).series.values())) for sagic_name in DADOS_COMPARE)
+    tasks = [(output_params, results.folder, sagic_name, metrics)
+             for sagic_name in sorted(sizes, key=sizes.get, reverse=True)]
+    map_outputs(plant_output_task, tasks, params['output_workers'])
+
+
+def __plant_groups(params):
+    """ Agrupa as plantas (nomes DESSEM) de params['compare_plants'] (ou
+        todas) que compartilham nomes SAGIC e que, portanto, precisam ser
+        consultadas e calculadas juntas """
+    groups = list()
+    for gen_type in params['dessem_sagic_name']:
+        for d_name, item in params['dessem_sagic_name'][gen_type][
+                'by_cepelname'].items():
+            if (params['compare_plants'] and
+                    d_name not in params['compare_plants']):
+                continue
+            d_names, s_names = set([d_name]), set(item['ons_sagic'])
+            for group in list(groups):
+                if group[0] & d_names or group[1] & s_names:
+                    d_names |= group[0]
+                    s_names |= group[1]
+                    groups.remove(group)
+            groups.append((d_names, s_names))
+    return [sorted(group[0]) for group in groups]
+
+
+def __day_indicators(sagic_name):
+    """ Retorna os indicadores diarios de uma planta de DADOS_COMPARE, sem
+        as series, no formato {dia: {indicador: valor}} (inclusive dias
+        sem indicadores) """
+    plant = DADOS_COMPARE.plant(sagic_name)
+    return dict((day, dict(plant.indicators.get(day, dict())))
+                for day in plant.days())
+
+
+def __stream_passes(params):
+    """ Monta as passagens do modo streaming: os grupos de plantas (ver
+        __plant_groups) sao reunidos em lotes de ao menos
+        params['max_concurrency'] unidades de consulta (planta, mes), de
+        modo que o motor de consultas se mantenha ocupado. O CMO eh
+        consultado na primeira passagem """
+    months = len(list(rrule(MONTHLY, dtstart=params['ini_date'],
+                            until=params['end_date'])))
+    target = params.get('max_concurrency', 10)
+    batches = [list()]
+    if params['query_gen']:
+        for d_names in __plant_groups(params):
+            if len(batches[-1]) * months >= target:
+                batches.append(list())
+            batches[-1].extend(d_names)
+    passes = [dict(params, compare_plants=d_names, query_gen=bool(d_names),
+                   query_cmo=params['query_cmo'] and not ibatch,
+                   record_coverage=False)
+              for ibatch, d_names in enumerate(batches)]
+    return [pass_params for pass_params in passes
+            if pass_params['query_gen'] or pass_params['query_cmo']]
+
+
+def __stream_compare(params):
+    """ Processa a comparacao por lotes de plantas (params['streaming']):
+        para cada passagem (ver __stream_passes), consulta os dados,
+        calcula os indicadores, grava os resultados e as saidas das
+        plantas e descarta as series antes da proxima passagem. Apenas os
+        indicadores diarios sao mantidos ate o fim, para a planilha de
+        indicadores. O pico de memoria eh limitado pelo maior lote. Todas
+        as passagens compartilham o motor de consultas e a capacidade
+        instalada, e a consulta completa eh registrada uma unica vez no
+        registro de cobertura, caso todas as passagens tenham sucesso """
+    indicators = dict()
+    passes = __stream_passes(params)
+    engine = FetchEngine(params['con_pool'],
+                         params.get('max_concurrency', 10))
+    capacity = __installed_capacity(params)
+    complete = True
+    try:
+        for ipass, pass_params in enumerate(passes):
+            logging.info('Streaming pass %d/%d: %s', ipass + 1,
+                         len(passes),
+                         ', '.join(pass_params['compare_plants']) or 'cmo')
+            DADOS_COMPARE.clear()
+            _, pass_complete = do_compare(params=dict(
+                pass_params, engine=engine, installed_capacity=capacity))
+            complete = complete and pass_complete
+            for sagic_name in DADOS_COMPARE:
+                __write_plant_outputs(params, sagic_name)
+                indicators[sagic_name] = __day_indicators(sagic_name)
+    finally:
+        engine.close()
+    if complete:
+        results = __compare_results(params)
+        add_coverage(results, coverage_request(
+            __requested_names(params, __compare_kinds(params)),
+            params['ini_date'].date(), params['end_date'].date(),
+            __compare_kinds(params)))
+        results.commit()
+    DADOS_COMPARE.clear()
+    if params['output_xls']:
+        existing_dates, existing_metrics = __prepare_wrapup_metrics(
+            indicators)
+        __write_metrics_xlsx(params, existing_dates, existing_metrics,
+                             indicators)
+
+
 def wrapup_compare(params):
-    """ Empacota os resultados de comparacao entre SAGIC e DESSEM """
+    """ Empacota os resultados de comparacao entre SAGIC e DESSEM. Com
+        params['streaming'], as plantas sao processadas uma a uma (ver
+        __stream_compare); com params['output_workers'] > 1, os arquivos
+        das plantas sao gravados em processos (ver __parallel_outputs).
+        Com params['output_parquet'], as series e os indicadores tambem
+        sao gravados em Parquet (ver __write_plant_parquet) e, com
+        params['output_database'], no banco de resultados (ver
+        __write_plant_database) """
     logging.info('Wrapping up...')
+    require_compression(params.get('csv_compression'))
+    if params.get('output_parquet', False):
+        require_pyarrow()
     connect_miran(params)
     load_files(params)
-    do_compare(params=params)
-    if params['output_xls']:
-        data, tstamps, data_types = __compute_cmo_data()
-        write_cmo_xlsx(data, tstamps, data_types, params)
-        for sagic_name in DADOS_COMPARE:
-            __write_plant_xlsx(params, sagic_name)
-        existing_dates, existing_metrics = __prepare_wrapup_metrics()
-        __write_metrics_xlsx(params, existing_dates, existing_metrics)
-        if params['query_pld']:
-            write_pld_xlsx(params['con'],
-                           params['ini_date'],
-                           params['end_date'],
-                           params['storage_folder'])
-        if params['query_load'] or params['query_wind']:
-            write_load_gen_xlsx(params['con'],
-                                params['ini_date'],
-                                params['end_date'],
-                                params['storage_folder'],
-                                params['query_load'],
-                                params['query_wind'],
-                                params['query_gen'])
-            write_interchange_xlsx(params['con'],
-                                   params['ini_date'],
-                                   params['end_date'],
-                                   params['storage_folder'])
-    if params['output_csv']:
-        write_csv(params)
+    if params.get('streaming', False):
+        __stream_compare(params)
+    elif params.get('output_workers', 1) > 1:
+        __parallel_outputs(params, do_compare(params=params)[0])
+    else:
+        do_compare(params=params)
+        cmo_data = None
+        if 'cmo' in DADOS_COMPARE:
+            cmo_data = __compute_cmo_data()
+        if params['output_xls']:
+            if cmo_data:
+                write_cmo_xlsx(*cmo_data, params)
+            for sagic_name in DADOS_COMPARE:
+                __write_plant_xlsx(params, sagic_name)
+            existing_dates, existing_metrics = __prepare_wrapup_metrics()
+            __write_metrics_xlsx(params, existing_dates, existing_metrics)
+        if params['output_csv']:
+            write_csv(params, cmo_data)
+        if params.get('output_parquet', False):
+            for sagic_name in DADOS_COMPARE:
+                __write_plant_parquet(params, sagic_name)
+        if params.get('output_database'):
+            for sagic_name in DADOS_COMPARE:
+                __write_plant_database(params, sagic_name)
+    # each dataset below is queried once and written to every format
+    output_parquet = params.get('output_parquet', False)
+    database = params.get('output_database')
+    if (params['output_xls'] or params['output_csv'] or output_parquet or
+            database):
         if params['query_pld']:
-            write_pld_csv(params['con'],
-                          params['ini_date'],
-                          params['end_date'],
-                          params['storage_folder'])
+            export_pld(params['con'],
+                       params['ini_date'],
+                       params['end_date'],
+                       params['storage_folder'],
+                       output_xls=params['output_xls'],
+                       output_csv=params['output_csv'],
+                       compression=params.get('csv_compression'),
+                       output_parquet=output_parquet,
+                       database=database)
         if params['query_load'] or params['query_wind']:
-            write_load_gen_csv(params['con'],
+            export_load_gen(params['con_pool'],
+                            params['ini_date'],
+                            params['end_date'],
+                            params['storage_folder'],
+                            params['query_load'],
+                            params['query_wind'],
+                            params['query_gen'],
+                            params.get('max_concurrency', 10),
+                            output_xls=params['output_xls'],
+                            output_csv=params['output_csv'],
+                            compression=params.get('csv_compression'),
+                            output_parquet=output_parquet,
+                            database=database)
+            export_interchange(params['con'],
                                params['ini_date'],
                                params['end_date'],
                                params['storage_folder'],
-                               params['query_load'],
-                               params['query_wind'],
-                               params['query_gen'])
-            write_interchange_csv(params['con'],
-                                  params['ini_date'],
-                                  params['end_date'],
-                                  params['storage_folder'])
+                               output_xls=params['output_xls'],
+                               output_csv=params['output_csv'],
+                               compression=params.get('csv_compression'),
+                               output_parquet=output_parquet,
+                               database=database)
     logging.info('Finished!')
 
 
+def __requested_dessem(params):
+    """ Retorna DADOS_DESSEM restrito aos dias da consulta. Os resultados
+        armazenados sao carregados por mes (ver __load_results), de modo
+        que DADOS_DESSEM pode conter dias de execucoes anteriores fora do
+        intervalo, que nao fazem parte das saidas """
+    first, last = params['ini_date'].date(), params['end_date'].date()
+    return dict((sagic_name, dict(
+        (day, day_data) for day, day_data in plant_data.items()
+        if first <= day <= last))
+                for sagic_name, plant_data in DADOS_DESSEM.items())
+
+def __write_dessem_parquet(params, dessem_data):
+    """ Grava as series de cada deck e os indicadores diarios de
+        'dessem_data' (ver __requested_dessem) em
+        storage_folder/parquet/dessem_{series,indicators}, particionados
+        por provedor do deck, rede e planta """
+    folder = params['storage_folder'] + '/parquet'
+    for sagic_name, plant_data in dessem_data.items():
+        keys = [('deck_provider', params['deck_provider']),
+                ('network', params['network']), ('plant', sagic_name)]
+        export_deck_series(folder + '/dessem_series', keys, plant_data,
+                           DESSEM_SERIES)
+        export_indicators(folder + '/dessem_indicators', keys, dict(
+            (day, dict((key, value) for key, value in day_data.items()
+                       if key not in DESSEM_SERIES))
+            for day, day_data in plant_data.items()))
+
+def __write_dessem_database(params, dessem_data):
+    """ Grava (com upsert) as series de cada deck e os indicadores diarios
+        de 'dessem_data' (ver __requested_dessem) no banco de resultados
+        params['output_database'], com source 'dessem' """
+    keys = (params['deck_provider'], params['network'])
+    with closing(connect_database(params['output_database'])) as con:
+        for sagic_name, plant_data in dessem_data.items():
+            upsert_deck_series(con, keys, sagic_name, plant_data,
+                               DESSEM_SERIES)
+            upsert_indicators(con, 'dessem', keys, sagic_name, dict(
+                (day, dict((key, value) for key, value in day_data.items()
+                           if key not in DESSEM_SERIES))
+                for day, day_data in plant_data.items()))
+
 def wrapup_ts_dessem(params):
-    """ Empacota os  resultados das estatisticas das series do DESSEM """
+    """ Empacota os  resultados das estatisticas das series do DESSEM. Com
+        params['output_parquet'], as series de cada deck e os indicadores
+        tambem sao gravados em Parquet (ver __write_dessem_parquet) e, com
+        params['output_database'], no banco de resultados (ver
+        __write_dessem_database) """
+    require_compression(params.get('csv_compression'))
+    if params.get('output_parquet', False):
+        require_pyarrow()
     connect_miran(params)
     load_files(params)
     do_ts_dessem(params=params)
+    dessem_data = __requested_dessem(params)
+    if params.get('output_parquet', False):
+        __write_dessem_parquet(params, dessem_data)
+    if params.get('output_database'):
+        __write_dessem_database(params, dessem_data)
     metrics = dict()
     dates = dict()
-    for sagic_name in DADOS_DESSEM:
-        for cur_date in DADOS_DESSEM[sagic_name]:
+    for sagic_name in dessem_data:
+        for cur_date in dessem_data[sagic_name]:
             dates[cur_date] = cur_date
-            for metric in DADOS_DESSEM[sagic_name][cur_date]:
+            for metric in dessem_data[sagic_name][cur_date]:
                 metrics[metric] = metric
     time_series = dict()
     existing_dates = list(dates)
     existing_dates.sort()
-    del metrics['dessem_gen']
-    del metrics['dessem_vol']
+    metrics.pop('dessem_gen', None)
+    metrics.pop('dessem_vol', None)
     existing_metrics = list(metrics)
     existing_metrics.sort()
     logging.info('Wrapping up...')
-    for sagic_name in DADOS_DESSEM:
+    for sagic_name in dessem_data:
         # gen_type = sagic_gen_type[sagic_name]
         time_series[sagic_name] = list()
         for cur_date in existing_dates:
-            if cur_date not in DADOS_DESSEM[sagic_name]:
-                DADOS_DESSEM[sagic_name][cur_date] = dict()
+            day_data = dessem_data[sagic_name].get(cur_date, dict())
             cur_date_data = dict()
             cur_date_data['Data'] = cur_date
             for metric in existing_metrics:
-                if metric not in DADOS_DESSEM[sagic_name][cur_date]:
+                if metric not in day_data:
                     cur_date_data[metric] = ''
                 else:
-                    cur_date_data[metric] = DADOS_DESSEM[
-                        sagic_name][cur_date][metric]
+                    cur_date_data[metric] = day_data[metric]
             time_series[sagic_name].append(cur_date_data)
     logging.info('Outputting to excel: dessem_statistics.xlsx')
     if params['output_xls']:
@@ -0,0 +1,102 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+import csv
+import gzip
+import locale
+import logging
+
+try:
+    import zstandard
+except ImportError:
+    # compressao zstd opcional
+    zstandard = None
+
+BUFFER_SIZE = 1 << 20
+BLOCK_ROWS = 4096
+SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+
+def number_format():
+    """ Retorna uma funcao equivalente a locale.str ('%.12g' com o
+        separador decimal do locale), com o separador obtido do locale
+        corrente uma unica vez, e nao a cada valor """
+    decimal_point = locale.localeconv()['decimal_point']
+    if decimal_point == '.':
+        return '%.12g'.__mod__
+    return lambda value: ('%.12g' % value).replace('.', decimal_point)
+
+
+def require_compression(compression):
+    """ Verifica se a compressao 'compression' (params['csv_compression'])
+        eh valida e esta disponivel """
+    assert compression in SUFFIXES,\
+        'compression must be one of: None, gzip, zstd'
+    assert compression != 'zstd' or zstandard is not None,\
+        'zstd compression requires the zstandard package'
+
+
+def open_text(filename, compression=None):
+    """ Abre um arquivo texto para escrita, com buffer, opcionalmente
+        comprimido com 'gzip' ou 'zstd' """
+    require_compression(compression)
+    if compression == 'gzip':
+        return gzip.open(filename, 'wt', compresslevel=6, newline='')
+    if compression == 'zstd':
+        return zstandard.open(filename, 'wt', newline='')
+    return open(filename, 'w', buffering=BUFFER_SIZE, newline='')
+
+
+class CsvWriter(object):
+    """ Escrita de arquivos CSV separados por ';' (modulo csv), com as
+        linhas acumuladas e gravadas em blocos de 'block_rows' linhas.
+        Com 'compression' ('gzip' ou 'zstd'), a extensao correspondente eh
+        acrescentada ao nome do arquivo. Os numeros sao formatados com
+        'number' (ver number_format) """
+
+    def __init__(self, dest_file, compression=None, block_rows=BLOCK_ROWS):
+        self.filename = dest_file + SUFFIXES.get(compression, '')
+        self.handle = open_text(self.filename, compression)
+        self.writer = csv.writer(self.handle, delimiter=';',
+                                 lineterminator='\n')
+        self.block_rows = block_rows
+        self.block = list()
+        self.number = number_format()
+
+    def cell(self, value):
+        """ Formata uma celula numerica ('' para valores ausentes) """
+        return self.number(value) if value != '' else ''
+
+    def writerow(self, row):
+        """ Acrescenta uma linha (lista de textos) ao bloco corrente """
+        self.block.append(row)
+        if len(self.block) >= self.block_rows:
+            self.flush()
+
+    def writerows(self, rows):
+        """ Grava diretamente as linhas de um iteravel, apos o bloco
+            corrente """
+        self.flush()
+        self.writer.writerows(rows)
+
+    def flush(self):
+        """ Grava o bloco corrente """
+        self.writer.writerows(self.block)
+        self.block = list()
+
+    def close(self):
+        """ Grava o ultimo bloco e fecha o arquivo """
+        self.flush()
+        self.handle.close()
+        logging.info('Finished outputting data into csv file: %s',
+                     self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,157 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+import logging
+import os
+import sqlite3
+import numpy as np
+
+# espera (em segundos) pela liberacao do banco por outro processo
+TIMEOUT = 300
+# as chaves primarias sao os indices (tabelas WITHOUT ROWID): a consulta de
+# uma planta em um intervalo de datas eh uma busca no indice
+SCHEMA = ["""CREATE TABLE IF NOT EXISTS series (
+                 source TEXT NOT NULL,
+                 deck_provider TEXT NOT NULL,
+                 network TEXT NOT NULL,
+                 plant TEXT NOT NULL,
+                 datetime INTEGER NOT NULL,
+                 series TEXT NOT NULL,
+                 value REAL,
+                 PRIMARY KEY (source, deck_provider, network, plant,
+                              datetime, series)) WITHOUT ROWID""",
+          """CREATE TABLE IF NOT EXISTS indicators (
+                 source TEXT NOT NULL,
+                 deck_provider TEXT NOT NULL,
+                 network TEXT NOT NULL,
+                 plant TEXT NOT NULL,
+                 date TEXT NOT NULL,
+                 metric TEXT NOT NULL,
+                 value REAL,
+                 PRIMARY KEY (source, deck_provider, network, plant, date,
+                              metric)) WITHOUT ROWID""",
+          """CREATE TABLE IF NOT EXISTS deck_series (
+                 deck_provider TEXT NOT NULL,
+                 network TEXT NOT NULL,
+                 plant TEXT NOT NULL,
+                 deck TEXT NOT NULL,
+                 datetime INTEGER NOT NULL,
+                 series TEXT NOT NULL,
+                 value REAL,
+                 PRIMARY KEY (deck_provider, network, plant, deck, datetime,
+                              series)) WITHOUT ROWID""",
+          """CREATE TABLE IF NOT EXISTS timeseries (
+                 name TEXT NOT NULL,
+                 series TEXT NOT NULL,
+                 datetime INTEGER NOT NULL,
+                 value REAL,
+                 PRIMARY KEY (name, series, datetime)) WITHOUT ROWID"""]
+UPSERT = """INSERT INTO %s (%s) VALUES (%s)
+            ON CONFLICT (%s) DO UPDATE SET value = excluded.value"""
+KEYS = {'series': ['source', 'deck_provider', 'network', 'plant',
+                   'datetime', 'series'],
+        'indicators': ['source', 'deck_provider', 'network', 'plant',
+                       'date', 'metric'],
+        'deck_series': ['deck_provider', 'network', 'plant', 'deck',
+                        'datetime', 'series'],
+        'timeseries': ['name', 'series', 'datetime']}
+
+
+def connect(filename):
+    """ Abre (criando, se necessario) o banco de resultados em 'filename'
+        (SQLite). As datas sao gravadas em ISO 8601 e os instantes como
+        timestamps em ms """
+    folder = os.path.dirname(filename)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    con = sqlite3.connect(filename, timeout=TIMEOUT)
+    con.execute('PRAGMA journal_mode = WAL')
+    con.execute('PRAGMA synchronous = NORMAL')
+    with con:
+        for statement in SCHEMA:
+            con.execute(statement)
+    return con
+
+
+def upsert(con, table, rows):
+    """ Insere (ou atualiza o valor de) linhas de uma tabela em uma unica
+        transacao. As linhas sao as chaves da tabela (ver KEYS) seguidas
+        do valor. Retorna o numero de linhas gravadas """
+    names = KEYS[table] + ['value']
+    statement = UPSERT % (table, ', '.join(names),
+                          ', '.join('?' * len(names)), ', '.join(KEYS[table]))
+    with con:
+        count = con.executemany(statement, rows).rowcount
+    logging.info('Database table %s: %d rows written', table, count)
+    return count
+
+
+def number(value):
+    """ Converte um valor (ou '' para ausente) para float ou None """
+    if value == '' or value is None:
+        return None
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+def upsert_series(con, source, keys, plant, series):
+    """ Grava as series {nome: (timestamps, valores)} de uma planta, com
+        'keys' = (provedor do deck, rede) """
+    return upsert(con, 'series', (
+        (source,) + tuple(keys) + (plant, tstamp, name, number(value))
+        for name, (tstamps, values) in series.items()
+        for tstamp, value in zip(np.asarray(tstamps).tolist(),
+                                 np.asarray(values).tolist())))
+
+
+def upsert_indicators(con, source, keys, plant, indicators):
+    """ Grava os indicadores diarios {dia: {indicador: valor}} de uma
+        planta """
+    return upsert(con, 'indicators', (
+        (source,) + tuple(keys) + (plant, day.isoformat(), metric,
+                                   number(value))
+        for day, day_indicators in indicators.items()
+        for metric, value in day_indicators.items()))
+
+
+def upsert_deck_series(con, keys, plant, plant_data, series_names):
+    """ Grava as series de cada deck diario {dia: {serie: {timestamp:
+        valor}}} de uma planta. Os timestamps do DESSEM (em segundos) sao
+        gravados em ms, como nas demais tabelas """
+    return upsert(con, 'deck_series', (
+        tuple(keys) + (plant, day.isoformat(), int(tstamp) * 1000, name,
+                       number(value))
+        for day, day_data in plant_data.items()
+        for name in series_names
+        for tstamp, value in day_data.get(name, dict()).items()))
+
+
+def upsert_timeseries(con, name, data, dtimes, ts_names):
+    """ Grava um conjunto {datetime: {serie: valor}} ja consultado (ver
+        interface.write_timeseries). Valores ausentes nao sao gravados """
+    return upsert(con, 'timeseries', (
+        (name, ts_name, int(dtime.timestamp() * 1000),
+         number(data[dtime][ts_name]))
+        for dtime in dtimes
+        for ts_name in ts_names
+        if data[dtime].get(ts_name, '') != ''))
+
+
+def plant_series(con, source, keys, plant, ini_tstamp, end_tstamp):
+    """ Retorna as series {nome: (timestamps, valores)} de uma planta no
+        intervalo [ini_tstamp, end_tstamp) (busca no indice) """
+    series = dict()
+    for name, tstamp, value in con.execute(
+            """SELECT series, datetime, value FROM series
+               WHERE source = ? AND deck_provider = ? AND network = ?
+               AND plant = ? AND datetime >= ? AND datetime < ?
+               ORDER BY datetime""",
+            (source,) + tuple(keys) + (plant, ini_tstamp, end_tstamp)):
+        points = series.setdefault(name, (list(), list()))
+        points[0].append(tstamp)
+        points[1].append(value)
+    return series
@@ -0,0 +1,203 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from queue import Queue, Empty
+from threading import Lock
+from time import time
+
+
+class ConnectionPool(object):
+    """ Pool de conexoes autenticadas com o Miran. Cada chamada retira uma
+        conexao exclusiva do pool (criada sob demanda por 'factory' ate o
+        limite 'size'), de modo que threads concorrentes nao compartilham
+        a mesma sessao. Conexoes ociosas por mais de 'keepalive' segundos
+        ou com a sessao expirada sao encerradas e substituidas por novas
+        (re-login). O pool expoe a mesma interface de
+        barrel_client.Connection """
+
+    def __init__(self, factory, size=10, keepalive=300):
+        assert isinstance(size, int) and size > 0,\
+            'size must be a positive integer'
+        self.factory = factory
+        self.size = size
+        self.keepalive = keepalive
+        self.idle = Queue()
+        self.created = 0
+        self.lock = Lock()
+
+    def __fresh(self):
+        """ Cria uma nova conexao autenticada """
+        logging.debug('Opening new pooled Miran connection')
+        return self.factory()
+
+    @staticmethod
+    def __discard(con):
+        """ Encerra a sessao de uma conexao substituida (logout ou close,
+            conforme disponivel). Falhas sao ignoradas, pois a sessao pode
+            ja ter expirado no servidor """
+        for method in ['logout', 'close']:
+            func = getattr(con, method, None)
+            if func is None:
+                continue
+            try:
+                func()
+            except Exception as exc:
+                logging.debug('Unable to %s Miran connection: %s', method,
+                              repr(exc))
+            return
+
+    def __replace(self):
+        """ Cria uma conexao para uma vaga do pool, liberando a vaga caso
+            o login falhe """
+        try:
+            return self.__fresh()
+        except Exception:
+            with self.lock:
+                self.created -= 1
+            raise
+
+    def acquire(self):
+        """ Retira uma conexao valida do pool, bloqueando enquanto todas
+            as 'size' conexoes estiverem em uso """
+        try:
+            con, last_used = self.idle.get_nowait()
+        except Empty:
+            with self.lock:
+                can_create = self.created < self.size
+                if can_create:
+                    self.created += 1
+            if can_create:
+                return self.__replace()
+            con, last_used = self.idle.get()
+        if time() - last_used > self.keepalive or not con.is_logged():
+            self.__discard(con)
+            con = self.__replace()
+        return con
+
+    def release(self, con):
+        """ Devolve uma conexao ao pool """
+        self.idle.put((con, time()))
+
+    def run(self, method, *args, **kwargs):
+        """ Executa um metodo de barrel_client.Connection em uma conexao do
+            pool, refazendo o login e repetindo a chamada uma vez caso a
+            sessao tenha expirado """
+        con = self.acquire()
+        try:
+            try:
+                return getattr(con, method)(*args, **kwargs)
+            except Exception:
+                if con.is_logged():
+                    raise
+                logging.warning('Miran session expired, logging in again')
+                self.__discard(con)
+                con = None
+                con = self.__replace()
+                return getattr(con, method)(*args, **kwargs)
+        finally:
+            if con is not None:
+                self.release(con)
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return partial(self.run, method)
+
+
+class AsyncConnection(object):
+    """ Adaptador assincrono para barrel_client.Connection (ou para um
+        ConnectionPool): cada chamada sincrona eh executada no pool de
+        threads do motor de consultas """
+
+    def __init__(self, engine, con):
+        self.engine = engine
+        self.con = con
+
+    async def get_timeseries(self, **kwargs):
+        """ Versao assincrona de Connection.get_timeseries """
+        return await self.engine.call(self.con.get_timeseries, **kwargs)
+
+    async def get_points(self, **kwargs):
+        """ Versao assincrona de Connection.get_points """
+        return await self.engine.call(self.con.get_points, **kwargs)
+
+    async def get_timeseries_sum(self, **kwargs):
+        """ Versao assincrona de Connection.get_timeseries_sum """
+        return await self.engine.call(self.con.get_timeseries_sum, **kwargs)
+
+    async def consulta_miran_web(self, **kwargs):
+        """ Versao assincrona de Connection.consulta_miran_web """
+        return await self.engine.call(self.con.consulta_miran_web, **kwargs)
+
+
+class FetchEngine(object):
+    """ Motor de consultas baseado em asyncio. Todas as chamadas de rede
+        de uma execucao compartilham um unico limite de concorrencia
+        ('concurrency'), independente de quantas tarefas estejam ativas.
+        Para que as chamadas efetivamente ocorram em paralelo, 'con' deve
+        ser um ConnectionPool de tamanho compativel com 'concurrency' """
+
+    def __init__(self, con, concurrency=10):
+        assert isinstance(concurrency, int) and concurrency > 0,\
+            'concurrency must be a positive integer'
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.semaphore = None
+        self.con = AsyncConnection(self, con)
+
+    async def call(self, func, *args, **kwargs):
+        """ Executa uma funcao sincrona (bloqueante) respeitando o limite
+            de concorrencia do motor """
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, partial(func, *args, **kwargs))
+
+    async def group(self, coros, on_done=None, on_fail=None):
+        """ Agrupa as corrotinas de uma unidade de trabalho (ex.: uma planta
+            em um mes). A unidade termina quando todas as suas corrotinas
+            terminam, sem bloquear as demais unidades. 'on_done' eh chamado
+            apenas se todas tiverem sucesso e 'on_fail', caso contrario """
+        results = await asyncio.gather(*coros, return_exceptions=True)
+        success = True
+        for result in results:
+            if isinstance(result, Exception):
+                logging.error('Fetch task failed: %s', repr(result))
+                success = False
+            elif not result:
+                success = False
+        if success and on_done:
+            on_done()
+        elif not success and on_fail:
+            on_fail()
+        return success
+
+    async def __gather(self, coros):
+        """ Aguarda todas as tarefas, registrando as que falharam """
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*coros, return_exceptions=True)
+        for i, result in enumerate(results):
+            if isinstance(result, Exception):
+                logging.error('Fetch task failed: %s', repr(result))
+                results[i] = False
+        return results
+
+    def run(self, coros):
+        """ Executa uma lista de corrotinas e retorna seus resultados """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.__gather(coros))
+        finally:
+            loop.close()
+
+    def close(self):
+        """ Libera o pool de threads do motor """
+        self.executor.shutdown(wait=True)
@@ -5,75 +5,160 @@ Proprietary and confidential
 Written by Marcos Leone Filho <marcos@venidera.com>
 """
 
+import asyncio
 import logging
-import locale
+from contextlib import closing
 from datetime import datetime, date
+from functools import partial
 from string import Template
 from json import dumps
 from os import path
+from time import time
 import pytz
 import xlsxwriter
 import barrel_client
 from vplantnaming.naming import PlantNaming
+from dessemstats.catalog import TimeseriesIndex, TimeseriesCatalog
+from dessemstats.fetch import ConnectionPool, FetchEngine
+from dessemstats.cache import fingerprint, load_versioned, save_versioned
+from dessemstats.csvwriter import CsvWriter
+from dessemstats.columnar import export_timeseries
+from dessemstats.database import connect, upsert_timeseries
 
 LOCAL_TIMEZONE = pytz.timezone('America/Sao_Paulo')
+# metadados de get_file que identificam o conteudo de um arquivo (campos
+# ausentes sao considerados nulos)
+FILE_VERSION_FIELDS = ['name', 'size', 'modified', 'md5', 'hash']
 
-def load_files(params):
-    """ Carrega os arquivos necessarios para o processo """
-    con = params['con']
-    res = con.get_file(oid='file8884_1781')
-    naming = PlantNaming(con)
-    params['dessem_sagic_name'] = naming.match_dict
-    res = con.get_file(oid='file6093_3674')
-    query_file = params['tmp_folder'] + '/' + res['name']
-    if not path.exists(query_file):
-        query_file = con.download_file(oid='file6093_3674',
-                                       pto=params['tmp_folder'])
-    with open(query_file, 'r') as myfile:
-        query_template_str = Template(myfile.read())
-    params['query_template_str'] = query_template_str
-    res = con.get_file(oid='file2666_8636')
-    query_file = params['tmp_folder'] + '/' + res['name']
-    if not path.exists(query_file):
-        query_file = con.download_file(oid='file2666_8636',
+def __file_info(con, oid, manifest, ttl):
+    """ Retorna o nome e a versao de um arquivo do Miran. A versao eh o
+        hash dos metadados estaveis de get_file (FILE_VERSION_FIELDS), de
+        modo que um arquivo reenviado com o mesmo nome tem outra versao,
+        mas campos volateis (data de acesso, URL assinada) nao invalidam o
+        cache. Os metadados sao revalidados no maximo a cada 'ttl'
+        segundos (manifesto local) """
+    if (oid in manifest and 'version' in manifest[oid] and
+            time() - manifest[oid]['checked'] <= ttl):
+        return manifest[oid]
+    res = con.get_file(oid=oid)
+    manifest[oid] = dict(manifest.get(oid, dict()), name=res['name'],
+                         version=fingerprint(oid, [
+                             (field, res.get(field))
+                             for field in FILE_VERSION_FIELDS]),
+                         checked=time())
+    return manifest[oid]
+
+def __load_template(con, oid, params, manifest, ttl):
+    """ Carrega um modelo de consulta, baixando-o apenas se necessario
+        (arquivo ausente ou com outra versao) """
+    info = __file_info(con, oid, manifest, ttl)
+    query_file = params['tmp_folder'] + '/' + info['name']
+    if (not path.exists(query_file) or
+            info.get('downloaded') != info['version']):
+        query_file = con.download_file(oid=oid,
                                        pto=params['tmp_folder'])
+        info['downloaded'] = info['version']
     with open(query_file, 'r') as myfile:
-        query_template_str = Template(myfile.read())
-    params['query_cmo_template_str'] = query_template_str
+        return Template(myfile.read())
 
-def connect_miran(params):
-    """ Conecta na plataforma Miran e retorna o objeto de coneccao """
+def load_files(params):
+    """ Carrega os arquivos necessarios para o processo. A tabela de nomes
+        (PlantNaming) e os modelos de consulta ficam em cache no
+        tmp_folder e sao revalidados pelos metadados dos arquivos, no maximo
+        a cada params['files_ttl'] segundos """
+    con = params['con']
+    ttl = params.get('files_ttl', 3600)
+    manifest_file = params['tmp_folder'] + '/files_manifest.json'
+    manifest = load_versioned(manifest_file, 1) or dict()
+    naming_file = params['tmp_folder'] + '/plant_naming.pickle'
+    naming_version = fingerprint('file8884_1781', __file_info(
+        con, 'file8884_1781', manifest, ttl)['version'])
+    params['dessem_sagic_name'] = load_versioned(naming_file,
+                                                 naming_version)
+    if params['dessem_sagic_name'] is None:
+        naming = PlantNaming(con)
+        params['dessem_sagic_name'] = naming.match_dict
+        save_versioned(naming_file, naming_version, naming.match_dict)
+    else:
+        logging.debug('Plant naming loaded from: %s', naming_file)
+    params['query_template_str'] = __load_template(
+        con, 'file6093_3674', params, manifest, ttl)
+    params['query_cmo_template_str'] = __load_template(
+        con, 'file2666_8636', params, manifest, ttl)
+    save_versioned(manifest_file, 1, manifest)
+
+def new_connection(params):
+    """ Cria uma conexao autenticada com a plataforma Miran """
     con = barrel_client.Connection(server=params['server'],
                                    port=params['port'])
     con.do_login(username=params['username'],
                  password=params['password'])
+    return con
+
+def connect_miran(params):
+    """ Conecta na plataforma Miran e retorna o objeto de coneccao. Tambem
+        cria o pool de conexoes ('con_pool') usado pelas consultas
+        concorrentes """
+    con = new_connection(params)
     params['con'] = con
+    params['con_pool'] = ConnectionPool(
+        partial(new_connection, params),
+        size=params.get('pool_size', params.get('max_concurrency', 10)),
+        keepalive=params.get('pool_keepalive', 300))
+    catalog = None
+    if params.get('catalog_ttl', 86400):
+        catalog = TimeseriesCatalog(
+            params['tmp_folder'] + '/tsid_catalog.sqlite',
+            ttl=params.get('catalog_ttl', 86400))
+    params['ts_index'] = TimeseriesIndex(params['con_pool'], catalog)
 
-def dump_to_csv(dest_file, data, ts_names, dtimes):
-    """ dumps timeseries to csv file """
-    with open(dest_file, 'w') as cur_file:
-        cur_line = 'datetime'
-        for ts_name in ts_names:
-            cur_line += ';' + ts_name
-        cur_line += '\n'
-        cur_file.write(cur_line)
-        for dtime in dtimes:
-            cur_line = dtime.isoformat()
-            for ts_name in ts_names:
-                cur_line += ';%s' % locale.str(data[dtime][ts_name])\
-                    if data[dtime][ts_name] != '' else ''
-            cur_line += '\n'
-            cur_file.write(cur_line)
-    logging.info('Finished outputting data into csv file: %s', dest_file)
+def dump_to_csv(dest_file, data, ts_names, dtimes, compression=None):
+    """ dumps timeseries to csv file (see CsvWriter). Cells without data
+        are left out of the row, separator included """
+    with CsvWriter(dest_file, compression) as writer:
+        writer.writerow(['datetime'] + list(ts_names))
+        number = writer.number
+        writer.writerows(
+            [dtime.isoformat()] + [number(data[dtime][ts_name])
+                                   for ts_name in ts_names
+                                   if data[dtime][ts_name] != '']
+            for dtime in dtimes)
+
+def __cell_writer(worksheet, types, fmt):
+    """ Returns the method used to write every (non-empty) cell of a
+        column, chosen once from the set of types of its values. Columns
+        with mixed types are written cell by cell, as worksheet.write """
+    if types and all(issubclass(kind, (dict, list)) for kind in types):
+        return lambda row, col, value: worksheet.write_string(
+            row, col, dumps(value))
+    if types and all(issubclass(kind, date) for kind in types):
+        return lambda row, col, value: worksheet.write_datetime(
+            row, col, value, fmt['br_datetime'])
+    if types and all(issubclass(kind, (int, float)) and
+                     not issubclass(kind, bool) for kind in types):
+        return worksheet.write_number
 
-def write_xlsx(data, filename='output.xlsx'):
+    def write(row, col, value):
+        """ writes a cell of a column with mixed types """
+        if isinstance(value, (dict, list)):
+            worksheet.write(row, col, dumps(value))
+        elif isinstance(value, date):
+            worksheet.write(row, col, value, fmt['br_datetime'])
+        else:
+            worksheet.write(row, col, value)
+    return write
+
+def write_xlsx(data, filename='output.xlsx', constant_memory=True):
     """ Output a dictionary to an Excel file.
         The first level of the dictionary should contain keys that represent
         each spreadsheet of the workbook. Each key must contain a list of
         dictionaries. Each item of this list represents a line in the
-        spreadsheet. """
+        spreadsheet. With constant_memory, each row is flushed to disk as
+        soon as the next one starts (see xlsxwriter), so memory does not
+        grow with the number of rows """
     logging.info('Outputting data into workbook: %s', filename)
-    workbook = xlsxwriter.Workbook(filename)
+    workbook = xlsxwriter.Workbook(filename,
+                                   {'constant_memory': constant_memory})
     bold = workbook.add_format({'bold': True})
     bold.set_text_wrap()
     fmt = dict()
@@ -91,32 +176,25 @@ def write_xlsx(data, filename='output.xlsx'):
                                           'bold': False})
     for sheet in data:
         logging.info('Writing spreadsheet: %s', sheet)
-        columns = list()
+        columns = dict()
         for datai in data[sheet]:
-            for key in datai:
-                if key not in columns:
-                    columns.append(key)
+            for key, value in datai.items():
+                types = columns.setdefault(key, set())
+                if value is not None and value != '':
+                    types.add(type(value))
         worksheet = workbook.add_worksheet(sheet)
         worksheet.freeze_panes(1, 0)
-        row = -1
-        for datai in data[sheet]:
-            row += 1
-            col = -1
-            for key in columns:
-                col += 1
-                if row == 0:
-                    worksheet.write(row, col, key, bold)
-                if key in datai:
-                    if isinstance(datai[key], (dict, list)):
-                        worksheet.write(row+1, col, dumps(datai[key]))
-                    elif isinstance(datai[key], date):
-                        worksheet.write(row+1, col, datai[key],
-                                        fmt['br_datetime'])
-                    elif isinstance(datai[key], datetime):
-                        worksheet.write(row+1, col, datai[key],
-                                        fmt['br_datetime'])
-                    else:
-                        worksheet.write(row+1, col, datai[key])
+        if not data[sheet]:
+            continue
+        worksheet.write_row(0, 0, list(columns), bold)
+        writers = [(col, key, __cell_writer(worksheet, types, fmt))
+                   for col, (key, types) in enumerate(columns.items())]
+        for row, datai in enumerate(data[sheet], 1):
+            for col, key, writer in writers:
+                value = datai.get(key)
+                # empty cells ('' or None) are left blank
+                if value is not None and value != '':
+                    writer(row, col, value)
     workbook.close()
     logging.info('Finished outputting data into workbook: %s', filename)
 
@@ -144,34 +222,57 @@ def query_pld(con, ini_datetime, end_datetime):
     dtimes.sort()
     return pld_data, dtimes, ts_names
 
-def write_pld_csv(con, ini_datetime, end_datetime, dest_path):
-    """ outputs pld data do csv file """
-    logging.debug('Generating PLD CSV file...')
-    pld_data, dtimes, ts_names = query_pld(con, ini_datetime, end_datetime)
+def write_timeseries(data, dtimes, ts_names, dest_path, name,
+                     output_xls=True, output_csv=True, compression=None,
+                     output_parquet=False, database=None):
+    """ outputs an already queried dataset (as returned by query_pld,
+        query_interchange or query_load_gen) to every enabled format, so
+        that each dataset is fetched and pivoted only once. With a
+        database filename, the dataset is also upserted into its
+        timeseries table (see dessemstats.database) """
     for dtime in dtimes:
         for ts_name in ts_names:
-            if ts_name not in pld_data[dtime]:
-                pld_data[dtime][
+            if ts_name not in data[dtime]:
+                data[dtime][
                     ts_name] = ''
-    dest_file = dest_path + '/pld.csv'
-    dump_to_csv(dest_file, pld_data, ts_names, dtimes)
+    if output_xls:
+        timeseries = {name: list()}
+        for dtime in dtimes:
+            cur_date_data = dict()
+            cur_date_data['Data'] = dtime.replace(tzinfo=None)
+            for ts_name in ts_names:
+                cur_date_data[ts_name] = data[dtime][ts_name]
+            timeseries[name].append(cur_date_data)
+        write_xlsx(timeseries, dest_path + '/' + name + '.xlsx')
+    if output_csv:
+        dump_to_csv(dest_path + '/' + name + '.csv', data, ts_names, dtimes,
+                    compression)
+    if output_parquet:
+        export_timeseries(dest_path + '/parquet/' + name, data, dtimes,
+                          ts_names)
+    if database:
+        with closing(connect(database)) as db_con:
+            upsert_timeseries(db_con, name, data, dtimes, ts_names)
+
+def export_pld(con, ini_datetime, end_datetime, dest_path,
+               output_xls=True, output_csv=True, compression=None,
+               output_parquet=False, database=None):
+    """ outputs pld data to the enabled formats """
+    logging.debug('Generating PLD files...')
+    pld_data, dtimes, ts_names = query_pld(con, ini_datetime, end_datetime)
+    write_timeseries(pld_data, dtimes, ts_names, dest_path, 'pld',
+                     output_xls, output_csv, compression, output_parquet,
+                     database)
+
+def write_pld_csv(con, ini_datetime, end_datetime, dest_path):
+    """ outputs pld data do csv file """
+    export_pld(con, ini_datetime, end_datetime, dest_path,
+               output_xls=False, output_csv=True)
 
 def write_pld_xlsx(con, ini_datetime, end_datetime, dest_path):
     """ outputs pld data do xlsx file """
-    logging.debug('Generating PLD XLSX file...')
-    pld_data, dtimes, ts_names = query_pld(con, ini_datetime, end_datetime)
-    timeseries = {'pld': list()}
-    for dtime in dtimes:
-        cur_date_data = dict()
-        cur_date_data['Data'] = dtime.replace(tzinfo=None)
-        for ts_name in ts_names:
-            if ts_name not in pld_data[dtime]:
-                pld_data[dtime][
-                    ts_name] = ''
-            cur_date_data[ts_name] = pld_data[dtime][ts_name]
-        timeseries['pld'].append(cur_date_data)
-    dest_file = dest_path + '/pld.xlsx'
-    write_xlsx(timeseries, dest_file)
+    export_pld(con, ini_datetime, end_datetime, dest_path,
+               output_xls=True, output_csv=False)
 
 def query_interchange(con, ini_datetime, end_datetime):
     """ Query energy interchanges in between subsystems """
@@ -198,36 +299,26 @@ def query_interchange(con, ini_datetime, end_datetime):
     dtimes.sort()
     return inter_data, dtimes, ts_names
 
-def write_interchange_csv(con, ini_datetime, end_datetime, dest_path):
-    """ outputs interchange data do csv file """
-    logging.debug('Generating Interchange CSV file...')
+def export_interchange(con, ini_datetime, end_datetime, dest_path,
+                       output_xls=True, output_csv=True, compression=None,
+                       output_parquet=False, database=None):
+    """ outputs interchange data to the enabled formats """
+    logging.debug('Generating Interchange files...')
     inter_data, dtimes, ts_names = query_interchange(
         con, ini_datetime, end_datetime)
-    for dtime in dtimes:
-        for ts_name in ts_names:
-            if ts_name not in inter_data[dtime]:
-                inter_data[dtime][
-                    ts_name] = ''
-    dest_file = dest_path + '/intercambio.csv'
-    dump_to_csv(dest_file, inter_data, ts_names, dtimes)
+    write_timeseries(inter_data, dtimes, ts_names, dest_path, 'intercambio',
+                     output_xls, output_csv, compression, output_parquet,
+                     database)
+
+def write_interchange_csv(con, ini_datetime, end_datetime, dest_path):
+    """ outputs interchange data do csv file """
+    export_interchange(con, ini_datetime, end_datetime, dest_path,
+                       output_xls=False, output_csv=True)
 
 def write_interchange_xlsx(con, ini_datetime, end_datetime, dest_path):
     """ outputs interchange data do xlsx file """
-    logging.debug('Generating Interchange XLSX file...')
-    inter_data, dtimes, ts_names = query_interchange(
-        con, ini_datetime, end_datetime)
-    timeseries = {'intercambio': list()}
-    for dtime in dtimes:
-        cur_date_data = dict()
-        cur_date_data['Data'] = dtime.replace(tzinfo=None)
-        for ts_name in ts_names:
-            if ts_name not in inter_data[dtime]:
-                inter_data[dtime][
-                    ts_name] = ''
-            cur_date_data[ts_name] = inter_data[dtime][ts_name]
-        timeseries['intercambio'].append(cur_date_data)
-    dest_file = dest_path + '/intercambio.xlsx'
-    write_xlsx(timeseries, dest_file)
+    export_interchange(con, ini_datetime, end_datetime, dest_path,
+                       output_xls=True, output_csv=False)
 
 def write_cmo_xlsx(data, tstamps, ts_names, params):
     """ outputs cmo data do xlsx file """
@@ -247,6 +338,38 @@ def write_cmo_xlsx(data, tstamps, ts_names, params):
                                        params['network'])
     write_xlsx(timeseries, dest_file)
 
+SUBSIS_NAMES = [('s_', 'sul'),
+                ('seco_', 'sudeste'),
+                ('n_', 'norte'),
+                ('ne_', 'nordeste')]
+LOAD_GEN_SERIES = [
+    ('load', 'ts_ons_carga_horaria_programada', 'carga_programada'),
+    ('load', 'ts_ons_carga_horaria_verificada', 'carga_verificada'),
+    ('wind', 'ts_ons_geracao_horaria_programada_eolica', 'eolica_programada'),
+    ('wind', 'ts_ons_geracao_horaria_verificada_eolica', 'eolica_verificada'),
+    ('gen', 'ts_ons_geracao_horaria_programada_hidraulica',
+     'hidraulica_programada'),
+    ('gen', 'ts_ons_geracao_horaria_verificada_hidraulica',
+     'hidraulica_verificada'),
+    ('gen', 'ts_ons_geracao_horaria_programada_solar', 'solar_programada'),
+    ('gen', 'ts_ons_geracao_horaria_verificada_solar', 'solar_verificada'),
+    ('gen', 'ts_ons_geracao_horaria_programada_termica',
+     'termica_programada'),
+    ('gen', 'ts_ons_geracao_horaria_verificada_termica',
+     'termica_verificada'),
+    ('gen', 'ts_ons_geracao_horaria_programada_total', 'total_programada'),
+    ('gen', 'ts_ons_geracao_horaria_verificada_total', 'total_verificada')]
+
+def __merge_subsis_points(data, subsis, res_points):
+    """ merges the points of a subsystem series into data """
+    for tstamp, value in zip(res_points['timestamps'],
+                             res_points['values']):
+        dtime = datetime.fromtimestamp(int(tstamp),
+                                       tz=LOCAL_TIMEZONE)
+        if dtime not in data:
+            data[dtime] = dict()
+        data[dtime][subsis] = value
+
 def query_hourly_subsis_sagic(
         con,
         ini_datetime,
@@ -270,8 +393,7 @@ def query_hourly_subsis_sagic(
     assert isinstance(data, dict),\
         'data must be dictionary'
     tseries = dict()
-    for i, j in zip(['s_', 'seco_', 'n_', 'ne_'],
-                    ['sul', 'sudeste', 'norte', 'nordeste']):
+    for i, j in SUBSIS_NAMES:
         tseries[i + suffix] = con.get_timeseries(params={
             'name': ts_prefix + '_subsistema_' + j})
         if not tseries[i + suffix]:
@@ -282,160 +404,99 @@ def query_hourly_subsis_sagic(
             params={'start': ini_datetime.isoformat(),
                     'end': end_datetime.isoformat(),
                     'tstype': 'int'})
-        for tstamp, value in zip(res_points['timestamps'],
-                                 res_points['values']):
-            dtime = datetime.fromtimestamp(int(tstamp),
-                                           tz=LOCAL_TIMEZONE)
-            if dtime not in data:
-                data[dtime] = dict()
-            data[dtime][subsis] = value
+        __merge_subsis_points(data, subsis, res_points)
     return data, list(tseries)
 
-def __process_load_gen(con, ini_datetime, end_datetime,
-                       query_load, query_wind, query_gen):
-    """ pre-process load and wind data """
+async def __aquery_hourly_subsis_sagic(engine, ini_datetime, end_datetime,
+                                       ts_prefix, suffix):
+    """ async version of query_hourly_subsis_sagic: the 4 timeseries
+        lookups and the 4 point downloads are issued concurrently.
+        Returns a list of (subsis, points) in subsystem order """
+    tseries = await asyncio.gather(*[
+        engine.con.get_timeseries(params={
+            'name': ts_prefix + '_subsistema_' + j})
+        for _, j in SUBSIS_NAMES])
+    subsis_ts = [(i + suffix, tsobj) for (i, _), tsobj
+                 in zip(SUBSIS_NAMES, tseries) if tsobj]
+    points = await asyncio.gather(*[
+        engine.con.get_points(
+            oid=tsobj[0]['tsid'],
+            params={'start': ini_datetime.isoformat(),
+                    'end': end_datetime.isoformat(),
+                    'tstype': 'int'})
+        for _, tsobj in subsis_ts])
+    return [(subsis, res_points) for (subsis, _), res_points
+            in zip(subsis_ts, points)]
+
+def query_load_gen(con, ini_datetime, end_datetime,
+                   query_load, query_wind, query_gen, concurrency=10):
+    """ pre-process load and wind data. Every subsystem series is queried
+        concurrently (up to 'concurrency' simultaneous requests), so 'con'
+        should be a ConnectionPool. Raises RuntimeError if any of the
+        series could not be retrieved """
+    assert isinstance(ini_datetime, datetime),\
+        'ini_datetime must be a datetime object'
+    assert isinstance(end_datetime, datetime),\
+        'end_datetime must be a datetime object'
+    groups = {'load': query_load, 'wind': query_wind, 'gen': query_gen}
+    series = [(ts_prefix, suffix) for group, ts_prefix, suffix
+              in LOAD_GEN_SERIES if groups[group]]
+    engine = FetchEngine(con, concurrency)
+    try:
+        results = engine.run([
+            __aquery_hourly_subsis_sagic(engine, ini_datetime, end_datetime,
+                                         ts_prefix, suffix)
+            for ts_prefix, suffix in series])
+    finally:
+        engine.close()
+    # a failed group would silently drop its subsystem columns
+    failed = [ts_prefix for (ts_prefix, _), result in zip(series, results)
+              if result is False]
+    if failed:
+        raise RuntimeError('Unable to retrieve load/generation series: ' +
+                           ', '.join(failed))
     data = dict()
     data_fields = list()
-    if query_load:
-        data, tnames = query_hourly_subsis_sagic(
-            con,
-            ini_datetime,
-            end_datetime,
-            data,
-            ts_prefix='ts_ons_carga_horaria_programada',
-            suffix='carga_programada')
-        data_fields += tnames
-        data, tnames = query_hourly_subsis_sagic(
-            con,
-            ini_datetime,
-            end_datetime,
-            data,
-            ts_prefix='ts_ons_carga_horaria_verificada',
-            suffix='carga_verificada')
-        data_fields += tnames
-    if query_wind:
-        data, tnames = query_hourly_subsis_sagic(
-            con,
-            ini_datetime,
-            end_datetime,
-            data,
-            ts_prefix='ts_ons_geracao_horaria_programada_eolica',
-            suffix='eolica_programada')
-        data_fields += tnames
-        data, tnames = query_hourly_subsis_sagic(
-            con,
-            ini_datetime,
-            end_datetime,
-            data,
-            ts_prefix='ts_ons_geracao_horaria_verificada_eolica',
-            suffix='eolica_verificada')
-        data_fields += tnames
-    if query_gen:
-        data, tnames = query_hourly_subsis_sagic(
-            con,
-            ini_datetime,
-            end_datetime,
-            data,
-            ts_prefix='ts_ons_geracao_horaria_programada_hidraulica',
-            suffix='hidraulica_programada')
-        data_fields += tnames
-        data, tnames = query_hourly_subsis_sagic(
-            con,
-            ini_datetime,
-            end_datetime,
-            data,
-            ts_prefix='ts_ons_geracao_horaria_verificada_hidraulica',
-            suffix='hidraulica_verificada')
-        data_fields += tnames
-        data, tnames = query_hourly_subsis_sagic(
-            con,
-            ini_datetime,
-            end_datetime,
-            data,
-            ts_prefix='ts_ons_geracao_horaria_programada_solar',
-            suffix='solar_programada')
-        data_fields += tnames
-        data, tnames = query_hourly_subsis_sagic(
-            con,
-            ini_datetime,
-            end_datetime,
-            data,
-            ts_prefix='ts_ons_geracao_horaria_verificada_solar',
-            suffix='solar_verificada')
-        data_fields += tnames
-        data, tnames = query_hourly_subsis_sagic(
-            con,
-            ini_datetime,
-            end_datetime,
-            data,
-            ts_prefix='ts_ons_geracao_horaria_programada_termica',
-            suffix='termica_programada')
-        data_fields += tnames
-        data, tnames = query_hourly_subsis_sagic(
-            con,
-            ini_datetime,
-            end_datetime,
-            data,
-            ts_prefix='ts_ons_geracao_horaria_verificada_termica',
-            suffix='termica_verificada')
-        data_fields += tnames
-        data, tnames = query_hourly_subsis_sagic(
-            con,
-            ini_datetime,
-            end_datetime,
-            data,
-            ts_prefix='ts_ons_geracao_horaria_programada_total',
-            suffix='total_programada')
-        data_fields += tnames
-        data, tnames = query_hourly_subsis_sagic(
-            con,
-            ini_datetime,
-            end_datetime,
-            data,
-            ts_prefix='ts_ons_geracao_horaria_verificada_total',
-            suffix='total_verificada')
-        data_fields += tnames
+    for result in results:
+        for subsis, res_points in result:
+            __merge_subsis_points(data, subsis, res_points)
+            data_fields.append(subsis)
     data_fields = list(set(data_fields))
     data_fields.sort()
     dtimes = list(data)
     dtimes.sort()
     return data, dtimes, data_fields
 
+def export_load_gen(con, ini_datetime, end_datetime, dest_path,
+                    query_load, query_wind, query_gen, concurrency=10,
+                    output_xls=True, output_csv=True, compression=None,
+                    output_parquet=False, database=None):
+    """ outputs ons load and generation (verified and predicted)
+        to the enabled formats """
+    logging.debug('Generating load and generation files...')
+    data, dtimes, data_fields = query_load_gen(con,
+                                               ini_datetime,
+                                               end_datetime,
+                                               query_load,
+                                               query_wind,
+                                               query_gen,
+                                               concurrency)
+    write_timeseries(data, dtimes, data_fields, dest_path,
+                     'carga_geracao_subsis', output_xls, output_csv,
+                     compression, output_parquet, database)
+
 def write_load_gen_csv(con, ini_datetime, end_datetime, dest_path,
-                       query_load, query_wind, query_gen):
+                       query_load, query_wind, query_gen,
+                       concurrency=10):
     """ outputs ons load (verified and predicted) to csv """
-    data, dtimes, data_fields = __process_load_gen(con,
-                                                   ini_datetime,
-                                                   end_datetime,
-                                                   query_load,
-                                                   query_wind,
-                                                   query_gen)
-    for dtime in dtimes:
-        for ts_name in data_fields:
-            if ts_name not in data[dtime]:
-                data[dtime][
-                    ts_name] = ''
-    dest_file = dest_path + '/carga_geracao_subsis.csv'
-    dump_to_csv(dest_file, data, data_fields, dtimes)
+    export_load_gen(con, ini_datetime, end_datetime, dest_path,
+                    query_load, query_wind, query_gen, concurrency,
+                    output_xls=False, output_csv=True)
 
 def write_load_gen_xlsx(con, ini_datetime, end_datetime, dest_path,
-                        query_load, query_wind, query_gen):
-    """ outputs ons load (verified and predicted) to csv """
-    data, dtimes, data_fields = __process_load_gen(con,
-                                                   ini_datetime,
-                                                   end_datetime,
-                                                   query_load,
-                                                   query_wind,
-                                                   query_gen)
-    timeseries = {'carga_geracao_subsis': list()}
-    for dtime in dtimes:
-        cur_date_data = dict()
-        cur_date_data['Data'] = dtime.replace(tzinfo=None)
-        for ts_name in data_fields:
-            if ts_name not in data[dtime]:
-                data[dtime][
-                    ts_name] = ''
-            cur_date_data[ts_name] = data[dtime][ts_name]
-        timeseries['carga_geracao_subsis'].append(cur_date_data)
-    dest_file = dest_path + '/carga_geracao_subsis.xlsx'
-    write_xlsx(timeseries, dest_file)
+                        query_load, query_wind, query_gen,
+                        concurrency=10):
+    """ outputs ons load (verified and predicted) to xlsx """
+    export_load_gen(con, ini_datetime, end_datetime, dest_path,
+                    query_load, query_wind, query_gen, concurrency,
+                    output_xls=True, output_csv=False)
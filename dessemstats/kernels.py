@@ -0,0 +1,236 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+import sys
+from math import gcd, isqrt, log
+import statistics
+import numpy as np
+
+# bits de cada parte (limb) das mantissas: os produtos entre partes e suas
+# somas em um segmento cabem em int64
+LIMB = 18
+# python < 3.11: statistics.stdev nao eh calculado de forma exata
+EXACT_STDEV = sys.version_info >= (3, 11)
+# bits da raiz inteira: arredondamento correto na conversao para float
+SQRT_BITS = 2 * sys.float_info.mant_dig + 3
+
+
+def align(i_tstamps, j_tstamps):
+    """ Retorna os indices dos timestamps comuns a duas series ordenadas
+        (sem repeticoes), em ordem cronologica """
+    _, i_index, j_index = np.intersect1d(
+        i_tstamps, j_tstamps, assume_unique=True, return_indices=True)
+    return i_index, j_index
+
+
+def segments(days):
+    """ Retorna o inicio de cada dia em um vetor ordenado de dias """
+    if not len(days):
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(([0], np.flatnonzero(np.diff(days)) + 1))
+
+
+def sqrt_of_frac(num, den):
+    """ Raiz quadrada de num / den (inteiros positivos) corretamente
+        arredondada para float. A raiz inteira eh calculada com bits
+        suficientes e o ultimo bit indica se ela eh inexata
+        (arredondamento para impar), de modo que a divisao final por uma
+        potencia de 2 arredonda corretamente """
+    shift = (num.bit_length() - den.bit_length() - SQRT_BITS) // 2
+    if shift >= 0:
+        den <<= 2 * shift
+    else:
+        num <<= -2 * shift
+    root = isqrt(num // den)
+    root |= root * root * den != num
+    if shift >= 0:
+        return float(root << shift)
+    return root / (1 << -shift)
+
+
+class ExactMoments(object):
+    """ Soma e soma dos quadrados exatas (inteiros) de cada segmento de um
+        vetor de floats. Cada valor eh decomposto em mantissa inteira e
+        expoente, e os valores de um segmento sao escalados para o menor
+        expoente do segmento, de modo que media e desvio padrao podem ser
+        calculados sem erro de arredondamento, com o mesmo resultado de
+        statistics.mean e statistics.stdev. As mantissas sao divididas em
+        partes de LIMB bits, somadas (e multiplicadas) com numpy por
+        segmento e expoente; apenas a combinacao de cada grupo usa inteiros
+        do Python """
+
+    def __init__(self, values, starts):
+        values = np.asarray(values, dtype=np.float64)
+        starts = np.asarray(starts, dtype=np.int64)
+        finite = np.isfinite(values)
+        mantissas, exponents = np.frexp(np.where(finite, values, 0.0))
+        mantissas = np.ldexp(mantissas, 53).astype(np.int64)
+        exponents = exponents.astype(np.int64) - 53
+        ends = np.append(starts[1:], len(values)).astype(np.int64)
+        self.bounds = list(zip(starts.tolist(), ends.tolist()))
+        self.sums = [0] * len(starts)
+        self.squares = [0] * len(starts)
+        self.values = values
+        if not len(starts):
+            self.scale = list()
+            self.exact = list()
+            return
+        seg_ids = np.repeat(np.arange(len(starts)), ends - starts)
+        nonzero = np.where(mantissas != 0, exponents, np.iinfo(np.int64).max)
+        scale = np.minimum.reduceat(nonzero, starts)
+        scale[scale == np.iinfo(np.int64).max] = 0
+        shifts = exponents - scale[seg_ids]
+        shifts[mantissas == 0] = 0
+        # grupos de valores com o mesmo segmento e o mesmo deslocamento
+        order = np.lexsort((shifts, seg_ids))
+        seg_ids, shifts = seg_ids[order], shifts[order]
+        mantissas = mantissas[order]
+        groups = np.flatnonzero(np.concatenate((
+            [True], (np.diff(seg_ids) != 0) | (np.diff(shifts) != 0))))
+        mask = (1 << LIMB) - 1
+        magnitudes = np.abs(mantissas)
+        limbs = [(magnitudes >> (LIMB * k)) & mask for k in range(3)]
+        signs = np.sign(mantissas)
+        # partes das mantissas e de seus quadrados, somadas por grupo
+        parts = [signs * limb for limb in limbs] + [
+            limbs[0] * limbs[0], 2 * limbs[0] * limbs[1],
+            2 * limbs[0] * limbs[2] + limbs[1] * limbs[1],
+            2 * limbs[1] * limbs[2], limbs[2] * limbs[2]]
+        parts = [np.add.reduceat(part, groups).tolist() for part in parts]
+        for seg, shift, *terms in zip(seg_ids[groups].tolist(),
+                                      shifts[groups].tolist(), *parts):
+            self.sums[seg] += (terms[0] + (terms[1] << LIMB) +
+                               (terms[2] << 2 * LIMB)) << shift
+            self.squares[seg] += (
+                terms[3] + (terms[4] << LIMB) + (terms[5] << 2 * LIMB) +
+                (terms[6] << 3 * LIMB) + (terms[7] << 4 * LIMB)) << 2 * shift
+        self.scale = scale.tolist()
+        self.exact = np.logical_and.reduceat(finite, starts).tolist()
+
+    def __ratio(self, value, count, seg, power=1):
+        """ Retorna (numerador, denominador) de
+            value * 2 ** (power * escala) / count """
+        exponent = power * self.scale[seg]
+        if exponent >= 0:
+            return value << exponent, count
+        return value, count << -exponent
+
+    def __fallback(self, seg):
+        """ Valores do segmento como lista (para statistics) """
+        ini, end = self.bounds[seg]
+        return self.values[ini:end].tolist()
+
+    def count(self, seg):
+        """ Numero de valores do segmento """
+        return self.bounds[seg][1] - self.bounds[seg][0]
+
+    def mean(self, seg):
+        """ Equivalente a statistics.mean do segmento """
+        count = self.count(seg)
+        if count < 1 or not self.exact[seg]:
+            return statistics.mean(self.__fallback(seg))
+        # divisao inteira com arredondamento correto, como em Fraction
+        num, den = self.__ratio(self.sums[seg], count, seg)
+        return num / den
+
+    def stdev(self, seg):
+        """ Equivalente a statistics.stdev do segmento """
+        count = self.count(seg)
+        if count < 2 or not EXACT_STDEV or not self.exact[seg]:
+            return statistics.stdev(self.__fallback(seg))
+        num, den = self.__ratio(
+            count * self.squares[seg] - self.sums[seg] * self.sums[seg],
+            count * (count - 1), seg, power=2)
+        if not num:
+            return 0.0
+        # fracao irredutivel, como a variancia (Fraction) de statistics
+        divisor = gcd(num, den)
+        return sqrt_of_frac(num // divisor, den // divisor)
+
+
+def log_returns(values, prev_values):
+    """ log(atual / anterior), ou 0 quando algum dos valores eh nulo ou a
+        razao nao eh positiva """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = values / prev_values
+    valid = (values != 0) & (prev_values != 0) & (ratios > 0)
+    logs = np.zeros(len(values), dtype=np.float64)
+    logs[valid] = list(map(log, ratios[valid].tolist()))
+    return logs
+
+
+def pair_statistics(i_values, j_values, days):
+    """ Calcula, para cada dia, os termos dos indicadores de comparacao
+        entre duas series alinhadas (i_values e j_values nos mesmos
+        timestamps, ordenados, e 'days' o dia de cada ponto). Retorna uma
+        lista (dia, termos) com os mesmos valores do calculo ponto a ponto:
+        somas sequenciais, minimos e maximos exatos, media e desvio padrao
+        exatos e log calculado por math.log """
+    starts = segments(days)
+    ends = np.append(starts[1:], len(days))
+    diffs = i_values - j_values
+    diffs_sqrt = np.sqrt(diffs * diffs)
+    # pares de pontos consecutivos de um mesmo dia
+    same_day = days[1:] == days[:-1]
+    pair_days = days[1:][same_day]
+    i_cur, i_prev = i_values[1:][same_day], i_values[:-1][same_day]
+    j_cur, j_prev = j_values[1:][same_day], j_values[:-1][same_day]
+    pair_starts = segments(pair_days)
+    i_volat = ExactMoments(np.abs(i_cur - i_prev), pair_starts)
+    j_volat = ExactMoments(np.abs(j_cur - j_prev), pair_starts)
+    i_logs = ExactMoments(log_returns(i_cur, i_prev), pair_starts)
+    j_logs = ExactMoments(log_returns(j_cur, j_prev), pair_starts)
+    diffs_moments = ExactMoments(diffs, starts)
+    i_moments = ExactMoments(i_values, starts)
+    j_moments = ExactMoments(j_values, starts)
+    i_max = np.maximum.reduceat(i_values, starts).tolist()\
+        if len(starts) else list()
+    i_min = np.minimum.reduceat(i_values, starts).tolist()\
+        if len(starts) else list()
+    j_max = np.maximum.reduceat(j_values, starts).tolist()\
+        if len(starts) else list()
+    j_min = np.minimum.reduceat(j_values, starts).tolist()\
+        if len(starts) else list()
+    diffs = diffs.tolist()
+    diffs_sqrt = diffs_sqrt.tolist()
+    pair_index = dict((day, seg) for seg, day in enumerate(
+        pair_days[pair_starts].tolist()))
+    results = list()
+    for seg, (ini, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        day = int(days[ini])
+        pseg = pair_index.get(day)
+        if pseg is None or i_logs.count(pseg) < 2:
+            # menos de 3 pontos comuns no dia: o desvio padrao dos retornos
+            # nao eh definido
+            continue
+        results.append((day, {
+            'num_values': end - ini,
+            'sum_diffs': sum(diffs[ini:end]),
+            'sum_diffs_sqrt': sum(diffs_sqrt[ini:end]),
+            'range_i': i_max[seg] - i_min[seg],
+            'range_j': j_max[seg] - j_min[seg],
+            'volat_mean_i': i_volat.mean(pseg),
+            'volat_mean_j': j_volat.mean(pseg),
+            'logs_stdev_i': i_logs.stdev(pseg),
+            'logs_stdev_j': j_logs.stdev(pseg),
+            'stdev_diffs': diffs_moments.stdev(seg),
+            'stdev_i': i_moments.stdev(seg),
+            'stdev_j': j_moments.stdev(seg)}))
+    return results
+
+
+def compare_terms(i_columns, j_columns, ordinals):
+    """ Alinha duas series (timestamps, valores, dias) e calcula os termos
+        dos indicadores de comparacao nos dias 'ordinals' """
+    i_tstamps, i_values, i_days = i_columns
+    j_tstamps, j_values, _ = j_columns
+    i_index, j_index = align(i_tstamps, j_tstamps)
+    days = np.asarray(i_days)[i_index]
+    selected = np.isin(days, ordinals)
+    return pair_statistics(np.asarray(i_values)[i_index][selected],
+                           np.asarray(j_values)[j_index][selected],
+                           days[selected])
@@ -0,0 +1,94 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+from datetime import date, datetime
+import numpy as np
+import pytz
+
+LOCAL_TIMEZONE = pytz.timezone('America/Sao_Paulo')
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+EPOCH = datetime(1970, 1, 1)
+
+
+class TransitionTable(object):
+    """ Tabela de transicoes de UTC-offset de um fuso horario (pytz), usada
+        para converter vetores de timestamps (em ms) para o horario local
+        em uma unica passada, com o mesmo resultado de
+        datetime.fromtimestamp(tstamp / 1000, tz=tz) ponto a ponto,
+        inclusive nas mudancas de horario de verao """
+
+    def __init__(self, tz=LOCAL_TIMEZONE):
+        transitions = getattr(tz, '_utc_transition_times', None)
+        if transitions:
+            self.transitions = np.array(
+                [int((dtime - EPOCH).total_seconds())
+                 for dtime in transitions], dtype=np.int64)
+            infos = tz._transition_info
+        else:
+            # fuso sem transicoes (ex.: UTC)
+            self.transitions = np.array([np.iinfo(np.int64).min],
+                                        dtype=np.int64)
+            infos = [(tz.utcoffset(EPOCH), None, None)]
+        self.offsets = np.array([int(info[0].total_seconds())
+                                 for info in infos], dtype=np.int64)
+        self.suffixes = np.array([self.__suffix(offset)
+                                  for offset in self.offsets.tolist()])
+
+    @staticmethod
+    def __suffix(offset):
+        """ Sufixo ISO 8601 (+HH:MM[:SS]) de um offset em segundos """
+        sign = '-' if offset < 0 else '+'
+        minutes, seconds = divmod(abs(offset), 60)
+        suffix = '%s%02d:%02d' % (sign, minutes // 60, minutes % 60)
+        return suffix + (':%02d' % seconds if seconds else '')
+
+    def index(self, seconds):
+        """ Retorna a transicao vigente em cada instante (em segundos) """
+        return np.searchsorted(self.transitions, seconds, side='right') - 1
+
+    def local_seconds(self, tstamps):
+        """ Retorna o horario local (segundos desde 1970-01-01 no relogio
+            local) de cada timestamp em ms """
+        seconds = np.floor_divide(np.asarray(tstamps, dtype=np.int64), 1000)
+        return seconds + self.offsets[self.index(seconds)]
+
+    def day_ordinals(self, tstamps):
+        """ Retorna o dia local (ordinal de date) de cada timestamp em ms """
+        return np.floor_divide(self.local_seconds(tstamps),
+                               86400) + EPOCH_ORDINAL
+
+    def day_hours(self, ordinals):
+        """ Retorna o numero de horas de cada dia local (ordinal de date):
+            23 ou 25 nos dias de mudanca do horario de verao. Considera
+            fusos com offsets em horas inteiras """
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        if not len(ordinals):
+            return np.zeros(0, dtype=np.int64)
+        first = (ordinals.min() - EPOCH_ORDINAL - 1) * 86400
+        last = (ordinals.max() - EPOCH_ORDINAL + 2) * 86400
+        days, hours = np.unique(
+            self.day_ordinals(np.arange(first, last, 3600) * 1000),
+            return_counts=True)
+        return hours[np.searchsorted(days, ordinals)]
+
+    def datetimes(self, tstamps):
+        """ Retorna o horario local (datetime sem fuso, truncado em
+            segundos) de cada timestamp em ms """
+        return self.local_seconds(tstamps).astype(
+            'datetime64[s]').tolist()
+
+    def isoformat(self, tstamps):
+        """ Retorna datetime.fromtimestamp(int(tstamp / 1000),
+            tz=tz).isoformat() de cada timestamp em ms """
+        seconds = np.floor_divide(np.asarray(tstamps, dtype=np.int64), 1000)
+        index = self.index(seconds)
+        local = (seconds + self.offsets[index]).astype('datetime64[s]')
+        return np.char.add(local.astype(str),
+                           self.suffixes[index]).tolist()
+
+
+LOCAL_TABLE = TransitionTable(LOCAL_TIMEZONE)
@@ -0,0 +1,93 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import shutil
+import tempfile
+import numpy as np
+from dessemstats.kernels import compare_terms
+
+COLUMNS = [('tstamps', np.int64), ('values', np.float64), ('days', np.int64)]
+# series mapeadas em memoria em cada processo de trabalho
+WORKER_COLUMNS = dict()
+
+
+def write_columns(folder, columns):
+    """ Grava as series {chave: (timestamps, valores, dias)} concatenadas
+        em um arquivo .npy por coluna e retorna {chave: (ini, fim)} """
+    layout = dict()
+    offset = 0
+    for key, arrays in columns.items():
+        layout[key] = (offset, offset + len(arrays[0]))
+        offset += len(arrays[0])
+    for k, (column, dtype) in enumerate(COLUMNS):
+        data = [arrays[k] for arrays in columns.values()]
+        np.save('%s/%s.npy' % (folder, column),
+                np.concatenate(data).astype(dtype, copy=False)
+                if data else np.empty(0, dtype=dtype))
+    return layout
+
+
+def attach_columns(folder, layout):
+    """ Inicializa um processo de trabalho: mapeia as colunas gravadas por
+        write_columns em memoria (somente leitura, sem copia) """
+    WORKER_COLUMNS.clear()
+    WORKER_COLUMNS['layout'] = layout
+    for column, _ in COLUMNS:
+        WORKER_COLUMNS[column] = np.load('%s/%s.npy' % (folder, column),
+                                         mmap_mode='r')
+
+
+def worker_series(key):
+    """ Retorna (timestamps, valores, dias) de uma serie mapeada """
+    ini, end = WORKER_COLUMNS['layout'][key]
+    return tuple(WORKER_COLUMNS[column][ini:end] for column, _ in COLUMNS)
+
+
+def pair_task(task):
+    """ Calcula os termos de todos os pares de series de uma planta """
+    name, pairs = task
+    results = list()
+    for comp_series, ordinals in pairs:
+        results.append((comp_series, compare_terms(
+            worker_series((name, comp_series[0])),
+            worker_series((name, comp_series[1])),
+            ordinals)))
+    return name, results
+
+
+def map_compare_terms(columns, tasks, workers, tmp_folder):
+    """ Distribui as tarefas [(planta, [(par de series, dias)])] entre
+        'workers' processos. As series sao gravadas uma unica vez em
+        arquivos temporarios e mapeadas em memoria pelos processos, de
+        modo que apenas a descricao das tarefas e os termos calculados
+        trafegam entre os processos """
+    folder = tempfile.mkdtemp(prefix='stats_', dir=tmp_folder)
+    try:
+        layout = write_columns(folder, columns)
+        logging.info('Calculating statistics for %d plants on %d processes',
+                     len(tasks), workers)
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=attach_columns,
+                                 initargs=(folder, layout)) as pool:
+            chunksize = max(1, len(tasks) // (4 * workers))
+            return list(pool.map(pair_task, tasks, chunksize=chunksize))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def map_outputs(task, tasks, workers):
+    """ Distribui a gravacao dos arquivos de saida de cada planta entre
+        'workers' processos. 'task' deve ser uma funcao de modulo que le a
+        planta de um armazenamento em disco, de modo que apenas a descricao
+        das tarefas trafega entre os processos. Retorna os resultados das
+        tarefas na ordem de 'tasks' """
+    logging.info('Writing outputs for %d plants on %d processes',
+                 len(tasks), workers)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(task, tasks))
@@ -0,0 +1,340 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+from datetime import date
+from hashlib import sha1
+from json import load, dump
+from urllib.parse import quote
+import logging
+import os
+import pickle
+import numpy as np
+from dateutil.relativedelta import relativedelta
+
+FORMAT_VERSION = 1
+RECORD_DTYPE = np.dtype([('day', '<i8'), ('series', '<i4'),
+                         ('tstamp', '<i8'), ('value', '<f8')])
+
+
+def month_start(day):
+    """ Retorna o primeiro dia do mes de 'day' """
+    return date(day.year, day.month, 1)
+
+
+def month_bounds(month):
+    """ Retorna os ordinais [ini, fim) dos dias de um mes """
+    return (month.toordinal(),
+            (month + relativedelta(months=1)).toordinal())
+
+
+class PartitionedStore(object):
+    """ Armazenamento de resultados particionado por planta e mes, em
+        <folder>/<planta>/<AAAA_MM>.npy (pontos em formato colunar binario,
+        lido por mapeamento em memoria) e <AAAA_MM>.pickle (dias e
+        indicadores). O manifesto (manifest.json) lista as particoes e o
+        hash do conteudo de cada uma, de modo que apenas particoes novas
+        ou alteradas sao regravadas """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.manifest_file = folder + '/manifest.json'
+        self.manifest = {'version': FORMAT_VERSION, 'series': list(),
+                         'partitions': dict(), 'meta': dict()}
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file, 'r') as handle:
+                manifest = load(handle)
+            if manifest.get('version') == FORMAT_VERSION:
+                self.manifest = manifest
+            else:
+                logging.warning('Ignoring results store with format %s: %s',
+                                manifest.get('version'), folder)
+
+    def exists(self):
+        """ Verifica se o armazenamento possui alguma planta gravada """
+        return bool(self.manifest['partitions'])
+
+    @property
+    def meta(self):
+        """ Metadados livres do armazenamento """
+        return self.manifest['meta']
+
+    def plants(self):
+        """ Retorna os nomes das plantas armazenadas """
+        return list(self.manifest['partitions'])
+
+    def months(self, plant, first=None, last=None):
+        """ Retorna os meses armazenados de uma planta (entre os meses de
+            'first' e 'last', se informados) em ordem cronologica """
+        months = sorted(date(int(key[:4]), int(key[5:]), 1)
+                        for key in self.manifest['partitions'].get(
+                            plant, dict()))
+        if first:
+            months = [month for month in months
+                      if month >= month_start(first)]
+        if last:
+            months = [month for month in months
+                      if month <= month_start(last)]
+        return months
+
+    def series_id(self, name):
+        """ Retorna o identificador (inteiro) de uma serie """
+        if name not in self.manifest['series']:
+            self.manifest['series'].append(name)
+        return self.manifest['series'].index(name)
+
+    def series_name(self, series_id):
+        """ Retorna o nome de uma serie a partir do identificador """
+        return self.manifest['series'][series_id]
+
+    def __filename(self, plant, month, ext):
+        """ Retorna o arquivo de uma particao """
+        return '%s/%s/%s.%s' % (self.folder, quote(plant, safe=''),
+                                month.strftime('%Y_%m'), ext)
+
+    def add_plant(self, plant):
+        """ Registra uma planta (mesmo sem particoes) """
+        self.manifest['partitions'].setdefault(plant, dict())
+
+    def read(self, plant, month):
+        """ Retorna (registros, metadados) de uma particao. Os registros
+            sao mapeados em memoria (somente leitura) """
+        records = np.load(self.__filename(plant, month, 'npy'),
+                          mmap_mode='r')
+        with open(self.__filename(plant, month, 'pickle'), 'rb') as handle:
+            meta = pickle.load(handle)
+        return records, meta
+
+    def write(self, plant, month, records, meta):
+        """ Grava uma particao caso seu conteudo tenha mudado. Retorna True
+            caso a particao tenha sido gravada """
+        meta_bytes = pickle.dumps(meta, protocol=pickle.HIGHEST_PROTOCOL)
+        digest = sha1(records.tobytes() + meta_bytes).hexdigest()
+        partitions = self.manifest['partitions'].setdefault(plant, dict())
+        key = month.strftime('%Y_%m')
+        if partitions.get(key) == digest:
+            return False
+        filename = self.__filename(plant, month, 'npy')
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+        with open(tmp_filename, 'wb') as handle:
+            np.save(handle, records)
+        os.replace(tmp_filename, filename)
+        filename = self.__filename(plant, month, 'pickle')
+        tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+        with open(tmp_filename, 'wb') as handle:
+            handle.write(meta_bytes)
+        os.replace(tmp_filename, filename)
+        partitions[key] = digest
+        return True
+
+    def commit(self):
+        """ Grava (de forma atomica) o manifesto """
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_filename = '%s.%d.tmp' % (self.manifest_file, os.getpid())
+        with open(tmp_filename, 'w') as handle:
+            dump(self.manifest, handle)
+        os.replace(tmp_filename, self.manifest_file)
+
+
+def records(results, columns):
+    """ Monta os registros de uma particao a partir de uma lista de
+        (serie, timestamps, valores, dias) """
+    chunks = list()
+    for name, tstamps, values, days in columns:
+        chunk = np.empty(len(tstamps), dtype=RECORD_DTYPE)
+        chunk['day'] = days
+        chunk['series'] = results.series_id(name)
+        chunk['tstamp'] = tstamps
+        chunk['value'] = values
+        chunks.append(chunk)
+    if not chunks:
+        return np.empty(0, dtype=RECORD_DTYPE)
+    return np.concatenate(chunks)
+
+
+def save_compare(results, store):
+    """ Grava um CompareStore no armazenamento particionado e retorna o
+        numero de particoes (novas ou alteradas) gravadas """
+    written = 0
+    for name, plant in store.items():
+        results.add_plant(name)
+        days = plant.days()
+        for month in sorted(set(month_start(day) for day in days)):
+            ini, end = month_bounds(month)
+            columns = list()
+            for series_name, series in plant.series.items():
+                series.consolidate()
+                first, last = np.searchsorted(series.days, [ini, end])
+                columns.append((series_name, series.tstamps[first:last],
+                                series.values[first:last],
+                                series.days[first:last]))
+            meta = {'series': list(plant.series),
+                    'days': sorted(day.toordinal() for day in days
+                                   if day in plant.extra_days and
+                                   month_start(day) == month),
+                    'indicators': dict(
+                        (day.toordinal(), plant.indicators[day])
+                        for day in sorted(plant.indicators)
+                        if month_start(day) == month)}
+            written += results.write(name, month,
+                                     records(results, columns), meta)
+    results.meta['stats_version'] = store.stats_version
+    results.commit()
+    logging.info('Results store %s: %d partitions written',
+                 results.folder, written)
+    return written
+
+
+def load_compare(results, store, names=None, first=None, last=None):
+    """ Carrega do armazenamento particionado as plantas 'names' (todas,
+        se None) nos meses entre 'first' e 'last' para um CompareStore,
+        sem marca-las como alteradas """
+    for name in results.plants():
+        if names is not None and name not in names:
+            continue
+        plant = store.plant(name)
+        loaded = dict()
+        for month in results.months(name, first, last):
+            data, meta = results.read(name, month)
+            plant.declare(meta['series'])
+            for series_id in np.unique(data['series']).tolist():
+                selected = data[data['series'] == series_id]
+                loaded.setdefault(results.series_name(series_id),
+                                  list()).append(selected)
+            plant.extra_days.update(date.fromordinal(day)
+                                    for day in meta['days'])
+            for day, indicators in meta['indicators'].items():
+                plant.indicators[date.fromordinal(day)] = indicators
+        for series_name, chunks in loaded.items():
+            data = np.concatenate(chunks)
+            plant.restore(series_name, data['tstamp'], data['value'])
+    store.stats_version = results.meta.get('stats_version')
+
+
+def save_nested(results, data, series):
+    """ Grava um dicionario data[planta][dia][serie ou indicador], onde as
+        'series' sao dicionarios {timestamp: valor}, no armazenamento
+        particionado e retorna o numero de particoes gravadas """
+    written = 0
+    for name, plant in data.items():
+        results.add_plant(name)
+        for month in sorted(set(month_start(day) for day in plant)):
+            columns = list()
+            meta = {'days': dict(), 'indicators': dict()}
+            for day in sorted(plant):
+                if month_start(day) != month:
+                    continue
+                ordinal = day.toordinal()
+                meta['days'][ordinal] = list()
+                for key, value in plant[day].items():
+                    if key in series:
+                        meta['days'][ordinal].append(key)
+                        columns.append((key, list(value),
+                                        list(value.values()),
+                                        [ordinal] * len(value)))
+                    else:
+                        meta['indicators'].setdefault(
+                            ordinal, dict())[key] = value
+            written += results.write(name, month,
+                                     records(results, columns), meta)
+    results.commit()
+    logging.info('Results store %s: %d partitions written',
+                 results.folder, written)
+    return written
+
+
+def load_nested(results, data, names=None, first=None, last=None):
+    """ Carrega do armazenamento particionado para um dicionario no
+        formato de save_nested """
+    for name in results.plants():
+        if names is not None and name not in names:
+            continue
+        plant = data.setdefault(name, dict())
+        for month in results.months(name, first, last):
+            records_data, meta = results.read(name, month)
+            for ordinal, day_series in meta['days'].items():
+                day_data = plant.setdefault(date.fromordinal(ordinal),
+                                            dict())
+                for key in day_series:
+                    day_data.setdefault(key, dict())
+                for key, value in meta['indicators'].get(
+                        ordinal, dict()).items():
+                    day_data[key] = value
+            for record in zip(records_data['day'].tolist(),
+                              records_data['series'].tolist(),
+                              records_data['tstamp'].tolist(),
+                              records_data['value'].tolist()):
+                plant[date.fromordinal(record[0])][
+                    results.series_name(record[1])][record[2]] = record[3]
+
+
+def coverage_request(names, first, last, kinds):
+    """ Descreve uma consulta para o registro de cobertura: nomes das
+        plantas (None para todas), intervalo de dias e tipos de serie """
+    return {'names': sorted(names) if names is not None else None,
+            'first': first.isoformat(), 'last': last.isoformat(),
+            'kinds': sorted(kinds)}
+
+
+def __contains(entry, request):
+    """ Verifica se a consulta registrada 'entry' abrange 'request' """
+    if entry['first'] > request['first'] or entry['last'] < request['last']:
+        return False
+    if not set(request['kinds']) <= set(entry['kinds']):
+        return False
+    if entry['names'] is None:
+        return True
+    return (request['names'] is not None and
+            set(request['names']) <= set(entry['names']))
+
+
+def covered(results, request):
+    """ Verifica se alguma consulta registrada no armazenamento abrange a
+        consulta 'request' (mesmo intervalo ou maior, mesmas plantas ou
+        mais e mesmos tipos de serie ou mais) """
+    return any(__contains(entry, request)
+               for entry in results.meta.get('coverage', list()))
+
+
+def add_coverage(results, request, today=None):
+    """ Registra no armazenamento uma consulta concluida. Apenas os meses
+        encerrados (ver MonthCache.is_closed) sao registrados, pois os
+        demais ainda recebem dados. Consultas contiguas com as mesmas
+        plantas e tipos de serie sao unidas """
+    today = today or date.today()
+    last_closed = (today.replace(day=1) - relativedelta(months=1) -
+                   relativedelta(days=1)).isoformat()
+    entry = dict(request, last=min(request['last'], last_closed))
+    if entry['first'] > entry['last']:
+        return
+    coverage = list(results.meta.get('coverage', list()))
+    merged = True
+    while merged:
+        merged = False
+        for other in coverage:
+            if (other['names'] == entry['names'] and
+                    other['kinds'] == entry['kinds'] and
+                    __adjacent(other, entry)):
+                entry['first'] = min(entry['first'], other['first'])
+                entry['last'] = max(entry['last'], other['last'])
+                coverage.remove(other)
+                merged = True
+                break
+    coverage = [other for other in coverage
+                if not __contains(entry, other)]
+    coverage.append(entry)
+    results.meta['coverage'] = coverage
+
+
+def __adjacent(entry, other):
+    """ Verifica se os intervalos de duas consultas se sobrepoem ou sao
+        contiguos """
+    after = (date.fromisoformat(entry['last']) +
+             relativedelta(days=1)).isoformat()
+    before = (date.fromisoformat(entry['first']) -
+              relativedelta(days=1)).isoformat()
+    return other['first'] <= after and other['last'] >= before
@@ -0,0 +1,376 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+from collections.abc import Mapping, MutableMapping
+from datetime import date
+import numpy as np
+from dessemstats.localtime import LOCAL_TABLE
+
+
+class Series(object):
+    """ Serie colunar: timestamps (int64, em ms) ordenados, valores e o dia
+        local de cada ponto, usado como indice por data. Pontos novos sao
+        acumulados em blocos e consolidados sob demanda; em timestamps
+        repetidos prevalece o primeiro valor recebido. Os dias que
+        receberam pontos novos sao mantidos em 'dirty' ate serem
+        descartados por clear_dirty """
+
+    def __init__(self, dtype=np.float64):
+        self.tstamps = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0, dtype=dtype)
+        self.days = np.empty(0, dtype=np.int64)
+        self.pending = list()
+        self.dirty = set()
+
+    def add(self, tstamps, values):
+        """ Acrescenta pontos a serie """
+        tstamps = np.asarray(tstamps, dtype=np.int64)
+        if tstamps.size:
+            self.pending.append(
+                (tstamps, np.asarray(values, dtype=self.values.dtype)))
+
+    def restore(self, tstamps, values):
+        """ Acrescenta pontos ja processados (ex.: lidos de disco), sem
+            marcar os seus dias como alterados """
+        self.consolidate()
+        dirty = set(self.dirty)
+        self.add(tstamps, values)
+        self.consolidate()
+        self.dirty = dirty
+
+    def consolidate(self):
+        """ Incorpora os blocos pendentes aos vetores ordenados """
+        if not self.pending:
+            return
+        tstamps = np.concatenate(
+            [self.tstamps] + [chunk[0] for chunk in self.pending])
+        values = np.concatenate(
+            [self.values] + [chunk[1] for chunk in self.pending])
+        new_days = [LOCAL_TABLE.day_ordinals(chunk[0])
+                    for chunk in self.pending]
+        days = np.concatenate([self.days] + new_days)
+        self.pending = list()
+        num_old = len(self.tstamps)
+        tstamps, index = np.unique(tstamps, return_index=True)
+        # pontos novos (os repetidos mantem o valor anterior)
+        self.dirty.update(np.unique(days[index[index >= num_old]]).tolist())
+        self.tstamps = tstamps
+        self.values = values[index]
+        self.days = days[index]
+
+    def day_bounds(self, day):
+        """ Retorna o intervalo [ini, fim) dos pontos de um dia """
+        self.consolidate()
+        ordinal = day.toordinal()
+        return (int(np.searchsorted(self.days, ordinal, side='left')),
+                int(np.searchsorted(self.days, ordinal, side='right')))
+
+    def day_arrays(self, day):
+        """ Retorna (timestamps, valores) dos pontos de um dia """
+        ini, end = self.day_bounds(day)
+        return self.tstamps[ini:end], self.values[ini:end]
+
+    def day_set(self):
+        """ Retorna o conjunto de dias (ordinais) com pontos """
+        self.consolidate()
+        return set(np.unique(self.days).tolist())
+
+    def remove_day(self, day):
+        """ Remove os pontos de um dia """
+        ini, end = self.day_bounds(day)
+        self.tstamps = np.delete(self.tstamps, np.s_[ini:end])
+        self.values = np.delete(self.values, np.s_[ini:end])
+        self.days = np.delete(self.days, np.s_[ini:end])
+
+    def dirty_days(self):
+        """ Retorna os dias (ordinais) com pontos novos """
+        self.consolidate()
+        return self.dirty
+
+    def clear_dirty(self):
+        """ Descarta o registro de dias com pontos novos """
+        self.consolidate()
+        self.dirty = set()
+
+    def __getstate__(self):
+        self.consolidate()
+        return self.__dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'dirty' not in state:
+            # gravado sem registro de alteracoes: todos os dias mudaram
+            self.dirty = set(np.unique(self.days).tolist())
+
+
+class SeriesView(Mapping):
+    """ Visao somente leitura {timestamp: valor} de uma serie em um dia,
+        compativel com o antigo dicionario de pontos """
+
+    def __init__(self, tstamps, values):
+        self.tstamps = tstamps
+        self.values = values
+
+    def __getitem__(self, tstamp):
+        i = int(np.searchsorted(self.tstamps, tstamp))
+        if i < len(self.tstamps) and self.tstamps[i] == tstamp:
+            return self.values[i].item()
+        raise KeyError(tstamp)
+
+    def __iter__(self):
+        return iter(self.tstamps.tolist())
+
+    def __len__(self):
+        return len(self.tstamps)
+
+    def items(self):
+        return list(zip(self.tstamps.tolist(), self.values.tolist()))
+
+    def values_list(self):
+        """ Retorna os valores da serie como lista """
+        return self.values.tolist()
+
+
+class PlantStore(MutableMapping):
+    """ Dados de uma planta (ou do CMO): series colunares declaradas e
+        indicadores diarios. Como mapeamento, se comporta como o antigo
+        dicionario {dia: {serie ou indicador: ...}} """
+
+    def __init__(self, dtype=np.float64):
+        self.dtype = dtype
+        self.series = dict()
+        self.indicators = dict()
+        self.extra_days = set()
+        self.days_cache = None
+
+    def declare(self, names):
+        """ Declara series da planta (presentes em todos os dias) """
+        for name in names:
+            if name not in self.series:
+                self.series[name] = Series(self.dtype)
+
+    def add_points(self, name, tstamps, values):
+        """ Acrescenta pontos a uma serie, declarando-a se necessario """
+        self.declare([name])
+        self.series[name].add(tstamps, values)
+        self.days_cache = None
+
+    def restore(self, name, tstamps, values):
+        """ Acrescenta pontos ja processados a uma serie (ver
+            Series.restore) """
+        self.declare([name])
+        self.series[name].restore(tstamps, values)
+        self.days_cache = None
+
+    def day_indicators(self, day):
+        """ Retorna (criando) o dicionario de indicadores de um dia """
+        if day not in self.indicators:
+            self.indicators[day] = dict()
+            self.days_cache = None
+        return self.indicators[day]
+
+    def days(self):
+        """ Retorna o conjunto de dias da planta """
+        if self.days_cache is None:
+            ordinals = set()
+            for series in self.series.values():
+                ordinals |= series.day_set()
+            self.days_cache = set(date.fromordinal(ordinal)
+                                  for ordinal in ordinals)
+            self.days_cache |= set(self.indicators) | self.extra_days
+        return self.days_cache
+
+    def __getitem__(self, day):
+        if day not in self.days():
+            raise KeyError(day)
+        return DayView(self, day)
+
+    def __setitem__(self, day, value):
+        for key, item in value.items():
+            if isinstance(item, Mapping):
+                self.add_points(key, list(item), list(item.values()))
+            else:
+                self.day_indicators(day)[key] = item
+        self.extra_days.add(day)
+        self.days_cache = None
+
+    def __delitem__(self, day):
+        if day not in self.days():
+            raise KeyError(day)
+        for series in self.series.values():
+            series.remove_day(day)
+        self.indicators.pop(day, None)
+        self.extra_days.discard(day)
+        self.days_cache = None
+
+    def __contains__(self, day):
+        return day in self.days()
+
+    def __iter__(self):
+        return iter(sorted(self.days()))
+
+    def __len__(self):
+        return len(self.days())
+
+
+class DayView(MutableMapping):
+    """ Visao {serie ou indicador: ...} de um dia de uma planta """
+
+    def __init__(self, plant, day):
+        self.plant = plant
+        self.day = day
+
+    def __getitem__(self, key):
+        if key in self.plant.series:
+            return SeriesView(*self.plant.series[key].day_arrays(self.day))
+        return self.plant.indicators.get(self.day, dict())[key]
+
+    def __setitem__(self, key, value):
+        if isinstance(value, Mapping):
+            self.plant.add_points(key, list(value), list(value.values()))
+        else:
+            self.plant.day_indicators(self.day)[key] = value
+
+    def __delitem__(self, key):
+        if key in self.plant.series:
+            raise KeyError('series cannot be removed from a single day')
+        del self.plant.indicators.get(self.day, dict())[key]
+
+    def __iter__(self):
+        return iter(list(self.plant.series) +
+                    list(self.plant.indicators.get(self.day, dict())))
+
+    def __len__(self):
+        return len(self.plant.series) + len(
+            self.plant.indicators.get(self.day, dict()))
+
+
+class CompareStore(dict):
+    """ Armazenamento colunar dos dados de comparacao: {planta: PlantStore}.
+        Cada serie de uma planta eh mantida em vetores NumPy (timestamps
+        int64 e valores float64, ou 'dtype') com indice por dia local, no
+        lugar dos dicionarios aninhados store[planta][dia][serie][tstamp].
+        A visao de dicionario antiga continua disponivel para leitura e
+        escrita, e dicionarios aninhados atribuidos sao convertidos.
+        'stats_version' identifica os parametros com que os indicadores
+        foram calculados pela ultima vez """
+
+    def __init__(self, dtype=np.float64):
+        super(CompareStore, self).__init__()
+        self.dtype = dtype
+        self.stats_version = None
+
+    def clear(self):
+        super(CompareStore, self).clear()
+        self.stats_version = None
+
+    def __setitem__(self, name, value):
+        if not isinstance(value, PlantStore):
+            plant = PlantStore(self.dtype)
+            for day, day_data in value.items():
+                plant[day] = day_data
+            value = plant
+        super(CompareStore, self).__setitem__(name, value)
+
+    def setdefault(self, name, default=None):
+        if name not in self:
+            self[name] = default if default is not None else dict()
+        return self[name]
+
+    def update(self, *args, **kwargs):
+        for name, value in dict(*args, **kwargs).items():
+            self[name] = value
+
+    def plant(self, name):
+        """ Retorna (criando) os dados de uma planta """
+        if name not in self:
+            self[name] = PlantStore(self.dtype)
+        return self[name]
+
+    def declare(self, name, series):
+        """ Declara as series de uma planta """
+        self.plant(name).declare(series)
+
+    def add_points(self, name, series, tstamps, values):
+        """ Acrescenta pontos a uma serie de uma planta """
+        self.plant(name).add_points(series, tstamps, values)
+
+    def has_series(self, name, series):
+        """ Verifica se a planta possui a serie declarada """
+        return name in self and series in self[name].series
+
+    def series(self, name, series):
+        """ Retorna (timestamps, valores) completos de uma serie """
+        cur_series = self[name].series[series]
+        cur_series.consolidate()
+        return cur_series.tstamps, cur_series.values
+
+    def columns(self, name, series):
+        """ Retorna (timestamps, valores, dias) completos de uma serie """
+        cur_series = self[name].series[series]
+        cur_series.consolidate()
+        return cur_series.tstamps, cur_series.values, cur_series.days
+
+    def day_counts(self, name, series):
+        """ Retorna {dia (ordinal): numero de pontos} de uma serie """
+        cur_series = self[name].series[series]
+        cur_series.consolidate()
+        days, counts = np.unique(cur_series.days, return_counts=True)
+        return dict(zip(days.tolist(), counts.tolist()))
+
+    def day_series(self, name, series, day):
+        """ Retorna (timestamps, valores) de uma serie em um dia """
+        return self[name].series[series].day_arrays(day)
+
+    def count(self, name, series, day):
+        """ Retorna o numero de pontos de uma serie em um dia """
+        ini, end = self[name].series[series].day_bounds(day)
+        return end - ini
+
+    def days(self, name):
+        """ Retorna os dias de uma planta em ordem cronologica """
+        return sorted(self[name].days())
+
+    def dirty_days(self, name, series):
+        """ Retorna os dias (ordinais) em que a serie recebeu pontos
+            desde o ultimo clear_dirty """
+        return self[name].series[series].dirty_days()
+
+    def clear_dirty(self):
+        """ Marca todas as series como processadas """
+        for plant in self.values():
+            for series in plant.series.values():
+                series.clear_dirty()
+
+    def indicators(self, name, day):
+        """ Retorna (criando) o dicionario de indicadores de um dia """
+        return self.plant(name).day_indicators(day)
+
+
+def missing_days(store, names, metrics, first_day, last_day):
+    """ Retorna os dias entre first_day e last_day em que alguma das series
+        'metrics' ja conhecidas das plantas 'names' de um CompareStore nao
+        possui dados completos: ao menos um ponto por hora do dia local
+        (23 ou 25 horas nos dias de mudanca do horario de verao). Series
+        que nunca apresentaram dados para uma planta sao ignoradas, e
+        plantas sem nenhuma serie conhecida tem todos os dias incompletos """
+    ordinals = np.arange(first_day.toordinal(), last_day.toordinal() + 1)
+    expected = LOCAL_TABLE.day_hours(ordinals)
+    complete = np.ones(len(ordinals), dtype=bool)
+    for name in names:
+        known = [metric for metric in metrics
+                 if store.has_series(name, metric) and
+                 len(store.series(name, metric)[0])]
+        if not known:
+            complete[:] = False
+        for metric in known:
+            counts = store.day_counts(name, metric)
+            complete &= np.array([counts.get(ordinal, 0)
+                                  for ordinal in ordinals.tolist()],
+                                 dtype=np.int64) >= expected
+    return [date.fromordinal(ordinal)
+            for ordinal in ordinals[~complete].tolist()]
@@ -10,6 +10,8 @@ from datetime import datetime, timedelta
 import getpass
 import os
 import dessemstats.compare_dessem_sagic as compare
+from dessemstats.columnar import require_pyarrow
+from dessemstats.csvwriter import require_compression
 
 locale.setlocale(locale.LC_ALL, ('pt_BR.UTF-8'))
 
@@ -50,9 +52,30 @@ QUERY_PLD = True
 QUERY_LOAD = True
 QUERY_WIND = True
 FORCE_PROCESS = True
+# consulta apenas os dias ainda sem dados completos em TMP_FOLDER/results/:
+INCREMENTAL = False
+# retoma uma execucao interrompida, sem consultar as unidades concluidas:
+RESUME = False
+# processa e grava as saidas planta a planta (memoria limitada):
+STREAMING = False
 NORMALIZE = True
+# processos para o calculo dos indicadores (1: sem paralelismo):
+STATS_WORKERS = 1
 OUTPUT_XLS = True
 OUTPUT_CSV = True
+# compressao dos arquivos CSV (None, 'gzip' ou 'zstd'):
+CSV_COMPRESSION = None
+# grava tambem as series e os indicadores em Parquet (requer pyarrow):
+OUTPUT_PARQUET = False
+# banco de resultados (SQLite) atualizado a cada execucao (None: desativado):
+OUTPUT_DATABASE = None
+# processos para a gravacao dos arquivos das plantas (1: sem paralelismo):
+OUTPUT_WORKERS = 1
+# dependencias opcionais verificadas antes de qualquer acesso a rede
+# (pip install dessemstats[parquet,zstd]):
+require_compression(CSV_COMPRESSION)
+if OUTPUT_PARQUET:
+    require_pyarrow()
 STORAGE_FOLDER = os.getenv('HOME') + '/tmp/edp/'
 if not os.path.exists(STORAGE_FOLDER):
     os.makedirs(STORAGE_FOLDER)
@@ -87,9 +110,17 @@ PARAMS = {'ini_date': INI_DATE,
           'query_load': QUERY_LOAD,
           'query_wind': QUERY_WIND,
           'force_process': FORCE_PROCESS,
+          'incremental': INCREMENTAL,
+          'resume': RESUME,
+          'streaming': STREAMING,
           'normalize': NORMALIZE,
+          'stats_workers': STATS_WORKERS,
           'output_xls': OUTPUT_XLS,
           'output_csv': OUTPUT_CSV,
+          'csv_compression': CSV_COMPRESSION,
+          'output_parquet': OUTPUT_PARQUET,
+          'output_database': OUTPUT_DATABASE,
+          'output_workers': OUTPUT_WORKERS,
           'storage_folder': STORAGE_FOLDER,
           'tmp_folder': TMP_FOLDER}
 
@@ -28,13 +28,16 @@ QUERY_GEN = True
 QUERY_PLD = True
 QUERY_LOAD = True
 QUERY_WIND = True
-FORCE_PROCESS = True
+# resultados armazenados sao separados por provedor do deck e rede:
+FORCE_PROCESS = False
 NORMALIZE = True
 OUTPUT_XLS = False
 OUTPUT_CSV = True
 STORAGE_FOLDER = os.getenv('HOME') + '/tmp/edp/'
 if not os.path.exists(STORAGE_FOLDER):
     os.makedirs(STORAGE_FOLDER)
+# banco de resultados (SQLite) atualizado a cada execucao:
+OUTPUT_DATABASE = STORAGE_FOLDER + 'dessemstats.sqlite'
 TMP_FOLDER = '/tmp/edp/'
 if not os.path.exists(TMP_FOLDER):
     os.makedirs(TMP_FOLDER)
@@ -65,6 +68,7 @@ PARAMS = {'ini_date': INI_DATE,
           'normalize': NORMALIZE,
           'output_xls': OUTPUT_XLS,
           'output_csv': OUTPUT_CSV,
+          'output_database': OUTPUT_DATABASE,
           'storage_folder': STORAGE_FOLDER,
           'tmp_folder': TMP_FOLDER}
 
@@ -77,5 +81,5 @@ PARAMS['query_load'] = False
 PARAMS['query_wind'] = False
 PARAMS['deck_provider'] = 'ccee'
 PARAMS['network'] = 'sem_rede'
-compare.DADOS_COMPARE = dict()
+compare.DADOS_COMPARE.clear()
 compare.wrapup_compare(params=PARAMS)
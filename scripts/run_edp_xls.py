@@ -28,7 +28,8 @@ QUERY_GEN = True
 QUERY_PLD = True
 QUERY_LOAD = True
 QUERY_WIND = True
-FORCE_PROCESS = True
+# resultados armazenados sao separados por provedor do deck e rede:
+FORCE_PROCESS = False
 NORMALIZE = True
 OUTPUT_XLS = True
 OUTPUT_CSV = False
@@ -78,5 +79,5 @@ PARAMS['query_load'] = False
 PARAMS['query_wind'] = False
 PARAMS['deck_provider'] = 'ccee'
 PARAMS['network'] = 'sem_rede'
-compare.DADOS_COMPARE = dict()
+compare.DADOS_COMPARE.clear()
 compare.wrapup_compare(params=PARAMS)
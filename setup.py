@@ -36,7 +36,6 @@ __classifiers__ = [
 __license__ = 'Proprietary'
 __public_dependencies__ = ['numpy',
                            'python-dateutil',
-                           'joblib',
                            'pytz',
                            'barrel_client',
                            'deckparser',
@@ -48,6 +47,8 @@ __public_dependency_links__ = [
     '#egg=barrel_client'),
     'git+https://github.com/venidera/deckparser.git#egg=deckparser',
     'git+https://github.com/venidera/vplantnaming.git#egg=vplantnaming']
+__extra_dependencies__ = {'parquet': ['pyarrow'],
+                          'zstd': ['zstandard']}
 __private_dependencies__ = []
 
 
@@ -132,6 +133,7 @@ setup(
         'requests',
         'setuptools-lint'
     ] + __public_dependencies__,
+    extras_require=__extra_dependencies__,
     classifiers=__classifiers__,
     cmdclass={
         'pylint': PylintCommand,
@@ -0,0 +1,90 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+import unittest
+import os
+import tempfile
+import shutil
+from datetime import date
+from dessemstats.cache import MonthCache, Checkpoint, extract, merge
+
+class TestMonthCache(unittest.TestCase):
+    """ Testes do cache de series por mes """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_closed_month(self):
+        """ apenas meses anteriores ao mes passado estao encerrados """
+        today = date(2020, 3, 10)
+        self.assertTrue(MonthCache.is_closed(date(2020, 1, 31), today))
+        self.assertFalse(MonthCache.is_closed(date(2020, 2, 1), today))
+        self.assertFalse(MonthCache.is_closed(date(2020, 3, 1), today))
+
+    def test_extract_merge(self):
+        """ extract e merge preservam as series e os pontos existentes """
+        store = {'A': {date(2020, 1, 1): {'dessem': {1: 1.0},
+                                          'desvio_x': 0.5},
+                       date(2020, 2, 1): {'dessem': {2: 2.0}}}}
+        data = extract(store, ['A', 'B'], ['dessem'],
+                       date(2020, 1, 1), date(2020, 1, 31))
+        self.assertEqual(data, {'A': {date(2020, 1, 1): {'dessem': {1: 1.0}}}})
+        target = {'A': {date(2020, 1, 1): {'dessem': {1: 9.0}}}}
+        merge(target, {'A': {date(2020, 1, 1): {'dessem': {1: 1.0, 3: 3.0}}}})
+        self.assertEqual(target['A'][date(2020, 1, 1)]['dessem'],
+                         {1: 9.0, 3: 3.0})
+
+    def test_immutable_entry(self):
+        """ entradas de meses encerrados nao expiram """
+        cache = MonthCache(self.folder, ttl=-1)
+        cache.save(date(2000, 1, 1), 'uhe_A', {'A': {}})
+        self.assertEqual(cache.load(date(2000, 1, 1), 'uhe_A'), {'A': {}})
+        cache.save(date.today(), 'uhe_A', {'A': {}})
+        self.assertIsNone(cache.load(date.today(), 'uhe_A'))
+
+    def test_discard(self):
+        """ entradas removidas deixam de ser carregadas e a pasta do mes eh
+            removida junto com a ultima entrada """
+        cache = MonthCache(self.folder)
+        cache.save(date(2000, 1, 1), 'uhe_A', {'A': {}})
+        cache.save(date(2000, 1, 1), 'uhe_B', {'B': {}})
+        cache.discard(date(2000, 1, 1), 'uhe_A')
+        cache.discard(date(2000, 1, 1), 'uhe_C')
+        self.assertIsNone(cache.load(date(2000, 1, 1), 'uhe_A'))
+        self.assertEqual(cache.load(date(2000, 1, 1), 'uhe_B'), {'B': {}})
+        cache.discard(date(2000, 1, 1), 'uhe_B')
+        self.assertEqual(os.listdir(self.folder), list())
+
+    def test_checkpoint(self):
+        """ unidades concluidas (mesmo sem dados) sobrevivem a uma nova
+            execucao apenas no modo 'resume' """
+        checkpoint = Checkpoint(self.folder + '/run')
+        checkpoint.save(date(2020, 1, 1), 'uhe_P.AFONSO 4', {})
+        checkpoint = Checkpoint(self.folder + '/run', resume=True)
+        self.assertEqual(checkpoint.load(date(2020, 1, 1), 'uhe_P.AFONSO 4'),
+                         {})
+        self.assertIsNone(checkpoint.load(date(2020, 2, 1), 'uhe_P.AFONSO 4'))
+        checkpoint = Checkpoint(self.folder + '/run')
+        self.assertIsNone(checkpoint.load(date(2020, 1, 1), 'uhe_P.AFONSO 4'))
+
+    def test_checkpoint_status(self):
+        """ unidades sem dados sao concluidas e unidades com falha sao
+            consultadas novamente ao retomar a execucao """
+        checkpoint = Checkpoint(self.folder + '/run')
+        checkpoint.save(date(2020, 1, 1), 'uhe_A', {})
+        checkpoint.save(date(2020, 1, 1), 'uhe_B', {'B': {}})
+        checkpoint.fail(date(2020, 1, 1), 'uhe_C')
+        checkpoint = Checkpoint(self.folder + '/run', resume=True)
+        self.assertEqual([checkpoint.status(date(2020, 1, 1), key)
+                          for key in ['uhe_A', 'uhe_B', 'uhe_C', 'uhe_D']],
+                         ['empty', 'done', 'failed', None])
+        self.assertIsNone(checkpoint.load(date(2020, 1, 1), 'uhe_C'))
+        self.assertEqual(checkpoint.failed(), ['2020_01_uhe_C.pickle'])
+        checkpoint.save(date(2020, 1, 1), 'uhe_C', {'C': {}})
+        self.assertEqual(checkpoint.failed(), [])
@@ -0,0 +1,160 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+import unittest
+import tempfile
+import shutil
+from fnmatch import fnmatch
+from dessemstats.catalog import TimeseriesCatalog, TimeseriesIndex
+
+PATTERN = 'ts_ons_geracao_horaria_verificada_*'
+SERIES = [{'name': 'ts_ons_geracao_horaria_verificada_a', 'tsid': '1'},
+          {'name': 'ts_ons_geracao_horaria_verificada_b', 'tsid': '2'}]
+MISSING = 'ts_ons_geracao_horaria_verificada_c'
+
+
+class StubConnection(object):
+    """ Conexao simulada com o Miran: lista as series que casam com o nome
+        (ou padrao) e registra as consultas """
+    def __init__(self, tseries):
+        self.tseries = list(tseries)
+        self.queries = list()
+
+    def get_timeseries(self, params):
+        """ equivalente a con.get_timeseries(params={'name': ...}) """
+        self.queries.append(params['name'])
+        return [tsobj for tsobj in self.tseries
+                if fnmatch(tsobj['name'], params['name'])]
+
+
+class TestTimeseriesIndex(unittest.TestCase):
+    """ Testes do indice local de series temporais """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.con = StubConnection(SERIES)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def catalog(self, ttl=3600):
+        """ catalogo persistente na pasta temporaria """
+        return TimeseriesCatalog(self.folder + '/catalog.sqlite', ttl)
+
+    def test_single_listing(self):
+        """ o padrao eh listado uma unica vez e as consultas seguintes,
+            inclusive de series inexistentes, sao locais """
+        index = TimeseriesIndex(self.con)
+        self.assertEqual(index.get_timeseries(SERIES[0]['name'], PATTERN),
+                         [SERIES[0]])
+        self.assertEqual(index.get_timeseries(SERIES[1]['name'], PATTERN),
+                         [SERIES[1]])
+        self.assertEqual(index.get_timeseries(MISSING, PATTERN), list())
+        self.assertEqual(self.con.queries, [PATTERN])
+
+    def test_negative_lookup(self):
+        """ a ausencia de uma serie na listagem eh registrada e reutilizada
+            por execucoes seguintes sem acesso a rede """
+        index = TimeseriesIndex(self.con, self.catalog())
+        self.assertEqual(index.get_timeseries(MISSING, PATTERN), list())
+        index = TimeseriesIndex(self.con, self.catalog())
+        self.assertEqual(index.get_timeseries(MISSING, PATTERN), list())
+        self.assertEqual(index.get_timeseries(SERIES[1]['name'], PATTERN),
+                         [SERIES[1]])
+        self.assertEqual(self.con.queries, [PATTERN])
+
+    def test_stale_listing(self):
+        """ uma serie ausente de uma listagem do catalogo (sem consulta
+            negativa) eh consultada individualmente """
+        TimeseriesIndex(self.con, self.catalog()).load(PATTERN)
+        self.con.tseries.append({'name': MISSING, 'tsid': '3'})
+        index = TimeseriesIndex(self.con, self.catalog())
+        self.assertEqual(index.get_timeseries(MISSING, PATTERN),
+                         [{'name': MISSING, 'tsid': '3'}])
+        self.assertEqual(index.get_timeseries(MISSING, PATTERN),
+                         [{'name': MISSING, 'tsid': '3'}])
+        self.assertEqual(self.con.queries, [PATTERN, MISSING])
+
+    def test_ttl_expiry(self):
+        """ listagens e consultas negativas expiradas sao refeitas no
+            Miran """
+        index = TimeseriesIndex(self.con, self.catalog(ttl=-1))
+        self.assertEqual(index.get_timeseries(MISSING, PATTERN), list())
+        self.con.tseries.append({'name': MISSING, 'tsid': '3'})
+        index = TimeseriesIndex(self.con, self.catalog(ttl=-1))
+        self.assertEqual(index.get_timeseries(MISSING, PATTERN),
+                         [{'name': MISSING, 'tsid': '3'}])
+        self.assertEqual(self.con.queries, [PATTERN, PATTERN])
+
+    def test_invalidate(self):
+        """ um tsid invalidado eh resolvido novamente, individualmente, e
+            removido do catalogo """
+        catalog = self.catalog()
+        index = TimeseriesIndex(self.con, catalog)
+        index.load(PATTERN)
+        self.con.tseries[0] = {'name': SERIES[0]['name'], 'tsid': '4'}
+        index.invalidate(SERIES[0]['name'])
+        self.assertEqual(index.get_timeseries(SERIES[0]['name'], PATTERN),
+                         [self.con.tseries[0]])
+        self.assertEqual(self.con.queries, [PATTERN, SERIES[0]['name']])
+        self.assertEqual(catalog.get_pattern(PATTERN),
+                         {SERIES[0]['name']: '4', SERIES[1]['name']: '2'})
+
+
+class TestTimeseriesCatalog(unittest.TestCase):
+    """ Testes do catalogo persistente (SQLite) de series temporais """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.filename = self.folder + '/catalog.sqlite'
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_persistence(self):
+        """ listagens e consultas negativas sobrevivem a reabertura do
+            arquivo """
+        catalog = TimeseriesCatalog(self.filename)
+        catalog.put_pattern(PATTERN, SERIES)
+        catalog.put_name(MISSING, PATTERN)
+        catalog.db.close()
+        catalog = TimeseriesCatalog(self.filename)
+        self.assertEqual(catalog.get_pattern(PATTERN),
+                         {SERIES[0]['name']: '1', SERIES[1]['name']: '2'})
+        self.assertTrue(catalog.is_missing(MISSING))
+        self.assertFalse(catalog.is_missing(SERIES[0]['name']))
+        self.assertIsNone(catalog.get_pattern('ts_ons_cmo_*'))
+
+    def test_replace_pattern(self):
+        """ uma nova listagem substitui a anterior, inclusive as consultas
+            negativas do padrao """
+        catalog = TimeseriesCatalog(self.filename)
+        catalog.put_pattern(PATTERN, SERIES)
+        catalog.put_name(MISSING, PATTERN)
+        catalog.put_pattern(PATTERN, SERIES[1:])
+        self.assertEqual(catalog.get_pattern(PATTERN),
+                         {SERIES[1]['name']: '2'})
+        self.assertFalse(catalog.is_missing(MISSING))
+
+    def test_ttl(self):
+        """ entradas mais antigas que 'ttl' sao ignoradas """
+        TimeseriesCatalog(self.filename).put_pattern(PATTERN, SERIES)
+        TimeseriesCatalog(self.filename).put_name(MISSING, PATTERN)
+        catalog = TimeseriesCatalog(self.filename, ttl=-1)
+        self.assertIsNone(catalog.get_pattern(PATTERN))
+        self.assertFalse(catalog.is_missing(MISSING))
+        catalog = TimeseriesCatalog(self.filename, ttl=3600)
+        self.assertEqual(len(catalog.get_pattern(PATTERN)), 2)
+        self.assertTrue(catalog.is_missing(MISSING))
+
+    def test_invalidate(self):
+        """ remove nomes e listagens de padroes """
+        catalog = TimeseriesCatalog(self.filename)
+        catalog.put_pattern(PATTERN, SERIES)
+        catalog.invalidate(name=SERIES[0]['name'])
+        self.assertEqual(catalog.get_pattern(PATTERN),
+                         {SERIES[1]['name']: '2'})
+        catalog.invalidate(pattern=PATTERN)
+        self.assertIsNone(catalog.get_pattern(PATTERN))
@@ -0,0 +1,157 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+import unittest
+import os
+import tempfile
+import shutil
+from datetime import datetime, date
+import pytz
+from dessemstats.columnar import pa, pq, export_series, export_indicators
+from dessemstats.columnar import export_deck_series, export_timeseries
+
+LOCAL_TIMEZONE = pytz.timezone('America/Sao_Paulo')
+KEYS = [('deck_provider', 'ons'), ('network', 'ccee')]
+
+
+def tstamp(*args):
+    """ timestamp local em ms """
+    return int(local(*args).timestamp() * 1000)
+
+
+def local(*args):
+    """ datetime no fuso local """
+    return LOCAL_TIMEZONE.localize(datetime(*args))
+
+
+@unittest.skipIf(pa is None, 'pyarrow not installed')
+class TestColumnar(unittest.TestCase):
+    """ Testes da exportacao em Parquet """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_series(self):
+        """ series unidas pelos instantes, com nulos, um arquivo por ano """
+        export_series(self.folder + '/series', KEYS + [('plant', 'A/B')], {
+            'dessem': ([tstamp(2019, 12, 31, 23), tstamp(2020, 1, 1)],
+                       [1.0, 2.0]),
+            'verificada': ([tstamp(2020, 1, 1)], [3.0])})
+        plant = self.folder + ('/series/deck_provider=ons/network=ccee/'
+                               'plant=A%2FB')
+        self.assertEqual(sorted(os.listdir(plant)), ['year=2019',
+                                                     'year=2020'])
+        table = pq.read_table(plant + '/year=2019/data.parquet')
+        self.assertEqual(table.column('dessem').to_pylist(), [1.0])
+        self.assertEqual(table.column('verificada').to_pylist(), [None])
+        table = pq.read_table(plant + '/year=2020/data.parquet')
+        self.assertEqual(table.column('verificada').to_pylist(), [3.0])
+        self.assertEqual(
+            table.column('datetime').cast(pa.int64()).to_pylist(),
+            [tstamp(2020, 1, 1)])
+
+    def test_indicators(self):
+        """ indicadores por dia, com '' como nulo e dias vazios omitidos """
+        export_indicators(self.folder + '/indicators', KEYS, {
+            date(2020, 1, 2): {'desvio': 0.5, 'erro': ''},
+            date(2020, 1, 1): {'desvio': 0.1},
+            date(2020, 1, 3): {}})
+        table = pq.read_table(self.folder + '/indicators/deck_provider=ons/'
+                              'network=ccee/data.parquet')
+        self.assertEqual(table.to_pydict(),
+                         {'date': [date(2020, 1, 1), date(2020, 1, 2)],
+                          'desvio': [0.1, 0.5], 'erro': [None, None]})
+
+    def test_deck_series(self):
+        """ series de cada deck (timestamps em segundos) com a coluna do
+            dia do deck """
+        export_deck_series(self.folder + '/dessem', KEYS, {
+            date(2020, 1, 1): {'dessem_gen': {tstamp(2020, 1, 1) // 1000: 1.0,
+                                              tstamp(2020, 1, 2) // 1000: 2.0},
+                               'desvio': 0.1},
+            date(2020, 1, 2): {'dessem_gen': {
+                tstamp(2020, 1, 2) // 1000: 4.0}}},
+            ['dessem_gen', 'dessem_vol'])
+        table = pq.read_table(self.folder + '/dessem/deck_provider=ons/'
+                              'network=ccee/year=2020/data.parquet')
+        self.assertEqual(table.column('deck').to_pylist(),
+                         [date(2020, 1, 1)] * 2 + [date(2020, 1, 2)])
+        self.assertEqual(
+            table.column('datetime').cast(pa.int64()).to_pylist(),
+            [tstamp(2020, 1, 1), tstamp(2020, 1, 2), tstamp(2020, 1, 2)])
+        self.assertEqual(table.column('dessem_gen').to_pylist(),
+                         [1.0, 2.0, 4.0])
+        self.assertEqual(table.column('dessem_vol').to_pylist(),
+                         [None] * 3)
+        export_deck_series(self.folder + '/dessem', KEYS, {
+            date(2020, 1, 2): {'dessem_gen': {
+                tstamp(2020, 1, 2) // 1000: 5.0}}}, ['dessem_gen'])
+        table = pq.read_table(self.folder + '/dessem/deck_provider=ons/'
+                              'network=ccee/year=2020/data.parquet')
+        self.assertEqual(table.column('dessem_gen').to_pylist(),
+                         [1.0, 2.0, 5.0])
+
+    def test_incremental(self):
+        """ execucoes de outros periodos sao preservadas no arquivo do ano
+            e no arquivo de indicadores """
+        keys = KEYS + [('plant', 'A')]
+        export_series(self.folder + '/series', keys, {
+            'dessem': ([tstamp(2020, 1, 1), tstamp(2020, 1, 2)],
+                       [1.0, 2.0])})
+        export_series(self.folder + '/series', keys, {
+            'dessem': ([tstamp(2020, 1, 2), tstamp(2020, 2, 1)], [3.0, 4.0]),
+            'verificada': ([tstamp(2020, 2, 1)], [5.0])})
+        table = pq.read_table(self.folder + '/series/deck_provider=ons/'
+                              'network=ccee/plant=A/year=2020/data.parquet')
+        self.assertEqual(
+            table.column('datetime').cast(pa.int64()).to_pylist(),
+            [tstamp(2020, 1, 1), tstamp(2020, 1, 2), tstamp(2020, 2, 1)])
+        self.assertEqual(table.column('dessem').to_pylist(), [1.0, 3.0, 4.0])
+        self.assertEqual(table.column('verificada').to_pylist(),
+                         [None, None, 5.0])
+        export_indicators(self.folder + '/indicators', KEYS, {
+            date(2020, 1, 1): {'desvio': 0.1, 'erro': 0.2}})
+        export_indicators(self.folder + '/indicators', KEYS, {
+            date(2020, 2, 1): {'desvio': 0.3}})
+        table = pq.read_table(self.folder + '/indicators/deck_provider=ons/'
+                              'network=ccee/data.parquet')
+        self.assertEqual(table.to_pydict(),
+                         {'date': [date(2020, 1, 1), date(2020, 2, 1)],
+                          'desvio': [0.1, 0.3], 'erro': [0.2, None]})
+
+    def test_timeseries(self):
+        """ conjunto {instante: {serie: valor}} com '' como nulo """
+        dtimes = [local(2020, 1, 1), local(2020, 1, 1, 1)]
+        export_timeseries(self.folder + '/pld',
+                          {dtimes[0]: {'se': 10.0, 's': ''},
+                           dtimes[1]: {'se': 20.0}}, dtimes, ['se', 's'])
+        table = pq.read_table(self.folder + '/pld/year=2020/data.parquet')
+        self.assertEqual(
+            table.column('datetime').cast(pa.int64()).to_pylist(),
+            [tstamp(2020, 1, 1), tstamp(2020, 1, 1, 1)])
+        self.assertEqual(table.column('se').to_pylist(), [10.0, 20.0])
+        self.assertEqual(table.column('s').to_pylist(), [None, None])
+
+    def test_timeseries_periods(self):
+        """ execucoes de periodos disjuntos sao preservadas, com um arquivo
+            por ano """
+        first = [local(2019, 12, 31, 23), local(2020, 1, 1)]
+        export_timeseries(self.folder + '/pld',
+                          {first[0]: {'se': 1.0}, first[1]: {'se': 2.0}},
+                          first, ['se'])
+        second = [local(2020, 3, 1)]
+        export_timeseries(self.folder + '/pld', {second[0]: {'se': 3.0}},
+                          second, ['se'])
+        table = pq.read_table(self.folder + '/pld/year=2019/data.parquet')
+        self.assertEqual(table.column('se').to_pylist(), [1.0])
+        table = pq.read_table(self.folder + '/pld/year=2020/data.parquet')
+        self.assertEqual(
+            table.column('datetime').cast(pa.int64()).to_pylist(),
+            [tstamp(2020, 1, 1), tstamp(2020, 3, 1)])
+        self.assertEqual(table.column('se').to_pylist(), [2.0, 3.0])
@@ -0,0 +1,278 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+import unittest
+from unittest import mock
+import os
+import sqlite3
+import tempfile
+import shutil
+from contextlib import closing
+from datetime import datetime, date
+from string import Template
+from time import mktime
+import pytz
+import dessemstats.compare_dessem_sagic as compare
+from dessemstats.catalog import TimeseriesIndex, VERIFIED_GEN_PATTERN
+from dessemstats.columnar import pa, pq
+from dessemstats.fetch import ConnectionPool
+
+PLANTS = {'uhe': {'by_cepelname': {'FURNAS': {'ons_sagic': ['furnas']}}},
+          'ute': {'by_cepelname': {'PECEM': {'ons_sagic': ['pecem']}}}}
+DECK_PREFIX = 'ts_ons_dessem_completo_'
+LOCAL_TIMEZONE = pytz.timezone('America/Sao_Paulo')
+QUERY_TEMPLATE = Template(
+    '{"intervals": {}, "consults": ['
+    '{"id": 1, "name": "${sagic_name}_programada"}, '
+    '{"id": 2, "name": "${sagic_name}_verificada"}, '
+    '{"id": 3, "name": "${sagic_name}_dessem_${yyyy_mm}"}]}')
+QUERY_CMO_TEMPLATE = Template(
+    '{"intervals": {}, "consults": [{"id": 1, "name": "cmo_${subsis}"}]}')
+
+
+def deck_names(prefix):
+    """ nomes das series de um deck diario (ver __return_ts_points) """
+    names = list()
+    for gen_type, plants in PLANTS.items():
+        gen_type = compare.GEN_TYPE[gen_type]
+        for d_name in plants['by_cepelname']:
+            names.append('%s_ger%s_%s_geracao_%s' % (prefix, gen_type[:4],
+                                                     d_name, gen_type))
+            names.append('%s_bal%s_%s_volini' % (prefix, gen_type[:4],
+                                                 d_name))
+    return names
+
+
+class FakeMiran(object):
+    """ Conexao simulada com o Miran: series deterministicas, de modo que
+        execucoes diferentes recebem os mesmos pontos. Registra as
+        consultas de pontos em 'queries' """
+    def __init__(self):
+        self.queries = list()
+
+    def is_logged(self):
+        """ equivalente a barrel_client.Connection.is_logged """
+        return True
+
+    def get_timeseries(self, params):
+        """ lista as series de um padrao '<prefixo do deck>_*' ou das
+            series de geracao verificada """
+        pattern = params['name']
+        if pattern == VERIFIED_GEN_PATTERN:
+            return [{'name': VERIFIED_GEN_PATTERN[:-1] + sagic_name,
+                     'tsid': sagic_name}
+                    for plants in PLANTS.values()
+                    for item in plants['by_cepelname'].values()
+                    for sagic_name in item['ons_sagic']]
+        if not pattern.startswith(DECK_PREFIX):
+            return list()
+        names = deck_names(pattern[:-len('_*')])
+        if not pattern.endswith('_*'):
+            names = [name for name in names if name == pattern]
+        return [{'name': name, 'tsid': name} for name in names]
+
+    def get_points(self, oid, params):
+        """ pontos do deck de um dia (timestamps em segundos): geracao
+            semi-horaria do inicio do dia ao inicio do dia seguinte e um
+            unico volume inicial """
+        self.queries.append(oid)
+        deck = datetime.strptime(oid[len(DECK_PREFIX):][:10], '%Y_%m_%d')
+        start = int(mktime(deck.timetuple()))
+        if oid.endswith('_volini'):
+            return {'timestamps': [start], 'values': [50.0]}
+        tstamps = [start + 1800 * k for k in range(49)]
+        return {'timestamps': tstamps,
+                'values': [float(len(oid) + deck.day + k % 5)
+                           for k in range(len(tstamps))]}
+
+
+    def consulta_miran_web(self, data):
+        """ resposta do Miran Web: cada grupo da consulta contem uma unica
+            serie, com o nome do grupo """
+        self.queries.append((data['intervals']['date_ini'],
+                             data['consults'][0]['name']))
+        return {'group': dict((str(grp['id']), {'timeseries': [grp['name']]})
+                              for grp in data['consults'])}
+
+    @staticmethod
+    def get_timeseries_sum(data):
+        """ soma horaria (timestamps em ms) das series do grupo entre os
+            instantes locais 'start' e 'end' """
+        start, end = [int(LOCAL_TIMEZONE.localize(datetime.fromisoformat(
+            data[key])).timestamp()) * 1000 for key in ['start', 'end']]
+        name = data['timeseries'][0]
+        return [{'timeseries_sum': [
+            [tstamp, float(len(name) % 7 + tstamp // 3600000 % 11)]
+            for tstamp in range(start, end + 1, 3600000)]}]
+
+
+class TestCompareRuns(unittest.TestCase):
+    """ Testes das execucoes completas (consulta, calculo e saidas) com uma
+        conexao simulada """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.miran = FakeMiran()
+        for name, method in [('connect_miran', self.connect_miran),
+                             ('load_files', self.load_files)]:
+            patcher = mock.patch.object(compare, name, method)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        compare.DADOS_COMPARE.clear()
+        compare.DADOS_DESSEM.clear()
+        shutil.rmtree(self.folder)
+
+    def connect_miran(self, params):
+        """ conexoes (e pool) com o Miran simulado """
+        params['con'] = self.miran
+        params['con_pool'] = ConnectionPool(lambda: self.miran, size=4)
+        params['ts_index'] = TimeseriesIndex(params['con_pool'])
+
+    @staticmethod
+    def load_files(params):
+        """ tabela de nomes das plantas simuladas e modelos de consulta """
+        params['dessem_sagic_name'] = PLANTS
+        params['query_template_str'] = QUERY_TEMPLATE
+        params['query_cmo_template_str'] = QUERY_CMO_TEMPLATE
+
+    def params(self, ini_date, end_date, name='run', folder=None):
+        """ parametros de uma execucao em 'folder' (por padrao, a pasta do
+            teste), com o banco de resultados <folder>/<name>.sqlite """
+        folder = folder or self.folder
+        return {'ini_date': datetime.combine(ini_date, datetime.min.time()),
+                'end_date': datetime.combine(end_date, datetime.min.time()),
+                'compare_plants': [],
+                'deck_provider': 'ons',
+                'network': 'com_rede',
+                'normalize': False,
+                'force_process': False,
+                'query_gen': True,
+                'query_cmo': True,
+                'query_pld': False,
+                'query_load': False,
+                'query_wind': False,
+                'max_concurrency': 4,
+                'output_xls': False,
+                'output_csv': False,
+                'output_database': '%s/%s.sqlite' % (folder, name),
+                'storage_folder': folder,
+                'tmp_folder': folder + '/tmp'}
+
+    def run_dessem(self, ini_date, end_date):
+        """ executa wrapup_ts_dessem em um novo processo (simulado) """
+        compare.DADOS_DESSEM.clear()
+        compare.wrapup_ts_dessem(self.params(ini_date, end_date))
+
+    def test_dessem_disjoint_ranges(self):
+        """ execucoes em intervalos disjuntos de um mesmo mes: os dias da
+            primeira execucao, carregados com o mes, nao entram nos
+            calculos nem nas saidas da segunda """
+        self.run_dessem(date(2020, 1, 1), date(2020, 1, 10))
+        first = set(self.dessem_days('desvio_dessem_gen'))
+        self.assertEqual(first, set(date(2020, 1, day)
+                                    for day in range(1, 10)))
+        del self.miran.queries[:]
+        self.run_dessem(date(2020, 1, 20), date(2020, 1, 31))
+        self.assertEqual(set(self.dessem_days('desvio_dessem_gen')) - first,
+                         set(date(2020, 1, day) for day in range(20, 31)))
+        # apenas os 12 dias novos sao consultados (2 plantas, 2 series)
+        self.assertEqual(len(self.miran.queries), 12 * 2 * 2)
+        # meses encerrados ficam apenas no armazenamento de resultados
+        self.assertEqual(self.month_cache_entries(), list())
+        with closing(sqlite3.connect(self.folder + '/run.sqlite')) as con:
+            decks = set(row[0] for row in con.execute(
+                'SELECT DISTINCT deck FROM deck_series'))
+        self.assertEqual(decks, set('2020-01-%02d' % day for day in list(
+            range(1, 11)) + list(range(20, 32))))
+
+    def run_compare(self, ini_date, end_date, folder=None, **options):
+        """ executa wrapup_compare em um novo processo (simulado), com
+            saidas em CSV, no banco de resultados e em Parquet (caso o
+            pyarrow esteja instalado) """
+        compare.DADOS_COMPARE.clear()
+        params = self.params(ini_date, end_date, folder=folder)
+        params.update(output_csv=True, output_parquet=pa is not None,
+                      **options)
+        compare.wrapup_compare(params)
+
+    def check_overlapping_runs(self, **options):
+        """ executa do_compare (modo incremental) em intervalos
+            sobrepostos com as opcoes de saida 'options' e compara as
+            saidas com as de execucoes unicas """
+        self.run_compare(date(2020, 1, 1), date(2020, 2, 15),
+                         incremental=True, **options)
+        del self.miran.queries[:]
+        self.run_compare(date(2020, 2, 1), date(2020, 3, 31),
+                         incremental=True, **options)
+        # fevereiro ja foi consultado (mes encerrado) na primeira execucao
+        self.assertTrue(self.miran.queries)
+        self.assertEqual(set(query[0][:7] for query in self.miran.queries),
+                         set(['2020-03']))
+        # arquivos CSV: os meses da segunda execucao
+        single = tempfile.mkdtemp(dir=self.folder)
+        self.run_compare(date(2020, 2, 1), date(2020, 3, 31), single)
+        files = sorted(name for name in os.listdir(single)
+                       if name.endswith('.csv'))
+        self.assertEqual(files, ['cmo_ons_com_rede.csv', 'furnas.csv',
+                                 'furnas_indicadores.csv', 'pecem.csv',
+                                 'pecem_indicadores.csv'])
+        for name in files:
+            with open('%s/%s' % (self.folder, name)) as handle, \
+                    open('%s/%s' % (single, name)) as expected:
+                self.assertEqual(handle.read(), expected.read(), name)
+        # banco de resultados e Parquet: a uniao das execucoes
+        full = tempfile.mkdtemp(dir=self.folder)
+        self.run_compare(date(2020, 1, 1), date(2020, 3, 31), full)
+        self.assertEqual(self.database_rows(self.folder),
+                         self.database_rows(full))
+        if pa is not None:
+            self.assertEqual(self.parquet_tables(self.folder),
+                             self.parquet_tables(full))
+
+    def test_compare_streaming(self):
+        """ execucoes sobrepostas em streaming (duas passagens) equivalem
+            a uma unica execucao """
+        self.check_overlapping_runs(streaming=True, max_concurrency=2)
+
+    def test_compare_parallel_outputs(self):
+        """ execucoes sobrepostas com as saidas gravadas em processos
+            equivalem a uma unica execucao """
+        self.check_overlapping_runs(output_workers=2)
+
+    @staticmethod
+    def database_rows(folder):
+        """ linhas de todas as tabelas do banco de resultados """
+        with closing(sqlite3.connect(folder + '/run.sqlite')) as con:
+            return dict((table, sorted(con.execute(
+                'SELECT * FROM %s' % table))) for table, in con.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table'"))
+
+    @staticmethod
+    def parquet_tables(folder):
+        """ conteudo dos arquivos Parquet, por caminho relativo """
+        tables = dict()
+        for root, _, names in os.walk(folder + '/parquet'):
+            for name in names:
+                tables[os.path.relpath(root, folder)] = pq.read_table(
+                    os.path.join(root, name)).to_pydict()
+        return tables
+
+    def month_cache_entries(self):
+        """ entradas gravadas no cache de meses """
+        return [name for _, _, names in os.walk(self.folder + '/tmp/'
+                                                'month_cache')
+                for name in names]
+
+    def dessem_days(self, metric):
+        """ dias gravados no banco de resultados com o indicador 'metric'
+            da planta 'furnas' """
+        with closing(sqlite3.connect(self.folder + '/run.sqlite')) as con:
+            return [date.fromisoformat(row[0]) for row in con.execute(
+                """SELECT date FROM indicators WHERE source = 'dessem'
+                   AND plant = 'furnas' AND metric = ? AND value IS NOT NULL
+                   ORDER BY date""", (metric,))]
@@ -0,0 +1,60 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+import unittest
+import gzip
+import locale
+import tempfile
+import shutil
+from unittest import mock
+from dessemstats.csvwriter import CsvWriter, number_format
+from dessemstats.csvwriter import require_compression
+
+VALUES = [0.1, 1 / 3, -2.5, 1e20, 1e-7, 3, 0.0, float('nan')]
+
+
+class TestCsvWriter(unittest.TestCase):
+    """ Testes da escrita de arquivos CSV """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_number_format(self):
+        """ mesmo texto de locale.str, inclusive com virgula decimal """
+        self.assertEqual([number_format()(value) for value in VALUES],
+                         [locale.str(value) for value in VALUES])
+        conv = dict(locale.localeconv(), decimal_point=',')
+        with mock.patch('locale.localeconv', return_value=conv):
+            self.assertEqual([number_format()(value) for value in VALUES],
+                             [locale.str(value) for value in VALUES])
+
+    def test_rows(self):
+        """ linhas separadas por ';', em blocos, com ou sem compressao """
+        rows = [['2020-01-01', '1.5', ''], ['2020-01-02', '', '2']]
+        for compression in [None, 'gzip']:
+            with CsvWriter(self.folder + '/data.csv', compression,
+                           block_rows=1) as writer:
+                writer.writerow(['datetime', 'a', 'b'])
+                writer.writerows(rows)
+            opener = gzip.open if compression else open
+            with opener(writer.filename, 'rb') as handle:
+                self.assertEqual(handle.read(),
+                                 b'datetime;a;b\n2020-01-01;1.5;\n'
+                                 b'2020-01-02;;2\n')
+
+    def test_require_compression(self):
+        """ compressoes desconhecidas ou indisponiveis sao rejeitadas antes
+            da escrita """
+        require_compression(None)
+        require_compression('gzip')
+        with self.assertRaises(AssertionError):
+            require_compression('bz2')
+        with mock.patch('dessemstats.csvwriter.zstandard', None):
+            with self.assertRaises(AssertionError):
+                require_compression('zstd')
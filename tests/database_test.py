@@ -0,0 +1,89 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+import unittest
+import tempfile
+import shutil
+from datetime import datetime, date
+import pytz
+from dessemstats.database import connect, upsert_series, upsert_indicators
+from dessemstats.database import upsert_deck_series, upsert_timeseries
+from dessemstats.database import plant_series
+
+LOCAL_TIMEZONE = pytz.timezone('America/Sao_Paulo')
+KEYS = ('ons', 'com_rede')
+
+
+def tstamp(*args):
+    """ timestamp local em ms """
+    return int(LOCAL_TIMEZONE.localize(datetime(*args)).timestamp() * 1000)
+
+
+class TestDatabase(unittest.TestCase):
+    """ Testes do banco de resultados """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.con = connect(self.folder + '/results.sqlite')
+
+    def tearDown(self):
+        self.con.close()
+        shutil.rmtree(self.folder)
+
+    def test_series_upsert(self):
+        """ execucoes incrementais atualizam os pontos existentes """
+        upsert_series(self.con, 'compare', KEYS, 'A', {
+            'dessem': ([tstamp(2020, 1, 1), tstamp(2020, 2, 1)],
+                       [1.0, 2.0])})
+        upsert_series(self.con, 'compare', KEYS, 'A', {
+            'dessem': ([tstamp(2020, 2, 1), tstamp(2020, 2, 2)],
+                       [3.0, float('nan')])})
+        self.assertEqual(
+            plant_series(self.con, 'compare', KEYS, 'A', tstamp(2020, 2, 1),
+                         tstamp(2020, 3, 1)),
+            {'dessem': ([tstamp(2020, 2, 1), tstamp(2020, 2, 2)],
+                        [3.0, None])})
+        plan = ' '.join(row[-1] for row in self.con.execute(
+            """EXPLAIN QUERY PLAN SELECT * FROM series WHERE source = ?
+               AND deck_provider = ? AND network = ? AND plant = ?
+               AND datetime >= ? AND datetime < ?""",
+            ('compare',) + KEYS + ('A', 0, 1)))
+        self.assertIn('PRIMARY KEY', plan)
+
+    def test_indicators(self):
+        """ indicadores por (planta, dia, indicador), com '' como nulo """
+        upsert_indicators(self.con, 'compare', KEYS, 'A', {
+            date(2020, 1, 1): {'desvio': 0.5, 'erro': ''}})
+        upsert_indicators(self.con, 'compare', KEYS, 'A', {
+            date(2020, 1, 1): {'desvio': 0.7}})
+        self.assertEqual(self.con.execute(
+            """SELECT date, metric, value FROM indicators
+               ORDER BY metric""").fetchall(),
+                         [('2020-01-01', 'desvio', 0.7),
+                          ('2020-01-01', 'erro', None)])
+
+    def test_deck_series(self):
+        """ series de cada deck, indexadas pelo dia do deck, com os
+            timestamps do DESSEM (em segundos) gravados em ms """
+        upsert_deck_series(self.con, KEYS, 'A', {
+            date(2020, 1, 1): {
+                'dessem_gen': {tstamp(2020, 1, 1) // 1000: 1.0},
+                'desvio': 0.1}}, ['dessem_gen', 'dessem_vol'])
+        self.assertEqual(self.con.execute(
+            'SELECT deck, datetime, series, value FROM deck_series'
+        ).fetchall(), [('2020-01-01', tstamp(2020, 1, 1), 'dessem_gen',
+                        1.0)])
+
+    def test_timeseries(self):
+        """ conjuntos {datetime: {serie: valor}} sem os valores ausentes """
+        dtimes = [LOCAL_TIMEZONE.localize(datetime(2020, 1, 1, hour))
+                  for hour in range(2)]
+        upsert_timeseries(self.con, 'pld', {dtimes[0]: {'se': 10.0},
+                                            dtimes[1]: {'se': ''}},
+                          dtimes, ['se'])
+        self.assertEqual(self.con.execute(
+            'SELECT name, series, datetime, value FROM timeseries'
+        ).fetchall(), [('pld', 'se', tstamp(2020, 1, 1), 10.0)])
@@ -0,0 +1,192 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+import unittest
+import tempfile
+import shutil
+from datetime import date
+from functools import partial
+from threading import Lock, Thread
+from time import sleep
+from dessemstats.cache import MonthCache
+from dessemstats.fetch import ConnectionPool, FetchEngine
+
+MONTH = date(2000, 1, 1)
+
+
+async def query(result):
+    """ consulta simulada com o resultado informado """
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+class StubConnection(object):
+    """ Conexao simulada com o Miran: registra o numero de chamadas
+        simultaneas e expira a sessao nas proximas stats['expire']
+        chamadas """
+    def __init__(self, stats):
+        self.stats = stats
+        self.logged = True
+
+    def is_logged(self):
+        """ equivalente a barrel_client.Connection.is_logged """
+        return self.logged
+
+    def logout(self):
+        """ equivalente a barrel_client.Connection.logout """
+        self.logged = False
+        self.stats['logouts'] += 1
+
+    def get_points(self, value, error=False):
+        """ consulta simulada, que falha (com a sessao valida) quando
+            solicitado """
+        with self.stats['lock']:
+            self.stats['active'] += 1
+            self.stats['peak'] = max(self.stats['peak'],
+                                     self.stats['active'])
+            expire = self.stats['expire'] > 0
+            self.stats['expire'] -= expire
+        sleep(0.01)
+        with self.stats['lock']:
+            self.stats['active'] -= 1
+        if expire:
+            self.logged = False
+            raise ConnectionError('session expired')
+        if error:
+            raise ValueError('invalid tsid')
+        return value
+
+
+class TestFetchEngine(unittest.TestCase):
+    """ Testes do motor de consultas """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.engine = FetchEngine(None, 2)
+
+    def tearDown(self):
+        self.engine.close()
+        shutil.rmtree(self.folder)
+
+    def test_failed_unit_not_cached(self):
+        """ apenas unidades em que todas as consultas tiveram sucesso sao
+            armazenadas no cache de meses """
+        cache = MonthCache(self.folder)
+        results = self.engine.run([
+            self.engine.group([query(True), query(True)], partial(
+                cache.save, MONTH, 'uhe_A', {'A': {}})),
+            self.engine.group([query(True), query(False)], partial(
+                cache.save, MONTH, 'uhe_B', {'B': {}})),
+            self.engine.group([query(ValueError('timeout'))], partial(
+                cache.save, MONTH, 'uhe_C', {'C': {}}))])
+        self.assertEqual(results, [True, False, False])
+        self.assertEqual(cache.load(MONTH, 'uhe_A'), {'A': {}})
+        self.assertIsNone(cache.load(MONTH, 'uhe_B'))
+        self.assertIsNone(cache.load(MONTH, 'uhe_C'))
+
+    def test_failed_unit_recorded(self):
+        """ unidades com falha sao registradas por 'on_fail' """
+        done, failed = list(), list()
+        self.engine.run([
+            self.engine.group([query(True)], partial(done.append, 'A'),
+                              partial(failed.append, 'A')),
+            self.engine.group([query(False)], partial(done.append, 'B'),
+                              partial(failed.append, 'B'))])
+        self.assertEqual((done, failed), (['A'], ['B']))
+
+    def test_shared_engine(self):
+        """ o mesmo motor executa varias passagens (modo streaming) """
+        for result in [True, False, True]:
+            self.assertEqual(self.engine.run([self.engine.group(
+                [query(result)])]), [result])
+
+
+class TestConnectionPool(unittest.TestCase):
+    """ Testes do pool de conexoes autenticadas """
+    def setUp(self):
+        self.stats = {'lock': Lock(), 'active': 0, 'peak': 0, 'logins': 0,
+                      'logouts': 0, 'expire': 0, 'fail_login': False}
+
+    def factory(self):
+        """ login simulado """
+        if self.stats['fail_login']:
+            raise ConnectionError('login failed')
+        self.stats['logins'] += 1
+        return StubConnection(self.stats)
+
+    def test_concurrency(self):
+        """ chamadas concorrentes usam no maximo 'size' conexoes, cada uma
+            exclusiva de uma chamada """
+        pool = ConnectionPool(self.factory, size=2)
+        results = list()
+        threads = [Thread(target=lambda value=value: results.append(
+            pool.get_points(value))) for value in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results), list(range(8)))
+        self.assertEqual(self.stats['peak'], 2)
+        self.assertEqual((pool.created, self.stats['logins']), (2, 2))
+        self.assertEqual(pool.idle.qsize(), 2)
+
+    def test_session_expired(self):
+        """ a chamada eh repetida uma vez em uma nova conexao quando a
+            sessao expira, e a conexao expirada eh descartada """
+        pool = ConnectionPool(self.factory, size=1)
+        self.stats['expire'] = 1
+        self.assertEqual(pool.get_points(1), 1)
+        self.assertEqual(self.stats['logins'], 2)
+        self.assertEqual(self.stats['logouts'], 1)
+        con, _ = pool.idle.get_nowait()
+        self.assertTrue(con.is_logged())
+
+    def test_stale_connection(self):
+        """ conexoes ociosas alem de 'keepalive' ou com a sessao expirada
+            sao encerradas antes de serem substituidas """
+        pool = ConnectionPool(self.factory, size=1, keepalive=0)
+        first = pool.acquire()
+        pool.release(first)
+        sleep(0.01)
+        second = pool.acquire()
+        self.assertIsNot(second, first)
+        self.assertFalse(first.is_logged())
+        second.logged = False
+        pool.release(second)
+        pool.keepalive = 300
+        third = pool.acquire()
+        self.assertIsNot(third, second)
+        self.assertEqual((self.stats['logins'], self.stats['logouts']),
+                         (3, 2))
+        self.assertEqual(pool.created, 1)
+
+    def test_call_error(self):
+        """ erros com a sessao valida sao propagados e a conexao volta ao
+            pool """
+        pool = ConnectionPool(self.factory, size=1)
+        with self.assertRaises(ValueError):
+            pool.get_points(1, error=True)
+        self.assertEqual(pool.get_points(2), 2)
+        self.assertEqual((pool.created, self.stats['logins']), (1, 1))
+
+    def test_login_error(self):
+        """ falhas de login liberam a vaga da conexao no pool """
+        pool = ConnectionPool(self.factory, size=1)
+        self.stats['fail_login'] = True
+        with self.assertRaises(ConnectionError):
+            pool.get_points(1)
+        self.assertEqual(pool.created, 0)
+        self.stats['fail_login'] = False
+        self.assertEqual(pool.get_points(1), 1)
+        # sessao expirada e novo login com falha
+        self.stats['expire'], self.stats['fail_login'] = 1, True
+        with self.assertRaises(ConnectionError):
+            pool.get_points(1)
+        self.assertEqual(pool.created, 0)
+        self.stats['fail_login'] = False
+        self.assertEqual(pool.get_points(2), 2)
+        self.assertEqual(pool.created, 1)
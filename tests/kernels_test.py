@@ -0,0 +1,71 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+import unittest
+import random
+import statistics
+from fractions import Fraction
+from math import inf, nextafter, sqrt
+import numpy as np
+from dessemstats.kernels import ExactMoments, segments, pair_statistics
+from dessemstats.kernels import sqrt_of_frac
+
+
+class TestKernels(unittest.TestCase):
+    """ Testes dos kernels vetorizados de estatisticas """
+    def setUp(self):
+        random.seed(0)
+        self.values = [random.choice([0.0, -1.5, random.random() * 1e4,
+                                      random.random() * 1e-3])
+                       for _ in range(240)]
+        self.days = np.repeat(np.arange(10), 24)
+
+    def test_exact_moments(self):
+        """ media e desvio padrao identicos aos do modulo statistics """
+        moments = ExactMoments(np.array(self.values), segments(self.days))
+        for seg in range(10):
+            chunk = self.values[seg * 24:(seg + 1) * 24]
+            self.assertEqual(moments.mean(seg), statistics.mean(chunk))
+            self.assertEqual(moments.stdev(seg), statistics.stdev(chunk))
+
+    def test_pair_statistics(self):
+        """ um termo por dia, com somas sequenciais """
+        i_values = np.array(self.values)
+        j_values = i_values[::-1].copy()
+        results = pair_statistics(i_values, j_values, self.days)
+        self.assertEqual([day for day, _ in results], list(range(10)))
+        terms = results[3][1]
+        diffs = (i_values - j_values)[72:96].tolist()
+        self.assertEqual(terms['num_values'], 24)
+        self.assertEqual(terms['sum_diffs'], sum(diffs))
+        self.assertEqual(terms['stdev_diffs'], statistics.stdev(diffs))
+
+    def test_extreme_exponents(self):
+        """ valores com expoentes muito distantes no mesmo segmento """
+        values = [1e300, -1e-300, 5e-324, 0.0, 3.0, -2.5e10]
+        moments = ExactMoments(np.array(values), np.array([0]))
+        self.assertEqual(moments.mean(0), statistics.mean(values))
+        self.assertEqual(moments.stdev(0), statistics.stdev(values))
+
+    def test_sqrt_of_frac(self):
+        """ raiz de uma fracao corretamente arredondada """
+        self.assertEqual(sqrt_of_frac(1, 4), 0.5)
+        self.assertEqual(sqrt_of_frac(2, 1), sqrt(2))
+        for num, den in [(10 ** 40 + 1, 3), (7, 10 ** 50), (2 ** 107, 1)]:
+            root = Fraction(sqrt_of_frac(num, den))
+            # a raiz exata fica entre os pontos medios dos floats vizinhos
+            below = (root + Fraction(nextafter(root, 0))) / 2
+            above = (root + Fraction(nextafter(root, inf))) / 2
+            self.assertLess(below ** 2, Fraction(num, den))
+            self.assertGreater(above ** 2, Fraction(num, den))
+
+    def test_short_days(self):
+        """ dias com menos de 3 pontos comuns sao ignorados """
+        results = pair_statistics(np.array([1.0, 2.0, 3.0, 4.0, 5.0]),
+                                  np.array([1.0, 1.0, 2.0, 2.0, 2.0]),
+                                  np.array([0, 0, 1, 1, 1]))
+        self.assertEqual([day for day, _ in results], [1])
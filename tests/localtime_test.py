@@ -0,0 +1,44 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+import unittest
+from datetime import datetime, date
+from dessemstats.localtime import LOCAL_TABLE, LOCAL_TIMEZONE
+
+
+class TestTransitionTable(unittest.TestCase):
+    """ Testes da conversao vetorizada para o horario local """
+    def setUp(self):
+        # horario de verao de 2018 (inicio em 04/11) e de 2019 (fim em 17/02)
+        start = int(datetime(2018, 11, 3, 20).timestamp()) * 1000
+        end = int(datetime(2019, 2, 17, 4).timestamp()) * 1000
+        self.tstamps = [tstamp + 1800000 * k
+                        for tstamp in (start, end) for k in range(24)]
+
+    def test_day_ordinals(self):
+        """ mesmo dia local de datetime.fromtimestamp """
+        self.assertEqual(
+            LOCAL_TABLE.day_ordinals(self.tstamps).tolist(),
+            [datetime.fromtimestamp(tstamp / 1000,
+                                    tz=LOCAL_TIMEZONE).toordinal()
+             for tstamp in self.tstamps])
+
+    def test_isoformat(self):
+        """ mesmo texto ISO 8601, com o offset vigente em cada ponto """
+        self.assertEqual(
+            LOCAL_TABLE.isoformat(self.tstamps),
+            [datetime.fromtimestamp(int(tstamp / 1000),
+                                    tz=LOCAL_TIMEZONE).isoformat()
+             for tstamp in self.tstamps])
+
+    def test_day_hours(self):
+        """ dias de 23 e 25 horas nas mudancas do horario de verao """
+        days = [date(2018, 11, 3), date(2018, 11, 4), date(2019, 2, 16),
+                date(2019, 2, 17)]
+        self.assertEqual(
+            LOCAL_TABLE.day_hours([day.toordinal() for day in days]).tolist(),
+            [24, 23, 25, 24])
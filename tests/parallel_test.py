@@ -0,0 +1,45 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+import unittest
+import os
+import tempfile
+import shutil
+import numpy as np
+from dessemstats.kernels import compare_terms
+from dessemstats.parallel import map_compare_terms, map_outputs
+
+
+class TestParallelStatistics(unittest.TestCase):
+    """ Testes do calculo de indicadores em processos """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_same_terms(self):
+        """ os processos calculam os mesmos termos do calculo serial """
+        rand = np.random.RandomState(0)
+        tstamps = np.arange(96, dtype=np.int64) * 3600000
+        days = np.repeat(np.arange(4), 24)
+        columns = dict()
+        for name in ['A', 'B']:
+            for series in ['x', 'y']:
+                columns[(name, series)] = (tstamps, rand.rand(96), days)
+        tasks = [(name, [(('x', 'y'), [1, 2])]) for name in ['A', 'B']]
+        results = map_compare_terms(columns, tasks, 2, self.folder)
+        for name, pair_results in results:
+            self.assertEqual(pair_results[0][1], compare_terms(
+                columns[(name, 'x')], columns[(name, 'y')], [1, 2]))
+        self.assertEqual(os.listdir(self.folder), [])
+
+    def test_outputs(self):
+        """ as tarefas de saida retornam na ordem em que foram pedidas """
+        files = ['%s/%d.txt' % (self.folder, k) for k in range(4)]
+        self.assertEqual(map_outputs(os.path.basename, files, 2),
+                         ['0.txt', '1.txt', '2.txt', '3.txt'])
@@ -0,0 +1,73 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+import unittest
+import tempfile
+import shutil
+from datetime import date
+from dessemstats.store import CompareStore
+from dessemstats.partitions import PartitionedStore, save_compare
+from dessemstats.partitions import load_compare, save_nested, load_nested
+from dessemstats.partitions import coverage_request, covered, add_coverage
+
+
+class TestPartitionedStore(unittest.TestCase):
+    """ Testes do armazenamento de resultados particionado """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_compare_store(self):
+        """ grava e le apenas os meses pedidos, sem regravar particoes """
+        store = CompareStore()
+        # 15/01/2020 e 15/02/2020, 12:00 (horario local)
+        store.add_points('A', 'dessem', [1579100400000, 1581778800000],
+                         [1.0, 2.0])
+        store.indicators('A', date(2020, 1, 15))['desvio'] = 0.5
+        results = PartitionedStore(self.folder)
+        self.assertEqual(save_compare(results, store), 2)
+        self.assertEqual(save_compare(results, store), 0)
+        store.add_points('A', 'dessem', [1581782400000], [3.0])
+        self.assertEqual(save_compare(results, store), 1)
+        loaded = CompareStore()
+        load_compare(PartitionedStore(self.folder), loaded,
+                     first=date(2020, 1, 1), last=date(2020, 1, 31))
+        self.assertEqual(list(loaded['A']), [date(2020, 1, 15)])
+        self.assertEqual(loaded['A'][date(2020, 1, 15)]['desvio'], 0.5)
+        self.assertEqual(loaded.dirty_days('A', 'dessem'), set())
+
+    def test_nested(self):
+        """ dicionarios aninhados sao preservados """
+        data = {'P': {date(2020, 1, 1): {'dessem_gen': {20: 1.0, 10: 2.0},
+                                         'dessem_vol': {},
+                                         'desvio_dessem_gen': 0.1}}}
+        save_nested(PartitionedStore(self.folder), data,
+                    ['dessem_gen', 'dessem_vol'])
+        loaded = dict()
+        load_nested(PartitionedStore(self.folder), loaded)
+        self.assertEqual(loaded, data)
+
+    def test_coverage(self):
+        """ subintervalos e subconjuntos de plantas de consultas registradas
+            sao atendidos; meses ainda abertos nao sao registrados """
+        results = PartitionedStore(self.folder)
+        today = date(2020, 6, 10)
+        add_coverage(results, coverage_request(
+            ['A', 'B'], date(2020, 1, 1), date(2020, 2, 29), ['gen']), today)
+        add_coverage(results, coverage_request(
+            ['A', 'B'], date(2020, 3, 1), date(2020, 6, 30), ['gen']), today)
+        self.assertEqual(len(results.meta['coverage']), 1)
+        self.assertTrue(covered(results, coverage_request(
+            ['A'], date(2020, 2, 1), date(2020, 4, 30), ['gen'])))
+        self.assertFalse(covered(results, coverage_request(
+            ['A'], date(2020, 2, 1), date(2020, 5, 1), ['gen'])))
+        self.assertFalse(covered(results, coverage_request(
+            None, date(2020, 2, 1), date(2020, 2, 2), ['gen'])))
+        self.assertFalse(covered(results, coverage_request(
+            ['A'], date(2020, 2, 1), date(2020, 2, 2), ['gen', 'cmo'])))
@@ -0,0 +1,96 @@
+"""
+Copyright(C) Venidera Research & Development, Inc - All Rights Reserved
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+Written by Marcos Leone Filho <marcos@venidera.com>
+"""
+
+import unittest
+import pickle
+from datetime import datetime, date
+import pytz
+from dessemstats.store import CompareStore, missing_days
+
+LOCAL_TIMEZONE = pytz.timezone('America/Sao_Paulo')
+
+
+def tstamp(*args):
+    """ timestamp local em ms """
+    return int(LOCAL_TIMEZONE.localize(datetime(*args)).timestamp() * 1000)
+
+
+class TestCompareStore(unittest.TestCase):
+    """ Testes do armazenamento colunar de comparacao """
+    def setUp(self):
+        self.store = CompareStore()
+        self.store.declare('A', ['programada', 'verificada', 'dessem'])
+        self.store.add_points('A', 'dessem',
+                              [tstamp(2020, 1, 2, 0), tstamp(2020, 1, 1, 23)],
+                              [2.0, 1.0])
+        self.store.add_points('A', 'dessem', [tstamp(2020, 1, 1, 23)], [9.0])
+
+    def test_dict_view(self):
+        """ a visao de dicionario agrupa os pontos por dia local """
+        self.assertEqual(list(self.store['A']),
+                         [date(2020, 1, 1), date(2020, 1, 2)])
+        day = self.store['A'][date(2020, 1, 1)]
+        self.assertEqual(sorted(day), ['dessem', 'programada', 'verificada'])
+        self.assertEqual(dict(day['dessem']), {tstamp(2020, 1, 1, 23): 1.0})
+        self.assertEqual(len(day['programada']), 0)
+        self.assertEqual(self.store.count('A', 'dessem', date(2020, 1, 2)), 1)
+
+    def test_indicators(self):
+        """ indicadores sao mantidos por dia, ao lado das series """
+        self.store.indicators('A', date(2020, 1, 1))['desvio'] = 0.5
+        self.assertEqual(self.store['A'][date(2020, 1, 1)]['desvio'], 0.5)
+        self.assertNotIn('desvio', self.store['A'][date(2020, 1, 2)])
+
+    def test_nested_dict(self):
+        """ dicionarios aninhados (formato antigo) sao convertidos """
+        store = CompareStore()
+        store['B'] = {date(2020, 1, 1): {'dessem': {tstamp(2020, 1, 1): 3.0},
+                                         'desvio': 0.1}}
+        self.assertEqual(store['B'][date(2020, 1, 1)]['desvio'], 0.1)
+        self.assertEqual(store.series('B', 'dessem')[1].tolist(), [3.0])
+        loaded = pickle.loads(pickle.dumps(store))
+        self.assertEqual(list(loaded['B']), [date(2020, 1, 1)])
+
+    def test_dirty_days(self):
+        """ apenas dias com pontos novos sao marcados como alterados """
+        day = date(2020, 1, 1).toordinal()
+        self.assertEqual(self.store.dirty_days('A', 'dessem'),
+                         {day, day + 1})
+        self.store.clear_dirty()
+        self.store.add_points('A', 'dessem', [tstamp(2020, 1, 1, 23)], [5.0])
+        self.assertEqual(self.store.dirty_days('A', 'dessem'), set())
+        self.store.add_points('A', 'dessem', [tstamp(2020, 1, 2, 1)], [5.0])
+        self.assertEqual(self.store.dirty_days('A', 'dessem'), {day + 1})
+
+
+class TestMissingDays(unittest.TestCase):
+    """ Testes da selecao dos dias incompletos do modo incremental """
+    def setUp(self):
+        self.store = CompareStore()
+        self.store.declare('A', ['programada', 'verificada', 'dessem'])
+        # 03/11/2018 completo, 04/11/2018 (23 horas) completo e
+        # 05/11/2018 com 23 dos 24 pontos
+        for day, hours in [(3, range(24)), (4, range(1, 24)),
+                           (5, range(23))]:
+            self.store.add_points('A', 'dessem',
+                                  [tstamp(2018, 11, day, hour)
+                                   for hour in hours], [1.0] * len(hours))
+
+    def test_expected_points(self):
+        """ o numero de pontos esperado eh o numero de horas do dia local,
+            e series sem nenhum ponto sao ignoradas """
+        self.assertEqual(
+            missing_days(self.store, ['A'], ['programada', 'dessem'],
+                         date(2018, 11, 3), date(2018, 11, 6)),
+            [date(2018, 11, 5), date(2018, 11, 6)])
+
+    def test_unknown_plant(self):
+        """ plantas sem series conhecidas tem todos os dias incompletos """
+        self.assertEqual(
+            missing_days(self.store, ['A', 'B'], ['dessem'],
+                         date(2018, 11, 3), date(2018, 11, 4)),
+            [date(2018, 11, 3), date(2018, 11, 4)])